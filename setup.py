@@ -22,7 +22,8 @@ setup(
             'grib2nc=weather_forecast_retrieval.grib2nc:main',
             'get_hrrr_archive=weather_forecast_retrieval.hrrr_archive:cli',
             'hrrr_preprocessor=weather_forecast_retrieval.hrrr_preprocessor:cli',
-            'hrrr_nomads=weather_forecast_retrieval.hrrr_nomads:cli'
+            'hrrr_nomads=weather_forecast_retrieval.hrrr_nomads:cli',
+            'hrrr_reference_index=weather_forecast_retrieval.data.hrrr.reference_index:cli',
         ]},
     include_package_data=True,
     install_requires=requirements,
@@ -1,7 +1,11 @@
 import logging
+import shutil
 import unittest
+from multiprocessing.pool import ThreadPool
 
 import mock
+import numpy as np
+import pandas as pd
 import xarray
 
 import tests.helpers
@@ -50,7 +54,7 @@ def saved_data_return_values():
     return metadata, dataframe
 
 
-@mock.patch.object(FileLoader, 'get_data')
+@mock.patch.object(FileLoader, 'get_data', return_value=('data', 'sources'))
 @mock.patch.object(
     FileLoader,
     'convert_to_dataframes',
@@ -67,37 +71,50 @@ class TestFileLoaderGetSavedData(RMETestCase):
             file_dir='path', config=tests.helpers.LOG_ERROR_CONFIG
         )
 
-    def test_parameters(self, _data_patch, _df_patch):
+    def test_parameters_not_stored(self, _df_patch, _data_patch):
         self.subject.get_saved_data(*self.METHOD_ARGS)
 
-        self.assertEqual(self.START_DATE, self.subject.start_date)
-        self.assertEqual(self.END_DATE, self.subject.end_date)
-        self.assertEqual(self.BBOX, self.subject.file_loader.bbox)
+        self.assertIsNone(self.subject.start_date)
+        self.assertIsNone(self.subject.end_date)
+        self.assertIsNone(self.subject.file_loader.bbox)
 
-    def test_call_get_data(self, data_patch, _df_patch):
+    def test_call_get_data(self, _df_patch, data_patch):
         self.subject.get_saved_data(*self.METHOD_ARGS)
 
-        data_patch.assert_called_once_with(GribFile.VAR_MAP)
+        data_patch.assert_called_once_with(
+            GribFile.VAR_MAP, *self.METHOD_ARGS
+        )
 
-    def test_call_get_data_for_specific_keys(self, data_patch, _df_patch):
+    def test_call_get_data_for_specific_keys(self, _df_patch, data_patch):
         var_key = 'air_temp'
         self.subject.get_saved_data(*self.METHOD_ARGS, var_keys=[var_key])
 
         data_patch.assert_called_once_with(
-            {var_key: GribFile.VAR_MAP[var_key]}
+            {var_key: GribFile.VAR_MAP[var_key]}, *self.METHOD_ARGS
         )
 
-    def test_converts_df(self, _data_patch, df_patch):
-        self.subject.get_saved_data(*self.METHOD_ARGS)
+    def test_converts_df(self, df_patch, _data_patch):
+        self.subject.get_saved_data(
+            *self.METHOD_ARGS, force_zone_number=self.UTM_ZONE_NUMBER
+        )
 
-        df_patch.assert_called_once_with(GribFile.VAR_MAP)
+        df_patch.assert_called_once_with(
+            'data', GribFile.VAR_MAP, self.UTM_ZONE_NUMBER
+        )
 
-    def test_returns_metadata_and_df(self, _data_patch, _df_patch):
+    def test_returns_metadata_and_df(self, _df_patch, _data_patch):
         metadata, dataframe = self.subject.get_saved_data(*self.METHOD_ARGS)
 
         self.assertEqual('metadata', metadata.name)
         self.assertEqual('dataframe', dataframe.name)
 
+    def test_returns_sources(self, _df_patch, _data_patch):
+        *_, sources = self.subject.get_saved_data(
+            *self.METHOD_ARGS, return_sources=True
+        )
+
+        self.assertEqual('sources', sources)
+
 
 class TestFileLoaderGetData(RMETestCase):
     def setUp(self):
@@ -111,15 +128,20 @@ class TestFileLoaderGetData(RMETestCase):
             file_dir=RMETestCase.hrrr_dir.as_posix(),
             config=tests.helpers.LOG_ERROR_CONFIG
         )
-        subject.start_date = RMETestCase.START_DATE
-        subject.end_date = RMETestCase.END_DATE
+        self.start_date = RMETestCase.START_DATE
+        self.end_date = RMETestCase.END_DATE
 
         self.subject = subject
         self.subject.log.setLevel(logging.ERROR)
         self.subject._file_loader = file_loader
 
+    def get_data(self, var_map):
+        return self.subject.get_data(
+            var_map, self.start_date, self.end_date, self.BBOX
+        )
+
     def test_call_to_load(self):
-        self.subject.get_data({})
+        self.get_data({})
 
         self.assertEqual(
             6,
@@ -136,15 +158,19 @@ class TestFileLoaderGetData(RMETestCase):
             self.subject.file_loader.load.call_args.args[1],
             msg='Var map not passed to file loader'
         )
+        self.assertEqual(
+            self.BBOX,
+            self.subject.file_loader.load.call_args.kwargs['bbox'],
+            msg='Bounding box not passed to file loader'
+        )
 
     def test_tries_six_forecast_hours(self):
         self.subject.file_loader.load.side_effect = Exception('Data error')
         with mock.patch('os.path.exists', return_value=True):
-            self.subject.end_date = \
-                self.subject.end_date - 5 * FileLoader.NEXT_HOUR
+            self.end_date = self.end_date - 5 * FileLoader.NEXT_HOUR
 
             with self.assertRaisesRegex(IOError, 'Not able to find good file'):
-                self.subject.get_data({})
+                self.get_data({})
 
             self.assertEqual(
                 6,
@@ -157,7 +183,7 @@ class TestFileLoaderGetData(RMETestCase):
         self.subject.file_dir = None
 
         with self.assertRaises(IOError):
-            self.subject.get_data({})
+            self.get_data({})
 
         self.assertEqual(
             0,
@@ -169,7 +195,7 @@ class TestFileLoaderGetData(RMETestCase):
         self.subject.file_loader.load.side_effect = Exception('Data error')
 
         with self.assertRaises(IOError):
-            self.subject.get_data({})
+            self.get_data({})
 
         # Can't load the file on disk and the other forecast hours are missing
         self.assertEqual(
@@ -178,20 +204,267 @@ class TestFileLoaderGetData(RMETestCase):
             msg='Tried to find more files than present on disk'
         )
 
-    def test_sets_data_attribute(self):
-        self.subject.get_data({})
-        self.assertIsInstance(self.subject.data, xarray.Dataset)
+    def test_returns_data(self):
+        data, _sources = self.get_data({})
+        self.assertIsInstance(data, xarray.Dataset)
 
     def test_failed_combine_coords(self):
         with mock.patch('xarray.combine_by_coords') as xr_patch:
             xr_patch.side_effect = Exception('Combine failed')
-            self.subject.end_date = \
-                self.subject.end_date - 5 * FileLoader.NEXT_HOUR
+            self.end_date = self.end_date - 5 * FileLoader.NEXT_HOUR
 
-            self.subject.get_data({})
+            data, _sources = self.get_data({})
 
             self.assertEqual(
                 None,
-                self.subject.data,
-                msg='Data set although failed to combine'
+                data,
+                msg='Data returned although failed to combine'
+            )
+
+
+class TestFileLoaderConcurrency(RMETestCase):
+    VAR_KEYS = ['air_temp', 'elevation']
+    REQUESTS = [
+        (pd.to_datetime('2018-07-22 01:00'),
+         pd.to_datetime('2018-07-22 03:00'),
+         RMETestCase.BBOX),
+        (pd.to_datetime('2018-07-22 10:00'),
+         pd.to_datetime('2018-07-22 11:00'),
+         [-116.8, 43.0, -116.7, 43.1]),
+    ]
+
+    def test_shared_loader(self):
+        subject = FileLoader(
+            file_dir=RMETestCase.hrrr_dir.as_posix(),
+            config=tests.helpers.LOG_ERROR_CONFIG
+        )
+
+        def load(request):
+            return subject.get_saved_data(
+                *request,
+                force_zone_number=self.UTM_ZONE_NUMBER,
+                var_keys=self.VAR_KEYS
+            )
+
+        expected = [load(request) for request in self.REQUESTS]
+
+        with ThreadPool(processes=4) as pool:
+            results = pool.map(load, self.REQUESTS * 2)
+
+        for (metadata, data), (gold_metadata, gold_data) in zip(
+            results, expected * 2
+        ):
+            pd.testing.assert_frame_equal(gold_metadata, metadata)
+            pd.testing.assert_frame_equal(
+                gold_data['air_temp'], data['air_temp']
+            )
+
+
+class TestFileLoaderVariableFallback(RMETestCase):
+    VAR_MAP = {
+        'air_temp': GribFile.VAR_MAP['air_temp'],
+        'wind_u': GribFile.VAR_MAP['wind_u'],
+    }
+
+    def setUp(self):
+        super().setUp()
+
+        file_loader = mock.MagicMock(spec=GribFile)
+        file_loader.SUFFIX = GribFile.SUFFIX
+        file_loader.load.side_effect = self.partial_load
+
+        self.subject = FileLoader(
+            file_dir=RMETestCase.hrrr_dir.as_posix(),
+            config=tests.helpers.LOG_ERROR_CONFIG
+        )
+        self.subject._file_loader = file_loader
+
+    def get_data(self):
+        return self.subject.get_data(
+            self.VAR_MAP, self.START_DATE, self.START_DATE, self.BBOX
+        )
+
+    @staticmethod
+    def partial_load(file, var_map, bbox=None):
+        """Forecast hour 1 files are missing the wind_u variable"""
+        return [
+            xarray.Dataset(
+                {key: (('time',), [1.0])},
+                coords={'time': [RMETestCase.START_DATE]}
             )
+            for key in var_map
+            if not (key == 'wind_u' and file.endswith('f01.grib2'))
+        ]
+
+    def test_loads_only_missing_variables(self):
+        with mock.patch('os.path.exists', return_value=True):
+            data, _sources = self.get_data()
+
+        load = self.subject.file_loader.load
+        self.assertEqual(2, load.call_count)
+        self.assertEqual(self.VAR_MAP, load.call_args_list[0].args[1])
+        self.assertEqual(
+            {'wind_u': self.VAR_MAP['wind_u']},
+            load.call_args_list[1].args[1],
+            msg='Requested variables that were already loaded'
+        )
+        self.assertCountEqual(['air_temp', 'wind_u'], data.data_vars)
+
+    def test_records_variable_sources(self):
+        with mock.patch('os.path.exists', return_value=True):
+            _data, sources = self.get_data()
+
+        sources = sources.loc[RMETestCase.START_DATE]
+        self.assertRegex(
+            sources['air_temp'],
+            r'.*/hrrr.20180722/hrrr.t00z.wrfsfcf01.grib2'
+        )
+        self.assertRegex(
+            sources['wind_u'],
+            r'.*/hrrr.20180721/hrrr.t23z.wrfsfcf02.grib2'
+        )
+
+    def test_missing_variable_in_all_files(self):
+        self.subject.file_loader.load.side_effect = \
+            lambda file, var_map, bbox: self.partial_load('f01.grib2', var_map)
+
+        with mock.patch('os.path.exists', return_value=True):
+            with self.assertRaisesRegex(IOError, 'Not able to find good file'):
+                self.get_data()
+
+        self.assertEqual(
+            FileLoader.MAX_FORECAST_HOUR,
+            self.subject.file_loader.load.call_count
+        )
+
+
+class TestFileLoaderPrecipitationFallback(RMETestCase):
+    START_DATE = pd.to_datetime('2018-07-22 01:00')
+    END_DATE = pd.to_datetime('2018-07-22 02:00')
+
+    def setUp(self):
+        super().setUp()
+        # the t01z forecast hour 1 file is missing, 02:00 falls back to
+        # forecast hour 2 of t00z
+        day_dir = self.output_path.joinpath('hrrr.20180722')
+        day_dir.mkdir()
+        source = self.hrrr_dir.joinpath(
+            'hrrr.20180722/hrrr.t00z.wrfsfcf01.grib2'
+        ).as_posix()
+        shutil.copy(source, day_dir.as_posix())
+        tests.helpers.write_forecast_hour(
+            source,
+            day_dir.joinpath('hrrr.t00z.wrfsfcf02.grib2').as_posix(),
+            2
+        )
+
+        self.subject = FileLoader(
+            file_dir=self.output_path.as_posix(),
+            config=tests.helpers.LOG_ERROR_CONFIG
+        )
+
+    def test_hourly_precipitation(self):
+        data, sources = self.subject.get_data(
+            {'precip_int': GribFile.VAR_MAP['precip_int']},
+            self.START_DATE, self.END_DATE, self.BBOX
+        )
+
+        self.assertRegex(
+            sources.loc[self.END_DATE, 'precip_int'],
+            r'.*/hrrr.20180722/hrrr.t00z.wrfsfcf02.grib2'
+        )
+        # the accumulation over the last hour, not since the initialization
+        np.testing.assert_array_equal(
+            data.precip_int.sel(time=self.START_DATE).values,
+            data.precip_int.sel(time=self.END_DATE).values
+        )
+
+
+class TestFileLoaderForecastRun(RMETestCase):
+    INIT_TIME = '2018-07-22 04:00'
+    VAR_KEYS = ['air_temp', 'wind_u']
+
+    def setUp(self):
+        super().setUp()
+        self.subject = FileLoader(
+            file_dir=RMETestCase.hrrr_dir.as_posix(),
+            config=tests.helpers.LOG_ERROR_CONFIG
+        )
+
+    def test_stacks_forecast_hours(self):
+        data = self.subject.load_forecast_run(
+            self.INIT_TIME, [1, 2], self.BBOX, var_keys=self.VAR_KEYS
+        )
+
+        self.assertCountEqual(self.VAR_KEYS, data.data_vars)
+        self.assertEqual([1, 2], data.forecast_hour.values.tolist())
+        self.assertEqual(
+            ('forecast_hour', 'y', 'x'), data.air_temp.dims
+        )
+        self.assertEqual(
+            pd.to_datetime(self.INIT_TIME), pd.to_datetime(data.time.values)
+        )
+
+    def test_matches_grib_file(self):
+        data = self.subject.load_forecast_run(
+            self.INIT_TIME, [1], self.BBOX, var_keys=self.VAR_KEYS
+        )
+
+        grib_file = GribFile(config=tests.helpers.LOG_ERROR_CONFIG)
+        grib_file.bbox = self.BBOX
+        expected = grib_file.load_variable(
+            self.hrrr_dir.joinpath(
+                'hrrr.20180722/hrrr.t04z.wrfsfcf01.grib2'
+            ).as_posix(),
+            'air_temp',
+            GribFile.VAR_MAP['air_temp'],
+        )
+
+        np.testing.assert_array_equal(
+            expected.air_temp.values[0],
+            data.air_temp.sel(forecast_hour=1).values
+        )
+
+    def test_hourly_precipitation(self):
+        day_dir = self.output_path.joinpath('hrrr.20180722')
+        day_dir.mkdir()
+        source = self.hrrr_dir.joinpath(
+            'hrrr.20180722/hrrr.t04z.wrfsfcf01.grib2'
+        ).as_posix()
+        shutil.copy(source, day_dir.as_posix())
+        tests.helpers.write_forecast_hour(
+            source,
+            day_dir.joinpath('hrrr.t04z.wrfsfcf02.grib2').as_posix(),
+            2
+        )
+        self.subject.file_dir = self.output_path.as_posix()
+
+        data = self.subject.load_forecast_run(
+            self.INIT_TIME, [2, 1], self.BBOX,
+            var_keys=['precip_int', 'air_temp']
+        )
+
+        self.assertEqual([2, 1], data.forecast_hour.values.tolist())
+        np.testing.assert_array_equal(
+            data.precip_int.sel(forecast_hour=1).values,
+            data.precip_int.sel(forecast_hour=2).values
+        )
+
+    def test_skips_missing_forecast_hours(self):
+        data = self.subject.load_forecast_run(
+            self.INIT_TIME, [1, 3], self.BBOX, var_keys=self.VAR_KEYS
+        )
+
+        self.assertEqual([1], data.forecast_hour.values.tolist())
+
+    def test_no_files(self):
+        with self.assertRaisesRegex(IOError, 'No files found'):
+            self.subject.load_forecast_run(
+                '2018-07-20 04:00', [1, 2], self.BBOX
+            )
+
+    def test_netcdf_not_supported(self):
+        self.subject.file_type = NetCdfFile.SUFFIX
+
+        with self.assertRaises(ValueError):
+            self.subject.load_forecast_run(self.INIT_TIME, [1], self.BBOX)
@@ -0,0 +1,323 @@
+import ftplib
+import os
+import shutil
+import time
+
+import mock
+
+from tests.helpers import LocalFtpServer, grib_message
+from tests.RME import RMETestCase
+from weather_forecast_retrieval import journal
+from weather_forecast_retrieval.data.hrrr import FtpRetrieval
+from weather_forecast_retrieval.data.hrrr.ftp_retrieval import (
+    FtpConnectionPool
+)
+
+
+class TestFtpConnectionPool(RMETestCase):
+    """Test sharing logged-in connections"""
+
+    def test_reuse_connection(self):
+        connect = mock.Mock(side_effect=lambda: mock.Mock())
+
+        with FtpConnectionPool(connect, 2) as pool:
+            with pool.connection() as first:
+                pass
+            with pool.connection() as second:
+                self.assertIs(first, second)
+
+        self.assertEqual(1, pool.opened)
+        first.quit.assert_called_once()
+
+    def test_discard_failed_connection(self):
+        connect = mock.Mock(side_effect=lambda: mock.Mock())
+
+        with FtpConnectionPool(connect, 2) as pool:
+            with self.assertRaises(EOFError):
+                with pool.connection() as first:
+                    raise EOFError()
+            with pool.connection() as second:
+                self.assertIsNot(first, second)
+
+        self.assertEqual(2, pool.opened)
+        first.quit.assert_called_once()
+
+    def test_reuse_after_permanent_error(self):
+        connect = mock.Mock(side_effect=lambda: mock.Mock())
+
+        with FtpConnectionPool(connect, 2) as pool:
+            with self.assertRaises(ftplib.error_perm):
+                with pool.connection() as first:
+                    raise ftplib.error_perm('550 No such file')
+            first.quit.assert_not_called()
+            with pool.connection() as second:
+                self.assertIs(first, second)
+
+        self.assertEqual(1, pool.opened)
+
+    def test_discard_after_temporary_error(self):
+        connect = mock.Mock(side_effect=lambda: mock.Mock())
+
+        with FtpConnectionPool(connect, 2) as pool:
+            with self.assertRaises(ftplib.error_temp):
+                with pool.connection() as first:
+                    raise ftplib.error_temp('421 Timeout')
+            with pool.connection() as second:
+                self.assertIsNot(first, second)
+
+        self.assertEqual(2, pool.opened)
+
+
+class TestFtpRetrieval(RMETestCase):
+    """Test downloading HRRR from the ftp site"""
+
+    DAYS = {
+        'hrrr.20180722': [
+            'hrrr.t01z.wrfsfcf01.grib2',
+            'hrrr.t01z.wrfsfcf03.grib2',
+            'hrrr.t02z.wrfsfcf01.grib2',
+            'hrrr.t03z.wrfsfcf01.grib2',
+            'hrrr.t04z.wrfsfcf02.grib2',
+        ],
+        'hrrr.20180723': [
+            'hrrr.t00z.wrfsfcf01.grib2',
+        ],
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        prod_dir = self.remote_dir.joinpath(
+            *FtpRetrieval.REMOTE_DIR.strip('/').split('/')
+        )
+        for day, file_names in self.DAYS.items():
+            day_dir = prod_dir.joinpath(day, 'conus')
+            day_dir.mkdir(parents=True)
+            for file_name in file_names:
+                shutil.copy(
+                    self.hrrr_dir.joinpath(day, file_name).as_posix(),
+                    day_dir.as_posix()
+                )
+            # files and folders that do not match
+            day_dir.joinpath('hrrr.t01z.wrfprsf01.grib2').write_bytes(b'')
+        prod_dir.joinpath('hrrr.v4').mkdir()
+
+        self.prod_dir = prod_dir
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+        self.server = LocalFtpServer(self.remote_dir)
+
+        patcher = mock.patch(
+            'weather_forecast_retrieval.data.hrrr.ftp_retrieval.FTP',
+            side_effect=self.server.connect
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def subject(self, num_connections=1, **kwargs):
+        return FtpRetrieval(
+            self.local_dir.as_posix(), num_connections=num_connections,
+            **kwargs
+        )
+
+    def commands(self, name):
+        return [
+            command for command in self.server.commands
+            if command.startswith(name)
+        ]
+
+    def replace_remote(self, day, file_name):
+        remote_file = self.prod_dir.joinpath(day, 'conus', file_name)
+        remote_file.write_bytes(grib_message())
+        modified = time.time() + 60
+        os.utime(remote_file.as_posix(), (modified, modified))
+
+    def local_file(self, day, file_name):
+        return self.local_dir.joinpath(day, file_name).as_posix()
+
+    def assert_downloaded(self, day, file_name):
+        with open(self.hrrr_dir.joinpath(day, file_name), 'rb') as f:
+            expected = f.read()
+        with open(self.local_file(day, file_name), 'rb') as f:
+            self.assertEqual(expected, f.read())
+
+    def test_plan_filters_once(self):
+        subject = self.subject()
+        with FtpConnectionPool(subject.connect, 1) as pool:
+            subject.pool = pool
+            downloads = subject.plan(
+                [1], '2018-07-22 02:00', '2018-07-22 03:00'
+            )
+
+        self.assertEqual(
+            [
+                self.local_file('hrrr.20180722', 'hrrr.t02z.wrfsfcf01.grib2'),
+                self.local_file('hrrr.20180722', 'hrrr.t03z.wrfsfcf01.grib2'),
+            ],
+            [download[1] for download in downloads]
+        )
+        self.assertEqual(
+            FtpRetrieval.REMOTE_DIR + '/hrrr.20180722/conus/'
+            'hrrr.t02z.wrfsfcf01.grib2',
+            downloads[0][0]
+        )
+
+        # one listing of the prod folder and the day in the date range
+        listings = [
+            command for command in self.server.commands
+            if command.startswith('NLST')
+        ]
+        self.assertEqual(2, len(listings))
+        self.assertFalse(os.path.exists(
+            self.local_dir.joinpath('hrrr.20180723')
+        ))
+
+    def test_fetch_all(self):
+        results = self.subject().fetch()
+
+        self.assertEqual(6, len(results))
+        self.assertTrue(all(results))
+        for day, file_names in self.DAYS.items():
+            for file_name in file_names:
+                self.assert_downloaded(day, file_name)
+
+    def test_fetch_parallel(self):
+        results = self.subject(num_connections=3).fetch(forecast_hours=[1])
+
+        self.assertEqual(4, len(results))
+        self.assertTrue(all(results))
+        self.assertLessEqual(self.server.connections, 3)
+        self.assertLessEqual(self.server.max_active, 3)
+
+    def test_fetch_existing(self):
+        subject = self.subject()
+        subject.fetch(forecast_hours=[1])
+        self.server.commands = []
+
+        results = subject.fetch(forecast_hours=[1])
+
+        self.assertEqual([], results)
+        self.assertFalse(any(
+            command.startswith('RETR') for command in self.server.commands
+        ))
+
+    def test_fetch_resume(self):
+        self.server.failures = 1
+
+        results = self.subject().fetch(
+            [2], '2018-07-22 04:00', '2018-07-22 04:00'
+        )
+
+        out_file = self.local_file('hrrr.20180722', 'hrrr.t04z.wrfsfcf02.grib2')
+        self.assertEqual([out_file], results)
+        self.assert_downloaded('hrrr.20180722', 'hrrr.t04z.wrfsfcf02.grib2')
+
+        transfers = [
+            command for command in self.server.commands
+            if command.startswith('RETR')
+        ]
+        self.assertEqual(2, len(transfers))
+        self.assertIn('REST {}'.format(os.path.getsize(out_file) // 2),
+                      transfers[1])
+
+    def test_fetch_failed(self):
+        self.server.failures = 10
+
+        results = FtpRetrieval(
+            self.local_dir.as_posix(), retries=1
+        ).fetch([2], '2018-07-22 04:00', '2018-07-22 04:00')
+
+        self.assertEqual([False], results)
+        out_file = self.local_file('hrrr.20180722', 'hrrr.t04z.wrfsfcf02.grib2')
+        self.assertFalse(os.path.exists(out_file))
+        self.assertTrue(os.path.exists(out_file + '.part'))
+
+    def test_sync_unchanged(self):
+        subject = self.subject(sync=True)
+        self.assertEqual(6, len(subject.fetch()))
+        self.server.commands = []
+
+        self.assertEqual([], subject.fetch())
+
+        # one listing of the prod folder and of each day
+        self.assertEqual(1, len(self.commands('NLST')))
+        self.assertEqual(2, len(self.commands('MLSD')))
+        self.assertEqual(3, len(self.server.commands) - len(
+            self.commands('USER') + self.commands('QUIT')
+        ))
+
+    def test_sync_changed(self):
+        subject = self.subject(sync=True)
+        subject.fetch()
+        self.replace_remote('hrrr.20180722', 'hrrr.t02z.wrfsfcf01.grib2')
+        out_file = self.local_file('hrrr.20180722', 'hrrr.t01z.wrfsfcf01.grib2')
+        with open(out_file, 'r+b') as f:
+            f.truncate(100)
+
+        results = subject.fetch()
+
+        self.assertCountEqual(
+            [
+                out_file,
+                self.local_file('hrrr.20180722', 'hrrr.t02z.wrfsfcf01.grib2'),
+            ],
+            results
+        )
+        self.assert_downloaded('hrrr.20180722', 'hrrr.t01z.wrfsfcf01.grib2')
+        with open(results[1], 'rb') as f:
+            self.assertEqual(grib_message(), f.read())
+
+    def test_sync_existing_files(self):
+        self.subject().fetch()
+        self.server.commands = []
+
+        self.assertEqual([], self.subject(sync=True).fetch())
+        self.assertEqual([], self.commands('RETR'))
+
+    def test_sync_without_mlsd(self):
+        self.server.mlsd = False
+        subject = self.subject(sync=True)
+        subject.fetch(forecast_hours=[1])
+        self.replace_remote('hrrr.20180722', 'hrrr.t02z.wrfsfcf01.grib2')
+        self.server.commands = []
+
+        results = subject.fetch(forecast_hours=[1])
+
+        self.assertEqual(
+            [self.local_file('hrrr.20180722', 'hrrr.t02z.wrfsfcf01.grib2')],
+            results
+        )
+        self.assertEqual([], self.commands('MLSD'))
+        self.assertEqual(4, len(self.commands('MDTM')))
+
+    def test_sync_journal(self):
+        download_journal = journal.DownloadJournal(
+            self.output_path.joinpath('journal.sqlite').as_posix()
+        )
+        subject = self.subject(sync=True, journal=download_journal)
+        subject.fetch(forecast_hours=[1])
+        self.replace_remote('hrrr.20180722', 'hrrr.t02z.wrfsfcf01.grib2')
+
+        with mock.patch(
+            'os.path.exists', wraps=os.path.exists
+        ) as exists:
+            results = subject.fetch(forecast_hours=[1])
+
+        out_file = self.local_file('hrrr.20180722', 'hrrr.t02z.wrfsfcf01.grib2')
+        self.assertEqual([out_file], results)
+        self.assertNotIn(
+            self.local_file('hrrr.20180722', 'hrrr.t01z.wrfsfcf01.grib2'),
+            [call[0][0] for call in exists.call_args_list]
+        )
+
+        entry = download_journal.get(subject.url(
+            FtpRetrieval.REMOTE_DIR + '/hrrr.20180722/conus/'
+            'hrrr.t02z.wrfsfcf01.grib2'
+        ))
+        self.assertEqual(journal.COMPLETE, entry['status'])
+        self.assertEqual(len(grib_message()), entry['size'])
+        self.assertEqual(
+            os.path.getmtime(out_file),
+            FtpRetrieval.to_utc(entry['modified']).timestamp()
+        )
+        download_journal.close()
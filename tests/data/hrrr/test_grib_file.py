@@ -34,3 +34,15 @@ class TestGribFile(unittest.TestCase):
             GribFile.VAR_MAP.keys(),
             GribFile.VARIABLES
         )
+
+    def test_forecast_hour_params(self):
+        self.assertEqual(
+            '1-2',
+            GribFile.forecast_hour_params(
+                GribFile.VAR_MAP['precip_int'], 2
+            )['stepRange']
+        )
+        self.assertEqual(
+            GribFile.VAR_MAP['air_temp'],
+            GribFile.forecast_hour_params(GribFile.VAR_MAP['air_temp'], 2)
+        )
@@ -0,0 +1,71 @@
+import unittest
+
+from weather_forecast_retrieval.data.hrrr import GribInventory
+
+INVENTORY = """1:0:d=2021061504:REFC:entire atmosphere:1 hour fcst:
+2:100:d=2021061504:TMP:2 m above ground:1 hour fcst:
+3:250:d=2021061504:RH:2 m above ground:1 hour fcst:
+4:400:d=2021061504:PRES:surface:1 hour fcst:
+5.1:500:d=2021061504:UGRD:10 m above ground:1 hour fcst:
+5.2:500:d=2021061504:VGRD:10 m above ground:1 hour fcst:
+6:700:d=2021061504:APCP:surface:0-1 hour acc fcst:
+7:900:d=2021061504:HGT:surface:1 hour fcst:
+"""
+
+
+class TestGribInventory(unittest.TestCase):
+    def setUp(self):
+        self.subject = GribInventory(INVENTORY)
+
+    def test_parse(self):
+        self.assertEqual(8, len(self.subject.messages))
+        self.assertEqual(100, self.subject.messages[1]['start'])
+        self.assertEqual(249, self.subject.messages[1]['end'])
+
+    def test_parse_last_message(self):
+        self.assertIsNone(self.subject.messages[-1]['end'])
+
+    def test_parse_sub_messages(self):
+        self.assertEqual(
+            self.subject.messages[4]['end'], self.subject.messages[5]['end']
+        )
+        self.assertEqual(699, self.subject.messages[5]['end'])
+
+    def test_select(self):
+        messages = self.subject.select(['TMP:2 m', 'HGT:surface'])
+        self.assertEqual([100, 900], [m['start'] for m in messages])
+
+    def test_select_defaults(self):
+        self.assertEqual(6, len(self.subject.select()))
+
+    def test_byte_ranges_merged(self):
+        self.assertEqual(
+            [(100, 399), (500, None)],
+            self.subject.byte_ranges()
+        )
+
+    def test_byte_ranges_sub_messages(self):
+        self.assertEqual(
+            [(500, 699)],
+            self.subject.byte_ranges(['UGRD:10 m', 'VGRD:10 m'])
+        )
+
+    def test_byte_ranges_not_adjacent(self):
+        self.assertEqual(
+            [(100, 249), (700, 899)],
+            self.subject.byte_ranges(['TMP:2 m', 'APCP:surface'])
+        )
+
+    def test_missing(self):
+        self.assertEqual(
+            ['DSWRF:surface', 'TCDC:entire atmosphere'],
+            self.subject.missing()
+        )
+
+    def test_range_header(self):
+        self.assertEqual(
+            {'Range': 'bytes=100-249'}, GribInventory.range_header(100, 249)
+        )
+        self.assertEqual(
+            {'Range': 'bytes=900-'}, GribInventory.range_header(900)
+        )
@@ -1,11 +1,21 @@
+import os
+import shutil
 from datetime import datetime, timedelta
 
 import mock
+import numpy as np
 import pandas as pd
 
-from tests.helpers import mocked_requests_get
+import tests.helpers
+from tests.helpers import (
+    CorruptingRequestHandler, LocalHttpServer, ThrottlingRequestHandler,
+    mocked_requests_get
+)
 from tests.RME import RMETestCase
-from weather_forecast_retrieval.data.hrrr import HttpRetrieval
+from weather_forecast_retrieval import download
+from weather_forecast_retrieval.data.hrrr import (
+    FileLoader, GribFile, GribInventory, HttpRetrieval
+)
 
 
 class TestHttpRetrieval(RMETestCase):
@@ -21,12 +31,16 @@ class TestHttpRetrieval(RMETestCase):
         ).as_posix()
         self.subject = HttpRetrieval(config=self.config_file)
 
-    def create_test_files(self):
+    def create_test_files(self, complete=True):
         output_file = './output/hrrr.20190710/hrrr.t10z.wrfsfcf00.grib2'
 
         with open(output_file, 'wb') as f:
             f.write(b'nothing here')
 
+        # Size of the file in the NOMADS listing
+        if complete:
+            os.truncate(output_file, 134 * 1024 ** 2)
+
     def test_start_date(self):
         self.assertEqual(
             pd.to_datetime('2019-07-10 09:00:00'),
@@ -71,7 +85,7 @@ class TestHttpRetrieval(RMETestCase):
         self.assertEqual(r'hrrr\.t\d\dz\.wrfsfcf(10|18).grib2',
                          self.subject.regex_file_name)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_parse_html_for_files(self, mock_get):
         self.subject.output_folder()
         self.subject.check_dates()
@@ -96,7 +110,7 @@ class TestHttpRetrieval(RMETestCase):
         self.assertTrue(len(df) == 0)
         self.assertTrue(mock_get.call_count == 4)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_parse_html_no_overwrite(self, mock_get):
         self.subject.output_folder()
         self.subject.check_dates()
@@ -107,7 +121,17 @@ class TestHttpRetrieval(RMETestCase):
         self.assertTrue(len(df) == 1)
         self.assertTrue(mock_get.call_count == 1)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_parse_html_truncated_file(self, mock_get):
+        self.subject.output_folder()
+        self.subject.check_dates()
+        self.create_test_files(complete=False)
+
+        # does not match the listing size and is downloaded again
+        df = self.subject.parse_html_for_files()
+        self.assertTrue(len(df) == 2)
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_parse_html_overwrite(self, mock_get):
         self.subject.output_folder()
         self.subject.check_dates()
@@ -119,9 +143,604 @@ class TestHttpRetrieval(RMETestCase):
         self.assertTrue(len(df) == 2)
         self.assertTrue(mock_get.call_count == 1)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_parse_html_outside_dates(self, mock_get):
+        self.subject.start_date = pd.to_datetime('2019-07-10 11:00:00')
+        self.subject.end_date = pd.to_datetime('2019-07-10 12:00:00')
+        self.subject.check_dates()
+        self.subject.journal = mock.Mock()
+
+        with mock.patch.object(self.subject, 'is_new_file') as is_new_file, \
+                mock.patch('os.makedirs') as makedirs:
+            df = self.subject.parse_html_for_files()
+
+        self.assertEqual(0, len(df))
+        is_new_file.assert_not_called()
+        makedirs.assert_not_called()
+        self.subject.journal.files.assert_not_called()
+        self.subject.journal.add.assert_not_called()
+
+    def test_days(self):
+        self.subject.end_date = pd.to_datetime('2019-07-12 01:00:00')
+        self.subject.check_dates()
+
+        days = self.subject.days()
+        self.assertEqual(3, len(days))
+        self.assertEqual(
+            pd.Timestamp('2019-07-10', tz='UTC'), days[0]
+        )
+
+    def test_end_before_start(self):
+        self.subject.start_date = pd.to_datetime('2020-01-02 00:00:00')
+        self.subject.end_date = pd.to_datetime('2020-01-01 00:00:00')
+
+        with self.assertRaisesRegex(ValueError, 'before start date'):
+            self.subject.check_dates()
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_plan_downloads_without_days(self, mock_get):
+        self.subject.start_date = pd.Timestamp('2020-01-02', tz='UTC')
+        self.subject.end_date = pd.Timestamp('2020-01-01', tz='UTC')
+
+        df = self.subject.plan_downloads()
+
+        self.assertEqual(0, len(df))
+        self.assertEqual(list(HttpRetrieval.COLUMNS), list(df.columns))
+        mock_get.assert_not_called()
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_plan_downloads_multiple_days(self, mock_get):
+        self.subject.end_date = pd.to_datetime('2019-07-11 10:00:00')
+        self.subject.check_dates()
+
+        df = self.subject.plan_downloads()
+
+        self.assertEqual(4, len(df))
+        self.assertEqual(2, mock_get.call_count)
+        self.assertCountEqual(
+            [
+                HttpRetrieval.URL.format('20190710'),
+                HttpRetrieval.URL.format('20190711'),
+            ],
+            [call[0][0] for call in mock_get.call_args_list]
+        )
+        self.assertTrue(df.file_date.is_monotonic_increasing)
+        self.assertEqual(
+            ['hrrr.20190710', 'hrrr.20190710', 'hrrr.20190711',
+             'hrrr.20190711'],
+            [file.split(os.sep)[-2] for file in df.out_file]
+        )
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_download_multiple_days(self, mock_get):
+        res = self.subject.fetch_by_date(
+            '2019-07-10 09:00:00', '2019-07-11 10:00:00'
+        )
+
+        self.assertEqual(4, len(res))
+        self.assertEqual(6, mock_get.call_count)
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_download_dates(self, mock_get):
 
         res = self.subject.fetch_by_date(self.START_DATE, self.END_DATE)
         self.assertIsNone(res)
         self.assertTrue(mock_get.call_count == 1)
+
+
+class TestHttpRetrievalListing(RMETestCase):
+    """Test parsing and caching the NOMADS listing"""
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        self.remote_dir.mkdir()
+        shutil.copy(
+            self.basin_dir.joinpath(
+                '..', 'nomads', 'nomads_response.html'
+            ).as_posix(),
+            self.remote_dir.joinpath('listing.html').as_posix()
+        )
+        with open(self.remote_dir.joinpath('listing.html')) as f:
+            self.page = f.read()
+
+        self.subject = HttpRetrieval(config=tests.helpers.LOG_ERROR_CONFIG)
+
+    def test_parse_listing(self):
+        df = HttpRetrieval.parse_listing(self.page)
+
+        self.assertEqual(['file_name', 'modified', 'size'], list(df.columns))
+        row = df[df.file_name == 'hrrr.t10z.wrfsfcf00.grib2'].iloc[0]
+        self.assertEqual(
+            pd.Timestamp('2021-06-14 00:52', tz='UTC'), row.modified
+        )
+        self.assertEqual('134M', row['size'])
+        self.assertIn('hrrr.t10z.wrfsfcf00.grib2.idx', df.file_name.values)
+        # directories and the parent link are not files
+        self.assertFalse(df.file_name.str.endswith('/').any())
+
+    def test_parse_empty_listing(self):
+        df = HttpRetrieval.parse_listing('')
+        self.assertEqual(0, len(df))
+
+    def test_request_listing_not_modified(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            url = server.url + 'listing.html'
+            first = self.subject.request_listing(url)
+            second = self.subject.request_listing(url)
+
+        self.assertEqual(2, len(server.requests))
+        self.assertNotIn('If-Modified-Since', server.requests[0][2])
+        self.assertIn('If-Modified-Since', server.requests[1][2])
+        self.assertIs(first, second)
+
+    def test_request_listing_etag(self):
+        response = tests.helpers.MockResponse('listing', self.page, 200)
+        response.headers = {'ETag': '"abc"'}
+        not_modified = tests.helpers.MockResponse('listing', '', 304)
+
+        with mock.patch(
+            'requests.Session.get', side_effect=[response, not_modified]
+        ) as mock_get:
+            first = self.subject.request_listing('listing')
+            second = self.subject.request_listing('listing')
+
+        self.assertEqual(
+            {'If-None-Match': '"abc"'},
+            mock_get.call_args_list[1][1]['headers']
+        )
+        self.assertIs(first, second)
+
+    def test_request_listing_not_found(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            df = self.subject.request_listing(server.url + 'missing.html')
+
+        self.assertEqual(0, len(df))
+
+
+class TestHttpRetrievalSubset(RMETestCase):
+    """Test downloading a subset of the messages with range requests"""
+
+    FILE_NAME = 'hrrr.t00z.wrfsfcf01.grib2'
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        self.remote_dir.mkdir()
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+
+        self.source_file = self.hrrr_dir.joinpath(
+            'hrrr.20180722', self.FILE_NAME
+        )
+        shutil.copy(self.source_file.as_posix(), self.remote_dir.as_posix())
+        shutil.copy(
+            self.basin_dir.joinpath(
+                '..', 'nomads', self.FILE_NAME + GribInventory.SUFFIX
+            ).as_posix(),
+            self.remote_dir.as_posix()
+        )
+
+        self.subject = HttpRetrieval(
+            subset=True, config=tests.helpers.LOG_ERROR_CONFIG
+        )
+        self.subject.out_path = self.local_dir.as_posix()
+
+    def test_subset_from_config(self):
+        subject = HttpRetrieval(config={
+            'output': {'subset': True, 'subset_variables': 'TMP:2 m'},
+            **tests.helpers.LOG_ERROR_CONFIG
+        })
+
+        self.assertTrue(subject.subset)
+        self.assertEqual(['TMP:2 m'], subject.subset_variables)
+
+    def test_default_subset_variables(self):
+        self.assertEqual(
+            list(GribInventory.VARIABLES), self.subject.subset_variables
+        )
+
+    def test_fetch_subset(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            out_file = self.subject.fetch_from_url(server.url + self.FILE_NAME)
+
+        self.assertEqual(
+            self.local_dir.joinpath(self.FILE_NAME).as_posix(), out_file
+        )
+        self.assertLess(
+            os.path.getsize(out_file), os.path.getsize(self.source_file)
+        )
+
+        # Inventory and one request for each group of adjacent messages
+        ranges = [
+            request for request in server.requests if 'Range' in request[2]
+        ]
+        self.assertEqual(len(server.requests) - 1, len(ranges))
+        self.assertEqual(5, len(ranges))
+
+        grib_file = GribFile(config=tests.helpers.LOG_ERROR_CONFIG)
+        grib_file.bbox = self.BBOX
+        for key in ['air_temp', 'relative_humidity', 'wind_u', 'elevation']:
+            expected = grib_file.load_variable(
+                self.source_file.as_posix(), key, GribFile.VAR_MAP[key]
+            )
+            subset = grib_file.load_variable(
+                out_file, key, GribFile.VAR_MAP[key]
+            )
+            np.testing.assert_array_equal(
+                expected[key].values, subset[key].values
+            )
+
+    def test_fetch_subset_without_inventory(self):
+        os.remove(
+            self.remote_dir.joinpath(self.FILE_NAME + GribInventory.SUFFIX)
+        )
+
+        with LocalHttpServer(self.remote_dir) as server:
+            out_file = self.subject.fetch_from_url(server.url + self.FILE_NAME)
+
+        self.assertFalse(out_file)
+        self.assertFalse(self.local_dir.joinpath(self.FILE_NAME).exists())
+
+
+class TestHttpRetrievalStream(RMETestCase):
+    """Test streaming downloads to disk"""
+
+    FILE_NAME = 'hrrr.t00z.wrfsfcf01.grib2'
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        self.remote_dir.mkdir()
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+
+        self.source_file = self.hrrr_dir.joinpath(
+            'hrrr.20180722', self.FILE_NAME
+        )
+        shutil.copy(self.source_file.as_posix(), self.remote_dir.as_posix())
+
+        self.subject = HttpRetrieval(config={
+            'output': {'buffer_size': 4096},
+            **tests.helpers.LOG_ERROR_CONFIG
+        })
+        self.subject.out_path = self.local_dir.as_posix()
+
+    def test_buffer_size(self):
+        self.assertEqual(4096, self.subject.buffer_size)
+        self.assertEqual(
+            HttpRetrieval.BUFFER_SIZE,
+            HttpRetrieval(
+                config=tests.helpers.LOG_ERROR_CONFIG
+            ).buffer_size
+        )
+
+    def test_fetch_streamed(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            out_file = self.subject.fetch_from_url(server.url + self.FILE_NAME)
+
+        self.assertEqual(
+            self.local_dir.joinpath(self.FILE_NAME).as_posix(), out_file
+        )
+        with open(out_file, 'rb') as local, \
+                open(self.source_file, 'rb') as remote:
+            self.assertEqual(remote.read(), local.read())
+        self.assertEqual([self.FILE_NAME], os.listdir(self.local_dir))
+
+    def test_fetch_interrupted(self):
+        def interrupted(*args, **kwargs):
+            yield b'GRIB'
+            raise ConnectionError('Connection reset')
+
+        response = tests.helpers.MockResponse(
+            self.FILE_NAME, b'', 200
+        )
+        response.iter_content = interrupted
+
+        with mock.patch('requests.Session.get', return_value=response):
+            out_file = self.subject.fetch_from_url(self.FILE_NAME)
+
+        self.assertFalse(out_file)
+        # partial file is kept to resume
+        self.assertEqual(
+            [self.FILE_NAME + '.part'], os.listdir(self.local_dir)
+        )
+        with open(self.local_dir.joinpath(self.FILE_NAME + '.part'), 'rb') as f:
+            self.assertEqual(b'GRIB', f.read())
+
+    def test_fetch_resume(self):
+        with open(self.source_file, 'rb') as f:
+            content = f.read()
+        with open(self.local_dir.joinpath(self.FILE_NAME + '.part'), 'wb') as f:
+            f.write(content[:10000])
+
+        with LocalHttpServer(self.remote_dir) as server:
+            out_file = self.subject.fetch_from_url(
+                server.url + self.FILE_NAME, size=len(content)
+            )
+
+        self.assertEqual(1, len(server.requests))
+        self.assertEqual('bytes=10000-', server.requests[0][2]['Range'])
+        with open(out_file, 'rb') as f:
+            self.assertEqual(content, f.read())
+        self.assertEqual([self.FILE_NAME], os.listdir(self.local_dir))
+
+    def test_fetch_size_mismatch(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            out_file = self.subject.fetch_from_url(
+                server.url + self.FILE_NAME, size='10K'
+            )
+
+        self.assertFalse(out_file)
+        self.assertFalse(self.local_dir.joinpath(self.FILE_NAME).exists())
+
+
+class TestHttpRetrievalEngine(RMETestCase):
+    """Test selecting the download engine"""
+
+    FILE_NAMES = [
+        'hrrr.t01z.wrfsfcf01.grib2',
+        'hrrr.t02z.wrfsfcf01.grib2',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        self.remote_dir.mkdir()
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+
+        for file_name in self.FILE_NAMES:
+            shutil.copy(
+                self.hrrr_dir.joinpath('hrrr.20180722', file_name).as_posix(),
+                self.remote_dir.as_posix()
+            )
+
+    def test_default_engine(self):
+        subject = HttpRetrieval(config=tests.helpers.LOG_ERROR_CONFIG)
+        self.assertEqual('thread', subject.engine)
+        self.assertIsNone(subject.rate_limit)
+
+    def test_engine_from_config(self):
+        subject = HttpRetrieval(config={
+            'output': {'engine': 'async', 'rate_limit': '5'},
+            **tests.helpers.LOG_ERROR_CONFIG
+        })
+        self.assertEqual('async', subject.engine)
+        self.assertEqual(5, subject.rate_limit)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            HttpRetrieval(
+                engine='process', config=tests.helpers.LOG_ERROR_CONFIG
+            )
+
+    def fetch_files(self, engine):
+        completed = []
+        subject = HttpRetrieval(
+            engine=engine,
+            callback=lambda url, result: completed.append(result),
+            config=tests.helpers.LOG_ERROR_CONFIG
+        )
+        subject.out_path = self.local_dir.as_posix()
+
+        with LocalHttpServer(self.remote_dir) as server:
+            results = subject.fetch_files(
+                [server.url + file_name for file_name in self.FILE_NAMES]
+            )
+
+        expected = [
+            self.local_dir.joinpath(file_name).as_posix()
+            for file_name in self.FILE_NAMES
+        ]
+        self.assertEqual(expected, results)
+        self.assertCountEqual(expected, completed)
+
+    def test_adaptive_from_config(self):
+        subject = HttpRetrieval(config={
+            'output': {
+                'adaptive': True, 'num_requests': 3, 'max_requests': 8
+            },
+            **tests.helpers.LOG_ERROR_CONFIG
+        })
+
+        self.assertTrue(subject.adaptive)
+        self.assertEqual(3, subject.concurrency.limit)
+        self.assertEqual(8, subject.concurrency.max_limit)
+        self.assertEqual(8, subject.pool_size)
+        self.assertIsNone(
+            HttpRetrieval(config=tests.helpers.LOG_ERROR_CONFIG).concurrency
+        )
+
+    def test_adaptive_async_engine(self):
+        with self.assertRaisesRegex(ValueError, 'only used by the thread'):
+            HttpRetrieval(engine='async', config={
+                'output': {'adaptive': True},
+                **tests.helpers.LOG_ERROR_CONFIG
+            })
+
+    @mock.patch.object(download, 'BACKOFF_FACTOR', 0)
+    def test_fetch_files_adaptive(self):
+        subject = HttpRetrieval(config={
+            'output': {
+                'adaptive': True, 'num_requests': 2, 'retries': 10
+            },
+            **tests.helpers.LOG_ERROR_CONFIG
+        })
+        subject.concurrency.backoff = 0.05
+        subject.out_path = self.local_dir.as_posix()
+
+        with LocalHttpServer(
+            self.remote_dir, handler=ThrottlingRequestHandler, capacity=1
+        ) as server:
+            results = subject.fetch_files(
+                [server.url + file_name for file_name in self.FILE_NAMES]
+            )
+
+        self.assertTrue(all(results))
+        self.assertEqual(server.throttled, subject.concurrency.throttled)
+
+    def test_fetch_files_thread(self):
+        self.fetch_files('thread')
+
+    def test_fetch_files_async(self):
+        self.fetch_files('async')
+
+
+class TestHttpRetrievalPriority(RMETestCase):
+    """Test the order of the download queue"""
+
+    def setUp(self):
+        super().setUp()
+        file_date = pd.to_datetime(
+            ['2018-07-22 01:00', '2018-07-22 01:00', '2018-07-22 02:00',
+             '2018-07-22 02:00', '2018-07-22 03:00']
+        ).tz_localize('UTC')
+        self.queue = pd.DataFrame({
+            'file_date': file_date,
+            'forecast_hour': [18, 1, 18, 0, 6],
+        })
+
+    def prioritize(self, priority):
+        subject = HttpRetrieval(
+            priority=priority, config=tests.helpers.LOG_ERROR_CONFIG
+        )
+        df = subject.prioritize(self.queue)
+        return list(zip(df.file_date.dt.hour, df.forecast_hour))
+
+    def test_default_priority(self):
+        subject = HttpRetrieval(config=tests.helpers.LOG_ERROR_CONFIG)
+        self.assertEqual('date', subject.priority)
+
+    def test_priority_from_config(self):
+        subject = HttpRetrieval(config={
+            'output': {'priority': 'critical'},
+            **tests.helpers.LOG_ERROR_CONFIG
+        })
+        self.assertEqual('critical', subject.priority)
+
+    def test_unknown_priority(self):
+        with self.assertRaises(ValueError):
+            HttpRetrieval(
+                priority='largest', config=tests.helpers.LOG_ERROR_CONFIG
+            )
+
+    def test_priority_date(self):
+        self.assertEqual(
+            [(1, 18), (1, 1), (2, 18), (2, 0), (3, 6)],
+            self.prioritize('date')
+        )
+
+    def test_priority_newest(self):
+        self.assertEqual(
+            [(3, 6), (2, 0), (2, 18), (1, 1), (1, 18)],
+            self.prioritize('newest')
+        )
+
+    def test_priority_critical(self):
+        self.assertEqual(
+            [(3, 6), (1, 1), (2, 0), (2, 18), (1, 18)],
+            self.prioritize('critical')
+        )
+        self.assertEqual(
+            range(1, FileLoader.MAX_FORECAST_HOUR + 1),
+            HttpRetrieval.CRITICAL_HOURS
+        )
+
+    def test_fetch_in_queue_order(self):
+        file_names = [
+            'hrrr.t02z.wrfsfcf01.grib2',
+            'hrrr.t01z.wrfsfcf01.grib2',
+            'hrrr.t04z.wrfsfcf02.grib2',
+        ]
+        remote_dir = self.output_path.joinpath('remote')
+        remote_dir.mkdir()
+        for file_name in file_names:
+            shutil.copy(
+                self.hrrr_dir.joinpath('hrrr.20180722', file_name).as_posix(),
+                remote_dir.as_posix()
+            )
+
+        subject = HttpRetrieval(
+            num_requests=1, config=tests.helpers.LOG_ERROR_CONFIG
+        )
+        subject.out_path = self.output_path.as_posix()
+
+        with LocalHttpServer(remote_dir) as server:
+            subject.fetch_files(
+                [server.url + file_name for file_name in file_names]
+            )
+
+        self.assertEqual(
+            ['/' + file_name for file_name in file_names],
+            [request[1] for request in server.requests]
+        )
+
+
+class TestHttpRetrievalValidate(RMETestCase):
+    """Test rejecting files with an invalid GRIB2 framing"""
+
+    FILE_NAME = 'hrrr.t01z.wrfsfcf01.grib2'
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        self.remote_dir.mkdir()
+        shutil.copy(
+            self.hrrr_dir.joinpath('hrrr.20180722', self.FILE_NAME).as_posix(),
+            self.remote_dir.as_posix()
+        )
+        self.out_file = self.output_path.joinpath(self.FILE_NAME).as_posix()
+
+    def fetch(self, engine='thread', config=None):
+        subject = HttpRetrieval(
+            engine=engine,
+            config={'output': config or {}, **tests.helpers.LOG_ERROR_CONFIG}
+        )
+        subject.out_path = self.output_path.as_posix()
+
+        with LocalHttpServer(
+            self.remote_dir, handler=CorruptingRequestHandler, failures=1
+        ) as server:
+            results = subject.fetch_files([server.url + self.FILE_NAME])
+
+        return results, server
+
+    def assert_retried(self, engine):
+        results, server = self.fetch(engine)
+
+        self.assertEqual([self.out_file], results)
+        self.assertEqual(2, len(server.requests))
+        with open(self.out_file, 'rb') as f:
+            self.assertEqual(b'7777', f.read()[-4:])
+
+    def test_default_validate(self):
+        subject = HttpRetrieval(config=tests.helpers.LOG_ERROR_CONFIG)
+        self.assertTrue(subject.validate)
+        self.assertIsNotNone(subject.validator('hrrr.t01z.wrfsfcf01.grib2'))
+        self.assertIsNone(subject.validator('index.html'))
+
+    def test_retry_invalid_thread(self):
+        self.assert_retried('thread')
+
+    def test_retry_invalid_async(self):
+        self.assert_retried('async')
+
+    def test_retry_invalid_adaptive(self):
+        results, server = self.fetch(config={'adaptive': True})
+
+        self.assertEqual([self.out_file], results)
+        self.assertEqual(2, len(server.requests))
+
+    def test_without_validate(self):
+        results, server = self.fetch(config={'validate': False})
+
+        self.assertEqual([self.out_file], results)
+        self.assertEqual(1, len(server.requests))
+
+    def test_invalid_on_all_attempts(self):
+        results, server = self.fetch(config={'retries': 0})
+
+        self.assertEqual([False], results)
+        self.assertFalse(os.path.exists(self.out_file))
+        self.assertEqual(0, download.partial_size(self.out_file))
@@ -0,0 +1,146 @@
+import mock
+import numpy as np
+import pandas as pd
+
+import tests.helpers
+from tests.RME import RMETestCase
+from weather_forecast_retrieval.data.hrrr import GribFile, ReferenceIndex
+
+
+class TestReferenceIndex(RMETestCase):
+    VARIABLES = ['air_temp', 'wind_u']
+    FILE = 'hrrr.20180722/hrrr.t00z.wrfsfcf01.grib2'
+
+    def setUp(self):
+        super().setUp()
+        self.subject = ReferenceIndex(
+            self.hrrr_dir.as_posix(),
+            var_map={key: GribFile.VAR_MAP[key] for key in self.VARIABLES},
+            config=tests.helpers.LOG_ERROR_CONFIG,
+        )
+
+    def test_files(self):
+        files = self.subject.files()
+
+        self.assertIn(self.FILE, files)
+        self.assertTrue(
+            all(file.endswith('.grib2') for file in files),
+            msg='Indexed files that are not HRRR grib2 files'
+        )
+
+    def test_scan_file(self):
+        messages = self.subject.scan_file(self.FILE)
+
+        self.assertCountEqual(
+            self.VARIABLES, [message['variable'] for message in messages]
+        )
+        for message in messages:
+            self.assertEqual(self.FILE, message['file'])
+            self.assertEqual('2018-07-22T00:00:00', message['time'])
+            self.assertEqual(1, message['forecast_hour'])
+
+    def test_message_byte_range(self):
+        message = self.subject.scan_file(self.FILE)[0]
+
+        with self.hrrr_dir.joinpath(self.FILE).open('rb') as grib:
+            grib.seek(message['offset'])
+            data = grib.read(message['length'])
+
+        self.assertEqual(b'GRIB', data[:4])
+        self.assertEqual(b'7777', data[-4:])
+
+    def test_save_and_load(self):
+        index_file = self.output_path.joinpath('index.json').as_posix()
+        self.subject.scan().save(index_file)
+
+        reference_index = ReferenceIndex.load(
+            index_file, config=tests.helpers.LOG_ERROR_CONFIG
+        )
+
+        self.assertEqual(self.subject.messages, reference_index.messages)
+        self.assertEqual(self.subject.grid, reference_index.grid)
+        self.assertEqual(
+            self.hrrr_dir.as_posix(), reference_index.file_dir
+        )
+
+    def test_open_dataset_is_lazy(self):
+        self.subject.scan()
+
+        with mock.patch.object(
+            ReferenceIndex, 'read_message',
+            wraps=self.subject.read_message
+        ) as read_message:
+            dataset = self.subject.open_dataset()
+            self.assertEqual(0, read_message.call_count)
+
+            dataset.air_temp.isel(time=0, forecast_hour=0).values
+            self.assertEqual(1, read_message.call_count)
+
+    def test_open_dataset_dimensions(self):
+        dataset = self.subject.scan().open_dataset()
+
+        self.assertCountEqual(self.VARIABLES, dataset.data_vars)
+        self.assertEqual(
+            ReferenceIndex.DIMS, dataset.air_temp.dims
+        )
+        self.assertEqual(
+            pd.to_datetime('2018-07-22 01:00'),
+            pd.to_datetime(dataset.valid_time.values[0, 0])
+        )
+
+    def test_values_match_grib_file(self):
+        dataset = self.subject.scan().open_dataset(bbox=self.BBOX)
+        air_temp = dataset.air_temp.sel(
+            time='2018-07-22 00:00', forecast_hour=1
+        )
+
+        grib_file = GribFile(config=tests.helpers.LOG_ERROR_CONFIG)
+        grib_file.bbox = self.BBOX
+        expected = grib_file.load_variable(
+            self.hrrr_dir.joinpath(self.FILE).as_posix(),
+            'air_temp',
+            GribFile.VAR_MAP['air_temp'],
+        ).air_temp.values[0]
+
+        self.assertEqual(expected.shape, air_temp.shape)
+        cells = ~np.isnan(expected)
+        np.testing.assert_allclose(expected[cells], air_temp.values[cells])
+
+    def test_open_dataset_without_scan(self):
+        with self.assertRaises(ValueError):
+            self.subject.open_dataset()
+
+    def test_hourly_accumulation(self):
+        var_map = {'precip_int': GribFile.VAR_MAP['precip_int']}
+        source = 'hrrr.20180722/hrrr.t02z.wrfsfcf01.grib2'
+        self.output_path.joinpath('hrrr.20180722').mkdir()
+        tests.helpers.write_forecast_hour(
+            self.hrrr_dir.joinpath(source).as_posix(),
+            self.output_path.joinpath(
+                'hrrr.20180722/hrrr.t02z.wrfsfcf02.grib2'
+            ).as_posix(),
+            2
+        )
+        subject = ReferenceIndex(
+            self.output_path.as_posix(),
+            var_map=var_map,
+            config=tests.helpers.LOG_ERROR_CONFIG,
+        )
+
+        self.assertEqual(1, len(subject.scan().messages))
+        self.assertEqual(2, subject.messages[0]['forecast_hour'])
+
+        source_index = ReferenceIndex(
+            self.hrrr_dir.as_posix(),
+            var_map=var_map,
+            config=tests.helpers.LOG_ERROR_CONFIG,
+        )
+        message = source_index.scan_file(source)[0]
+        np.testing.assert_array_equal(
+            source_index.read_message(
+                message['file'], message['offset'], message['length']
+            ),
+            subject.open_dataset().precip_int.isel(
+                time=0, forecast_hour=0
+            ).values
+        )
@@ -1,4 +1,13 @@
+import ftplib
 import os
+import re
+import threading
+import time
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+import requests
 
 LOG_ERROR_CONFIG = {
     'logging': {
@@ -17,15 +26,84 @@ class MockResponse:
         self.text = text
         self.status_code = status_code
         self.content = text
+        self.headers = {}
 
     def text(self):
         return self.text
 
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(
+                '{} Error for url: {}'.format(self.status_code, self.url)
+            )
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def grib_message(section_length=21):
+    """
+    Smallest GRIB2 message with a valid framing: the indicator section, an
+    empty identification section and the end section
+    """
+    length = 16 + section_length + 4
+    return b'GRIB\x00\x00\x00\x02' + length.to_bytes(8, 'big') + \
+        section_length.to_bytes(4, 'big') + b'\x01' + \
+        b'\x00' * (section_length - 5) + b'7777'
+
+
+def write_forecast_hour(source, out_file, forecast_hour):
+    """
+    Write a HRRR file of a later forecast hour from a forecast hour 1 file.
+    The instantaneous messages are copied with the new step. The total
+    precipitation is written in the order of the HRRR files: first the
+    accumulation since the initialization, with the values increased by
+    100, then the accumulation over the last hour with the source values.
+    """
+    import eccodes
+
+    with open(source, 'rb') as grib, open(out_file, 'wb') as out:
+        while True:
+            handle = eccodes.codes_grib_new_from_file(grib)
+            if handle is None:
+                break
+
+            if eccodes.codes_get(handle, 'stepType') == 'instant':
+                eccodes.codes_set(handle, 'stepRange', str(forecast_hour))
+                eccodes.codes_write(handle, out)
+            elif eccodes.codes_get(handle, 'shortName') == 'tp':
+                run_total = eccodes.codes_clone(handle)
+                eccodes.codes_set(run_total, 'stepRange', '0-{}'.format(
+                    forecast_hour
+                ))
+                eccodes.codes_set_values(
+                    run_total, eccodes.codes_get_values(run_total) + 100
+                )
+                eccodes.codes_write(run_total, out)
+                eccodes.codes_release(run_total)
+
+                eccodes.codes_set(handle, 'stepRange', '{}-{}'.format(
+                    forecast_hour - 1, forecast_hour
+                ))
+                eccodes.codes_write(handle, out)
+
+            eccodes.codes_release(handle)
+
 
 def mocked_requests_get(*args, **kwargs):
 
     if 'grib2' in args[0]:
-        return MockResponse(args[0], b'mock response text', 200)
+        return MockResponse(args[0], grib_message(), 200)
 
     if 'nomads' in args[0]:
         with open('../nomads/nomads_response.html') as f:
@@ -33,3 +111,296 @@ def mocked_requests_get(*args, **kwargs):
         return MockResponse(args[0], html_string, 200)
 
     return MockResponse(args[0], None, 404)
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serve the files of the LocalHttpServer directory with support for
+    single byte range requests. A range with an If-Range that is not the
+    Last-Modified date of the file is answered with the whole file. All
+    requests are recorded on the server.
+    """
+    RANGE_PATTERN = re.compile(r'bytes=(\d+)-(\d*)')
+
+    def translate_path(self, path):
+        path = urlparse(path).path.strip('/')
+        return os.path.join(self.server.directory, *path.split('/'))
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.server.requests.append((self.command, self.path, self.headers))
+        super().do_HEAD()
+
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path, self.headers))
+
+        byte_range = self.RANGE_PATTERN.fullmatch(
+            self.headers.get('Range', '')
+        )
+        file = self.translate_path(self.path)
+        if byte_range is None or not os.path.isfile(file):
+            return super().do_GET()
+
+        last_modified = self.date_time_string(os.path.getmtime(file))
+        if self.headers.get('If-Range', last_modified) != last_modified:
+            return super().do_GET()
+
+        with open(file, 'rb') as f:
+            content = f.read()
+
+        start = int(byte_range.group(1))
+        end = int(byte_range.group(2) or len(content) - 1)
+        if start >= len(content):
+            self.send_error(416)
+            return
+
+        end = min(end, len(content) - 1)
+        self.send_response(206)
+        self.send_header(
+            'Content-Range', 'bytes {}-{}/{}'.format(start, end, len(content))
+        )
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        self.wfile.write(content[start:end + 1])
+
+
+class KeepAliveRequestHandler(RangeRequestHandler):
+    """
+    Keep the connection open between requests with HTTP/1.1. The server
+    answers with status 503 while server.failures is larger than 0.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.server.requests.append(
+                (self.command, self.path, self.headers)
+            )
+            self.send_error(503)
+            return
+
+        super().do_GET()
+
+
+class CorruptingRequestHandler(RangeRequestHandler):
+    """
+    Replace the last four bytes of a file with zeros while server.failures
+    is larger than 0. The corrupt response has the full length.
+    """
+
+    def do_GET(self):
+        file = self.translate_path(self.path)
+        if self.server.failures == 0 or not os.path.isfile(file):
+            return super().do_GET()
+
+        self.server.failures -= 1
+        self.server.requests.append((self.command, self.path, self.headers))
+
+        with open(file, 'rb') as f:
+            content = f.read()[:-4] + b'\x00' * 4
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class SlowRequestHandler(RangeRequestHandler):
+    """
+    Wait server.delay seconds before answering a GET request and record
+    the largest number of requests handled at the same time in
+    server.max_active.
+    """
+    DELAY = 0.1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(
+                self.server.max_active, self.server.active
+            )
+        try:
+            time.sleep(self.DELAY)
+            super().do_GET()
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+
+class ThrottlingRequestHandler(SlowRequestHandler):
+    """
+    Answer with status 429 when more than server.capacity GET requests are
+    handled at the same time. Throttled requests are counted in
+    server.throttled.
+    """
+
+    def do_GET(self):
+        with self.server.lock:
+            throttle = self.server.active >= self.server.capacity
+            if throttle:
+                self.server.throttled += 1
+
+        if throttle:
+            self.send_error(429)
+            return
+
+        super().do_GET()
+
+
+class LocalHttpServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for a remote HTTP server that serves a directory.
+    Use as a context manager to start and stop the server. The number of
+    accepted connections is counted in connections.
+    """
+    daemon_threads = True
+
+    def __init__(self, directory, handler=RangeRequestHandler, failures=0,
+                 capacity=None):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.directory = str(directory)
+        self.requests = []
+        self.connections = 0
+        self.failures = failures
+        self.active = 0
+        self.max_active = 0
+        self.capacity = capacity
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever)
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.server_address[1])
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+class LocalFtpServer:
+    """
+    Local stand-in for an ftp site that serves a directory. Patch
+    ftplib.FTP with connect to open connections to it. Commands of all
+    connections are recorded in commands. The first failures transfers
+    are dropped after half of the file. Set mlsd to False for a site that
+    does not support MLSD.
+    """
+
+    def __init__(self, directory, failures=0, mlsd=True):
+        self.directory = str(directory)
+        self.failures = failures
+        self.mlsd = mlsd
+        self.commands = []
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def connect(self, host=None):
+        with self.lock:
+            self.connections += 1
+        return MockFTP(self)
+
+    def path(self, ftp_path):
+        return os.path.join(self.directory, *ftp_path.strip('/').split('/'))
+
+    def record(self, command):
+        with self.lock:
+            self.commands.append(command)
+
+
+class MockFTP:
+    """Connection to a LocalFtpServer with the used part of ftplib.FTP"""
+
+    def __init__(self, server):
+        self.server = server
+
+    def login(self, *args):
+        self.server.record('USER')
+
+    def voidcmd(self, command):
+        self.server.record(command)
+
+    def nlst(self, ftp_path):
+        self.server.record('NLST {}'.format(ftp_path))
+        return sorted(os.listdir(self.server.path(ftp_path)))
+
+    def size(self, ftp_path):
+        self.server.record('SIZE {}'.format(ftp_path))
+        return os.path.getsize(self.server.path(ftp_path))
+
+    @staticmethod
+    def modify(path):
+        return time.strftime(
+            '%Y%m%d%H%M%S', time.gmtime(os.path.getmtime(path))
+        )
+
+    def mlsd(self, ftp_path, facts=None):
+        self.server.record('MLSD {}'.format(ftp_path))
+        if not self.server.mlsd:
+            raise ftplib.error_perm('500 Unknown command.')
+
+        directory = self.server.path(ftp_path)
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            yield name, {
+                'type': 'dir' if os.path.isdir(path) else 'file',
+                'size': str(os.path.getsize(path)),
+                'modify': self.modify(path),
+            }
+
+    def sendcmd(self, command):
+        self.server.record(command)
+        name, ftp_path = command.split(' ', 1)
+        if name == 'MDTM':
+            return '213 {}'.format(self.modify(self.server.path(ftp_path)))
+        raise ftplib.error_perm('500 Unknown command.')
+
+    def retrbinary(self, command, callback, blocksize=8192, rest=None):
+        self.server.record(command if rest is None else '{} REST {}'.format(
+            command, rest
+        ))
+
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(
+                self.server.max_active, self.server.active
+            )
+            fail = self.server.failures > 0
+            if fail:
+                self.server.failures -= 1
+
+        try:
+            with open(self.server.path(command.split(' ', 1)[1]), 'rb') as f:
+                content = f.read()[rest or 0:]
+
+            time.sleep(0.01)
+            end = len(content) // 2 if fail else len(content)
+            for start in range(0, end, blocksize):
+                callback(content[start:min(start + blocksize, end)])
+
+            if fail:
+                raise EOFError('Connection closed')
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def quit(self):
+        self.server.record('QUIT')
+
+    def close(self):
+        pass
@@ -0,0 +1,194 @@
+import os
+import shutil
+import threading
+import time
+
+import mock
+
+from tests.helpers import (
+    KeepAliveRequestHandler, LocalHttpServer, SlowRequestHandler
+)
+from tests.RME import RMETestCase
+from weather_forecast_retrieval import download
+from weather_forecast_retrieval.async_download import AsyncDownloader
+
+
+class TestAsyncDownloader(RMETestCase):
+    """Test downloading with asyncio"""
+
+    FILE_NAMES = [
+        'hrrr.t01z.wrfsfcf01.grib2',
+        'hrrr.t02z.wrfsfcf01.grib2',
+        'hrrr.t03z.wrfsfcf01.grib2',
+        'hrrr.t04z.wrfsfcf01.grib2',
+        'hrrr.t05z.wrfsfcf01.grib2',
+        'hrrr.t06z.wrfsfcf01.grib2',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        self.remote_dir.mkdir()
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+
+        for file_name in self.FILE_NAMES:
+            shutil.copy(
+                self.hrrr_dir.joinpath('hrrr.20180722', file_name).as_posix(),
+                self.remote_dir.as_posix()
+            )
+
+    def downloads(self, server):
+        return [
+            (
+                server.url + file_name,
+                self.local_dir.joinpath(file_name).as_posix()
+            )
+            for file_name in self.FILE_NAMES
+        ]
+
+    def test_run(self):
+        completed = []
+        subject = AsyncDownloader(
+            buffer_size=4096,
+            callback=lambda url, result: completed.append((url, result))
+        )
+
+        with LocalHttpServer(self.remote_dir) as server:
+            downloads = self.downloads(server)
+            results = subject.run(downloads)
+
+        self.assertEqual([out_file for _url, out_file in downloads], results)
+        self.assertCountEqual(downloads, completed)
+
+        for file_name in self.FILE_NAMES:
+            with open(self.remote_dir.joinpath(file_name), 'rb') as remote, \
+                    open(self.local_dir.joinpath(file_name), 'rb') as local:
+                self.assertEqual(remote.read(), local.read())
+
+    def test_host_limit(self):
+        subject = AsyncDownloader(host_limit=2)
+
+        with LocalHttpServer(
+            self.remote_dir, handler=SlowRequestHandler
+        ) as server:
+            results = subject.run(self.downloads(server))
+
+        self.assertTrue(all(results))
+        self.assertEqual(2, server.max_active)
+
+    def test_rate_limit(self):
+        subject = AsyncDownloader(rate_limit=20)
+
+        start = time.monotonic()
+        with LocalHttpServer(self.remote_dir) as server:
+            results = subject.run(self.downloads(server))
+
+        self.assertTrue(all(results))
+        # The first request starts right away
+        self.assertGreaterEqual(
+            time.monotonic() - start, (len(self.FILE_NAMES) - 1) / 20
+        )
+
+    @mock.patch.object(download, 'BACKOFF_FACTOR', 0)
+    def test_retries(self):
+        subject = AsyncDownloader(retries=2)
+
+        with LocalHttpServer(
+            self.remote_dir, handler=KeepAliveRequestHandler, failures=2
+        ) as server:
+            results = subject.run(self.downloads(server)[:1])
+
+        self.assertTrue(results[0])
+        self.assertEqual(3, len(server.requests))
+
+    def test_missing_file(self):
+        completed = []
+        subject = AsyncDownloader(
+            callback=lambda url, result: completed.append((url, result))
+        )
+
+        with LocalHttpServer(self.remote_dir) as server:
+            url = server.url + 'hrrr.t00z.wrfsfcf01.grib2'
+            results = subject.run([
+                (url, self.local_dir.joinpath('missing.grib2').as_posix())
+            ])
+
+        self.assertEqual([False], results)
+        self.assertEqual([(url, False)], completed)
+        self.assertEqual(1, len(server.requests))
+        self.assertEqual([], os.listdir(self.local_dir))
+
+    def test_resume(self):
+        file_name = self.FILE_NAMES[0]
+        with open(self.remote_dir.joinpath(file_name), 'rb') as f:
+            content = f.read()
+        with open(self.local_dir.joinpath(file_name + '.part'), 'wb') as f:
+            f.write(content[:10000])
+
+        with LocalHttpServer(self.remote_dir) as server:
+            url, out_file = self.downloads(server)[0]
+            results = AsyncDownloader().run([(url, out_file, len(content))])
+
+        self.assertEqual([out_file], results)
+        self.assertEqual('bytes=10000-', server.requests[0][2]['Range'])
+        with open(out_file, 'rb') as f:
+            self.assertEqual(content, f.read())
+
+    def test_resume_changed_file(self):
+        file_name = self.FILE_NAMES[0]
+        with open(self.remote_dir.joinpath(file_name), 'rb') as f:
+            content = f.read()
+        out_file = self.local_dir.joinpath(file_name).as_posix()
+        # partial file of an earlier version of the remote file
+        with open(download.partial_file(out_file), 'wb') as f:
+            f.write(b'GRIB' * 2500)
+        with open(download.tag_file(out_file), 'w') as f:
+            f.write('Sat, 21 Jul 2018 00:00:00 GMT')
+
+        with LocalHttpServer(self.remote_dir) as server:
+            url, out_file = self.downloads(server)[0]
+            results = AsyncDownloader().run([(url, out_file, len(content))])
+
+        self.assertEqual([out_file], results)
+        self.assertEqual(
+            'Sat, 21 Jul 2018 00:00:00 GMT',
+            server.requests[0][2]['If-Range']
+        )
+        with open(out_file, 'rb') as f:
+            self.assertEqual(content, f.read())
+        self.assertEqual([file_name], os.listdir(self.local_dir))
+
+    @mock.patch.object(download, 'BACKOFF_FACTOR', 0)
+    def test_size_mismatch(self):
+        subject = AsyncDownloader(retries=1)
+
+        with LocalHttpServer(self.remote_dir) as server:
+            url, out_file = self.downloads(server)[0]
+            results = subject.run([(url, out_file, '10K')])
+
+        self.assertEqual([False], results)
+        self.assertFalse(os.path.exists(out_file))
+
+    def test_file_access_off_the_loop(self):
+        loop_thread = threading.get_ident()
+        threads = []
+
+        def record(function):
+            def wrapper(*args, **kwargs):
+                threads.append(threading.get_ident())
+                return function(*args, **kwargs)
+            return wrapper
+
+        journal = mock.Mock()
+        journal.start.side_effect = record(lambda *args: True)
+        journal.complete.side_effect = record(lambda *args: None)
+
+        with mock.patch('os.fsync', record(os.fsync)), \
+                LocalHttpServer(self.remote_dir) as server:
+            downloads = self.downloads(server)
+            results = AsyncDownloader(journal=journal).run(downloads)
+
+        self.assertTrue(all(results))
+        self.assertEqual(3 * len(downloads), len(threads))
+        self.assertNotIn(loop_thread, threads)
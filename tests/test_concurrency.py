@@ -0,0 +1,270 @@
+import os
+import shutil
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import mock
+import requests
+
+from tests.helpers import LocalHttpServer, ThrottlingRequestHandler
+from tests.RME import RMETestCase
+from weather_forecast_retrieval import download
+from weather_forecast_retrieval.concurrency import (
+    AdaptiveConcurrency, RateLimiter
+)
+
+
+def throttled_error(status_code=429):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(response=response)
+
+
+class TestAdaptiveConcurrency(RMETestCase):
+    """Test the adaptive limit of concurrent requests"""
+
+    def setUp(self):
+        super().setUp()
+        self.subject = AdaptiveConcurrency(
+            initial=2, max_limit=4, backoff=0.05, max_backoff=0.2
+        )
+
+    def complete(self, count, size, elapsed=0.01):
+        for _ in range(count):
+            self.subject.acquire()
+            self.subject.release(size, elapsed)
+
+    def test_initial_limit(self):
+        self.assertEqual(2, self.subject.limit)
+        self.assertEqual(0, self.subject.throughput)
+        self.assertIsNone(self.subject.latency)
+        self.assertEqual(
+            4, AdaptiveConcurrency(initial=10, max_limit=4).limit
+        )
+
+    def test_grow_with_throughput(self):
+        self.complete(2, 1000)
+        self.assertEqual(3, self.subject.limit)
+        self.assertGreater(self.subject.throughput, 0)
+
+        self.complete(3, 1e9)
+        self.assertEqual(4, self.subject.limit)
+
+        # not above the maximum
+        self.complete(4, 1e12)
+        self.assertEqual(4, self.subject.limit)
+
+    def test_hold_without_throughput_rise(self):
+        self.complete(2, 1e9)
+        self.assertEqual(3, self.subject.limit)
+
+        self.complete(3, 1)
+        self.assertEqual(3, self.subject.limit)
+
+    def test_shrink_on_latency(self):
+        self.complete(2, 1000, elapsed=0.01)
+        self.assertEqual(3, self.subject.limit)
+
+        self.complete(3, 1e9, elapsed=1)
+        self.assertEqual(2, self.subject.limit)
+
+    def test_throttle(self):
+        self.subject = AdaptiveConcurrency(
+            initial=4, backoff=0.05, max_backoff=0.2
+        )
+        self.subject.acquire()
+        self.subject.release(throttled=True)
+
+        self.assertEqual(2, self.subject.limit)
+        self.assertEqual(1, self.subject.throttled)
+
+        # next request waits for the backoff with jitter
+        start = time.monotonic()
+        self.subject.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.02)
+        self.subject.release(throttled=True)
+        self.assertEqual(1, self.subject.limit)
+
+        self.subject.acquire()
+        self.subject.release(throttled=True)
+        self.assertEqual(1, self.subject.limit)
+
+    def test_limit_concurrent_requests(self):
+        active = []
+
+        def run(_):
+            with self.subject.request():
+                active.append(self.subject.active)
+                time.sleep(0.01)
+
+        with ThreadPool(6) as pool:
+            pool.map(run, range(6))
+
+        self.assertLessEqual(max(active), 4)
+        self.assertEqual(0, self.subject.active)
+
+    def test_first_in_first_out(self):
+        self.subject = AdaptiveConcurrency(initial=1, max_limit=1)
+        started = []
+
+        def run(number):
+            self.subject.acquire()
+            started.append(number)
+            self.subject.release()
+
+        self.subject.acquire()
+        threads = []
+        for number in range(5):
+            thread = threading.Thread(target=run, args=(number,))
+            thread.start()
+            threads.append(thread)
+            # wait until the thread is queued before starting the next
+            while self.subject._next_ticket < number + 2:
+                time.sleep(0.001)
+
+        self.subject.release()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(list(range(5)), started)
+
+    def test_request(self):
+        with self.subject.request() as request:
+            self.assertEqual(1, self.subject.active)
+            request.size = 100
+
+        self.assertEqual(0, self.subject.active)
+
+    def test_request_throttled(self):
+        for error in [
+            throttled_error(429), throttled_error(503), requests.Timeout()
+        ]:
+            with self.assertRaises(type(error)):
+                with self.subject.request():
+                    raise error
+
+        self.assertEqual(3, self.subject.throttled)
+        self.assertEqual(0, self.subject.active)
+
+    def test_request_error(self):
+        with self.assertRaises(requests.HTTPError):
+            with self.subject.request():
+                raise throttled_error(404)
+
+        self.assertEqual(0, self.subject.throttled)
+
+    def test_request_error_not_recorded(self):
+        self.complete(2, 1000)
+        throughput = self.subject.throughput
+
+        for _ in range(3):
+            with self.assertRaises(requests.HTTPError):
+                with self.subject.request():
+                    time.sleep(0.05)
+                    raise throttled_error(404)
+
+        self.assertEqual(3, self.subject.limit)
+        self.assertEqual(throughput, self.subject.throughput)
+
+
+class TestRateLimiter(RMETestCase):
+    """Test the token bucket for the rate of requests"""
+
+    def test_burst(self):
+        subject = RateLimiter(rate=10, burst=3)
+
+        self.assertEqual([0, 0, 0], [subject.reserve() for _ in range(3)])
+        self.assertAlmostEqual(0.1, subject.reserve(), places=2)
+        self.assertAlmostEqual(0.2, subject.reserve(), places=2)
+
+    def test_refill(self):
+        subject = RateLimiter(rate=20, burst=2)
+        subject.reserve()
+        subject.reserve()
+
+        time.sleep(0.2)
+
+        # refilled up to the burst
+        self.assertEqual([0, 0], [subject.reserve() for _ in range(2)])
+        self.assertGreater(subject.reserve(), 0)
+
+    def test_rate_of_threads(self):
+        subject = RateLimiter(rate=50, burst=1)
+        starts = []
+
+        def request(_):
+            subject.acquire()
+            starts.append(time.monotonic())
+
+        with ThreadPool(8) as pool:
+            pool.map(request, range(11))
+
+        # 10 intervals at 50 requests per second
+        self.assertGreaterEqual(max(starts) - min(starts), 0.19)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(rate=0)
+        with self.assertRaises(ValueError):
+            RateLimiter(burst=0)
+
+
+class TestAdaptiveDownloads(RMETestCase):
+    """Test adaptive downloads against a server that throttles"""
+
+    FILE_NAMES = [
+        'hrrr.t01z.wrfsfcf01.grib2',
+        'hrrr.t02z.wrfsfcf01.grib2',
+        'hrrr.t03z.wrfsfcf01.grib2',
+        'hrrr.t04z.wrfsfcf01.grib2',
+        'hrrr.t05z.wrfsfcf01.grib2',
+        'hrrr.t06z.wrfsfcf01.grib2',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        self.remote_dir.mkdir()
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+
+        for file_name in self.FILE_NAMES:
+            shutil.copy(
+                self.hrrr_dir.joinpath('hrrr.20180722', file_name).as_posix(),
+                self.remote_dir.as_posix()
+            )
+
+    @mock.patch.object(download, 'BACKOFF_FACTOR', 0)
+    def test_back_off(self):
+        subject = AdaptiveConcurrency(
+            initial=6, max_limit=6, backoff=0.05, max_backoff=0.2
+        )
+        session = download.create_session(pool_size=6, retries=0)
+
+        def fetch(file_name):
+            for _attempt in range(10):
+                try:
+                    with subject.request() as request:
+                        request.size = download.download_file(
+                            server.url + file_name,
+                            self.local_dir.joinpath(file_name).as_posix(),
+                            http_session=session
+                        )
+                    return True
+                except requests.HTTPError as e:
+                    if not download.is_throttled(e):
+                        raise
+            return False
+
+        with LocalHttpServer(
+            self.remote_dir, handler=ThrottlingRequestHandler, capacity=2
+        ) as server:
+            with ThreadPool(6) as pool:
+                results = pool.map(fetch, self.FILE_NAMES)
+
+        self.assertTrue(all(results))
+        self.assertGreater(server.throttled, 0)
+        self.assertEqual(server.throttled, subject.throttled)
+        self.assertLess(subject.limit, 6)
+        self.assertCountEqual(self.FILE_NAMES, os.listdir(self.local_dir))
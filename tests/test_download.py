@@ -0,0 +1,251 @@
+import os
+import shutil
+
+import mock
+import requests
+
+from tests.helpers import KeepAliveRequestHandler, LocalHttpServer
+from tests.RME import RMETestCase
+from weather_forecast_retrieval import download
+
+
+class TestSession(RMETestCase):
+    """Test the shared sessions"""
+
+    FILE_NAMES = [
+        'hrrr.t01z.wrfsfcf01.grib2',
+        'hrrr.t02z.wrfsfcf01.grib2',
+        'hrrr.t03z.wrfsfcf01.grib2',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        self.remote_dir.mkdir()
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+
+        for file_name in self.FILE_NAMES:
+            shutil.copy(
+                self.hrrr_dir.joinpath('hrrr.20180722', file_name).as_posix(),
+                self.remote_dir.as_posix()
+            )
+
+    def test_shared_session(self):
+        self.assertIs(download.session(4), download.session(4))
+        self.assertIsNot(download.session(4), download.session(2))
+        self.assertIsNot(download.session(4), download.session(4, 0))
+
+    def test_pool_size(self):
+        session = download.create_session(pool_size=6, retries=2)
+        adapter = session.get_adapter('https://nomads.ncep.noaa.gov')
+
+        self.assertEqual(6, adapter._pool_maxsize)
+        self.assertEqual(2, adapter.max_retries.total)
+
+    def test_keep_alive(self):
+        session = download.create_session()
+
+        with LocalHttpServer(
+            self.remote_dir, handler=KeepAliveRequestHandler
+        ) as server:
+            for file_name in self.FILE_NAMES:
+                download.download_file(
+                    server.url + file_name,
+                    self.local_dir.joinpath(file_name).as_posix(),
+                    http_session=session
+                )
+
+        self.assertEqual(3, len(server.requests))
+        self.assertEqual(1, server.connections)
+        self.assertEqual(
+            sorted(self.FILE_NAMES), sorted(os.listdir(self.local_dir))
+        )
+
+    @mock.patch.object(download, 'BACKOFF_FACTOR', 0)
+    def test_retries(self):
+        session = download.create_session(retries=2)
+        out_file = self.local_dir.joinpath(self.FILE_NAMES[0]).as_posix()
+
+        with LocalHttpServer(
+            self.remote_dir, handler=KeepAliveRequestHandler, failures=2
+        ) as server:
+            download.download_file(
+                server.url + self.FILE_NAMES[0], out_file, http_session=session
+            )
+
+        self.assertEqual(3, len(server.requests))
+        self.assertTrue(os.path.exists(out_file))
+
+    @mock.patch.object(download, 'BACKOFF_FACTOR', 0)
+    def test_retries_exhausted(self):
+        session = download.create_session(retries=1)
+        out_file = self.local_dir.joinpath(self.FILE_NAMES[0]).as_posix()
+
+        with LocalHttpServer(
+            self.remote_dir, handler=KeepAliveRequestHandler, failures=2
+        ) as server:
+            with self.assertRaises(requests.HTTPError):
+                download.download_file(
+                    server.url + self.FILE_NAMES[0],
+                    out_file,
+                    http_session=session
+                )
+
+        self.assertEqual(2, len(server.requests))
+        self.assertEqual([], os.listdir(self.local_dir))
+
+
+class TestResume(RMETestCase):
+    """Test resuming partial downloads"""
+
+    FILE_NAME = 'hrrr.t01z.wrfsfcf01.grib2'
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        self.remote_dir.mkdir()
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+
+        source_file = self.hrrr_dir.joinpath('hrrr.20180722', self.FILE_NAME)
+        shutil.copy(source_file.as_posix(), self.remote_dir.as_posix())
+        with open(source_file, 'rb') as f:
+            self.content = f.read()
+
+        self.out_file = self.local_dir.joinpath(self.FILE_NAME).as_posix()
+
+    def write_partial(self, content):
+        with open(download.partial_file(self.out_file), 'wb') as f:
+            f.write(content)
+
+    def test_size_matches(self):
+        self.assertTrue(download.size_matches(100, None))
+        self.assertTrue(download.size_matches(100, 100))
+        self.assertFalse(download.size_matches(99, 100))
+        self.assertTrue(download.size_matches(512, '512'))
+        self.assertTrue(download.size_matches(9500, '9.3K'))
+        self.assertFalse(download.size_matches(9000, '9.3K'))
+        self.assertTrue(download.size_matches(141 * 1024 ** 2 + 10, '141M'))
+        self.assertFalse(download.size_matches(10, '141M'))
+        self.assertTrue(download.size_matches(10, '-'))
+
+    def test_content_size(self):
+        self.assertEqual(
+            200, download.content_size(206, {'Content-Range': 'bytes 100-199/200'})
+        )
+        self.assertIsNone(
+            download.content_size(206, {'Content-Range': 'bytes 100-199/*'})
+        )
+        self.assertEqual(
+            100, download.content_size(200, {'Content-Length': '100'})
+        )
+        self.assertIsNone(download.content_size(200, {}))
+
+    def test_resume(self):
+        self.write_partial(self.content[:1000])
+
+        with LocalHttpServer(self.remote_dir) as server:
+            size = download.download_file(
+                server.url + self.FILE_NAME, self.out_file
+            )
+
+        self.assertEqual(len(self.content), size)
+        self.assertEqual('bytes=1000-', server.requests[0][2]['Range'])
+        with open(self.out_file, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+        self.assertEqual([self.FILE_NAME], os.listdir(self.local_dir))
+
+    def test_resume_tag(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            with self.assertRaises(IOError):
+                download.download_file(
+                    server.url + self.FILE_NAME, self.out_file, size=10
+                )
+            tag = download.read_tag(self.out_file)
+            self.assertIsNotNone(tag)
+
+            # unchanged remote file, resumed with the tag
+            self.write_partial(self.content[:1000])
+            download.download_file(server.url + self.FILE_NAME, self.out_file)
+
+        self.assertEqual(tag, server.requests[1][2]['If-Range'])
+        self.assertEqual('bytes=1000-', server.requests[1][2]['Range'])
+        with open(self.out_file, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+        self.assertEqual([self.FILE_NAME], os.listdir(self.local_dir))
+
+    def test_resume_changed_file(self):
+        # partial file of an earlier version of the remote file
+        self.write_partial(b'GRIB' * 250)
+        with open(download.tag_file(self.out_file), 'w') as f:
+            f.write('Sat, 21 Jul 2018 00:00:00 GMT')
+
+        with LocalHttpServer(self.remote_dir) as server:
+            size = download.download_file(
+                server.url + self.FILE_NAME, self.out_file
+            )
+
+        self.assertEqual(1, len(server.requests))
+        self.assertEqual(len(self.content), size)
+        with open(self.out_file, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+        self.assertEqual([self.FILE_NAME], os.listdir(self.local_dir))
+
+    def test_range_header(self):
+        self.assertEqual({}, download.range_header(0, 'tag'))
+        self.assertEqual(
+            {'Range': 'bytes=10-'}, download.range_header(10)
+        )
+        self.assertEqual(
+            {'Range': 'bytes=10-', 'If-Range': '"abc"'},
+            download.range_header(10, '"abc"')
+        )
+
+    def test_resume_tag_of_headers(self):
+        self.assertEqual('"abc"', download.resume_tag({
+            'ETag': '"abc"', 'Last-Modified': 'Sun, 22 Jul 2018 03:52:00 GMT'
+        }))
+        self.assertEqual(
+            'Sun, 22 Jul 2018 03:52:00 GMT',
+            download.resume_tag({
+                'ETag': 'W/"abc"',
+                'Last-Modified': 'Sun, 22 Jul 2018 03:52:00 GMT'
+            })
+        )
+        self.assertIsNone(download.resume_tag({}))
+
+    def test_resume_too_large(self):
+        self.write_partial(self.content + b'7777')
+
+        with LocalHttpServer(self.remote_dir) as server:
+            download.download_file(server.url + self.FILE_NAME, self.out_file)
+
+        # Range not satisfiable and download again from the start
+        self.assertEqual(2, len(server.requests))
+        with open(self.out_file, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+
+    def test_no_resume(self):
+        self.write_partial(b'GRIB')
+
+        with LocalHttpServer(self.remote_dir) as server:
+            download.download_file(
+                server.url + self.FILE_NAME, self.out_file, resume=False
+            )
+
+        self.assertNotIn('Range', server.requests[0][2])
+        with open(self.out_file, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+
+    def test_size_mismatch(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            with self.assertRaises(IOError):
+                download.download_file(
+                    server.url + self.FILE_NAME, self.out_file, size=10
+                )
+
+        self.assertFalse(os.path.exists(self.out_file))
+        self.assertEqual(
+            len(self.content), download.partial_size(self.out_file)
+        )
@@ -0,0 +1,125 @@
+import mock
+
+from tests.helpers import grib_message
+from tests.RME import RMETestCase
+from weather_forecast_retrieval import download
+from weather_forecast_retrieval.grib_framing import (
+    GribFramingError, GribFramingValidator
+)
+
+
+class TestGribFramingValidator(RMETestCase):
+    """Test checking the GRIB2 framing while a file is written"""
+
+    def setUp(self):
+        super().setUp()
+        with open(self.hrrr_dir.joinpath(
+            'hrrr.20180722', 'hrrr.t01z.wrfsfcf01.grib2'
+        ), 'rb') as f:
+            self.content = f.read()
+
+    def validate(self, content, chunk_size=1024, messages=None):
+        subject = GribFramingValidator(messages)
+        for start in range(0, len(content), chunk_size):
+            subject.update(content[start:start + chunk_size])
+        return subject.close()
+
+    def test_valid_file(self):
+        for chunk_size in [1, 7, 1024, len(self.content)]:
+            self.assertEqual(
+                52, self.validate(self.content, chunk_size=chunk_size)
+            )
+
+    def test_messages(self):
+        self.assertEqual(
+            2, self.validate(grib_message() * 2, messages=2)
+        )
+        with self.assertRaisesRegex(GribFramingError, 'expected 3'):
+            self.validate(grib_message() * 2, messages=3)
+
+    def test_error_is_validation_error(self):
+        self.assertTrue(issubclass(GribFramingError, download.ValidationError))
+        self.assertTrue(issubclass(GribFramingError, IOError))
+
+    def test_empty(self):
+        with self.assertRaisesRegex(GribFramingError, 'no GRIB messages'):
+            self.validate(b'')
+
+    def test_truncated(self):
+        with self.assertRaisesRegex(GribFramingError, 'within message 52'):
+            self.validate(self.content[:-1])
+        with self.assertRaisesRegex(GribFramingError, 'within message 1'):
+            self.validate(self.content[:10])
+
+    def test_not_grib(self):
+        with self.assertRaisesRegex(GribFramingError, 'Expected GRIB'):
+            self.validate(b'<html>Not Found</html>' + b' ' * 100)
+
+    def test_edition(self):
+        content = bytearray(grib_message())
+        content[7] = 1
+        with self.assertRaisesRegex(GribFramingError, 'edition 1'):
+            self.validate(bytes(content))
+
+    def test_missing_end(self):
+        content = self.content[:-4] + b'\x00' * 4
+        with self.assertRaises(GribFramingError):
+            self.validate(content)
+
+    def test_message_length(self):
+        # message length is one byte longer than the sections
+        content = bytearray(grib_message())
+        content[15] += 1
+        with self.assertRaisesRegex(GribFramingError, 'Message 1'):
+            self.validate(bytes(content) + b'\x00')
+
+    def test_section_length(self):
+        content = bytearray(grib_message())
+        content[19] += 100
+        with self.assertRaisesRegex(GribFramingError, 'does not fit'):
+            self.validate(bytes(content))
+
+    def test_unknown_section(self):
+        content = bytearray(grib_message())
+        content[20] = 9
+        with self.assertRaisesRegex(GribFramingError, 'Unknown section 9'):
+            self.validate(bytes(content))
+
+    def test_trailing_bytes(self):
+        with self.assertRaisesRegex(GribFramingError, 'within message 53'):
+            self.validate(self.content + b'GR')
+
+    def read(self, content):
+        file_name = self.output_path.joinpath('file.grib2')
+        file_name.write_bytes(content)
+        with open(file_name, 'rb') as f:
+            return GribFramingValidator().read(f)
+
+    def test_read_file(self):
+        self.assertEqual(52, self.read(self.content))
+
+    def test_read_truncated_file(self):
+        with self.assertRaisesRegex(GribFramingError, 'within message 52'):
+            self.read(self.content[:-1])
+        # truncated within the contents of a section
+        with self.assertRaisesRegex(GribFramingError, 'within message 1'):
+            self.read(self.content[:100])
+        with self.assertRaisesRegex(GribFramingError, 'no GRIB messages'):
+            self.read(b'')
+
+    def test_download_removes_invalid_partial(self):
+        out_file = self.output_path.joinpath('file.grib2').as_posix()
+        response = mock.MagicMock(status_code=200, headers={})
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [self.content[:-4], b'0000']
+        session = mock.MagicMock()
+        session.get.return_value = response
+
+        with self.assertRaises(GribFramingError):
+            download.download_file(
+                'http://localhost/file.grib2', out_file,
+                http_session=session, validator=GribFramingValidator()
+            )
+
+        self.assertEqual(0, download.partial_size(out_file))
+        self.assertFalse(self.output_path.joinpath('file.grib2').exists())
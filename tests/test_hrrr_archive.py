@@ -2,14 +2,25 @@
 # -*- coding: utf-8 -*-
 
 import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import partial
 
 import mock
 import numpy as np
 import pandas as pd
 
-from tests.helpers import mocked_requests_get
+import tests.helpers
+from tests.helpers import (
+    LocalHttpServer, ThrottlingRequestHandler, mocked_requests_get
+)
 from tests.RME import RMETestCase
-from weather_forecast_retrieval import hrrr_archive
+from weather_forecast_retrieval import download, hrrr_archive, scheduler
+from weather_forecast_retrieval.concurrency import AdaptiveConcurrency
+from weather_forecast_retrieval.data.hrrr import GribFile, GribInventory
+from weather_forecast_retrieval.scheduler import JobScheduler
 
 
 def compare_gold(v_name, gold_dir, test_df):
@@ -72,13 +83,573 @@ class TestHRRRArchive(RMETestCase):
             forecasts=0
         )
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_download_archive(self, mock_get):
 
         hrrr_archive.HRRR_from_UofU(
             self.start_date,
             self.end_date,
             self.output_path.as_posix(),
-            forecasts=[1]
+            forecasts=[1],
+            blackout=None
         )
         self.assertTrue(mock_get.call_count == 1)
+
+
+class TestHRRRArchiveBackfill(RMETestCase):
+    """Test downloading a range of hours concurrently"""
+
+    start_date = pd.to_datetime('2018-07-22 00:00')
+    end_date = pd.to_datetime('2018-07-22 05:00')
+
+    def setUp(self):
+        super().setUp()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.files = []
+
+    def download_url(self, fname, OUTDIR, logger, file_day, **kwargs):
+        kwargs['rate_limiter'].acquire()
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.files.append((file_day, fname))
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        return True
+
+    def test_concurrent_downloads(self):
+        with mock.patch.object(
+            hrrr_archive, 'download_url', side_effect=self.download_url
+        ), mock.patch('time.sleep', wraps=time.sleep) as sleep:
+            results = hrrr_archive.HRRR_from_UofU(
+                self.start_date,
+                self.end_date,
+                self.output_path.as_posix(),
+                forecasts=[1, 2],
+                workers=3,
+                rate=1000,
+                burst=6,
+                blackout=None
+            )
+
+        self.assertEqual([True] * 12, results)
+        self.assertEqual(12, len(set(self.files)))
+        self.assertIn(
+            (self.start_date.date(), 'hrrr.t05z.wrfsfcf02.grib2'), self.files
+        )
+        self.assertGreater(self.max_active, 1)
+        self.assertLessEqual(self.max_active, 3)
+
+        # only the sleep of the mocked downloads, none between files and
+        # hours
+        self.assertEqual(12, sleep.call_count)
+
+    def test_rate_limit(self):
+        with mock.patch.object(
+            hrrr_archive, 'download_url', side_effect=self.download_url
+        ):
+            start = time.monotonic()
+            hrrr_archive.HRRR_from_UofU(
+                self.start_date,
+                self.end_date,
+                self.output_path.as_posix(),
+                forecasts=[1],
+                workers=6,
+                rate=20,
+                burst=1,
+                blackout=None
+            )
+
+        # 6 files start at 20 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_download_url_rate_limiter(self):
+        rate_limiter = mock.MagicMock()
+        session = mock.MagicMock()
+
+        hrrr_archive.download_url(
+            'hrrr.t01z.wrfsfcf01.grib2', self.output_path.as_posix(),
+            mock.MagicMock(), self.start_date, http_session=session,
+            rate_limiter=rate_limiter
+        )
+
+        rate_limiter.acquire.assert_called_once()
+
+
+class TestHRRRArchiveSubset(RMETestCase):
+    """Test downloading a subset of the messages from the archive"""
+
+    FILE_NAME = 'hrrr.t00z.wrfsfcf01.grib2'
+    FILE_DAY = pd.to_datetime('2018-07-22')
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        archive_dir = self.remote_dir.joinpath('hrrr', 'sfc', '20180722')
+        archive_dir.mkdir(parents=True)
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+
+        self.source_file = self.hrrr_dir.joinpath(
+            'hrrr.20180722', self.FILE_NAME
+        )
+        shutil.copy(self.source_file.as_posix(), archive_dir.as_posix())
+        self.inventory = archive_dir.joinpath(
+            self.FILE_NAME + GribInventory.SUFFIX
+        )
+        shutil.copy(
+            self.basin_dir.joinpath(
+                '..', 'nomads', self.FILE_NAME + GribInventory.SUFFIX
+            ).as_posix(),
+            self.inventory.as_posix()
+        )
+
+    def download_url(self, server, **kwargs):
+        with mock.patch.object(hrrr_archive, 'ARCHIVE_URL', server.url):
+            return hrrr_archive.download_url(
+                self.FILE_NAME, self.local_dir.as_posix(), mock.MagicMock(),
+                self.FILE_DAY, http_session=download.create_session(),
+                **kwargs
+            )
+
+    def test_download_subset(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            self.assertTrue(self.download_url(
+                server, variables=GribInventory.VARIABLES
+            ))
+
+        out_file = self.local_dir.joinpath(
+            'hrrr.20180722', self.FILE_NAME
+        ).as_posix()
+        self.assertLess(
+            os.path.getsize(out_file), os.path.getsize(self.source_file)
+        )
+
+        # Inventory and one request for each group of adjacent messages
+        self.assertEqual(6, len(server.requests))
+        self.assertFalse(any(
+            request[0] == 'HEAD' for request in server.requests
+        ))
+
+        grib_file = GribFile(config=tests.helpers.LOG_ERROR_CONFIG)
+        grib_file.bbox = self.BBOX
+        for key in ['air_temp', 'precip_int']:
+            expected = grib_file.load_variable(
+                self.source_file.as_posix(), key, GribFile.VAR_MAP[key]
+            )
+            subset = grib_file.load_variable(
+                out_file, key, GribFile.VAR_MAP[key]
+            )
+            np.testing.assert_array_equal(
+                expected[key].values, subset[key].values
+            )
+
+    def test_download_subset_without_inventory(self):
+        os.remove(self.inventory)
+
+        with LocalHttpServer(self.remote_dir) as server:
+            self.assertFalse(self.download_url(
+                server, variables=['TMP:2 m']
+            ))
+
+        self.assertEqual(
+            [], os.listdir(self.local_dir.joinpath('hrrr.20180722'))
+        )
+
+    def test_backfill_subset(self):
+        with mock.patch.object(hrrr_archive, 'download_url') as download_url:
+            hrrr_archive.HRRR_from_UofU(
+                self.FILE_DAY, self.FILE_DAY + pd.Timedelta(hours=1),
+                self.local_dir.as_posix(), forecasts=[1], rate=1000,
+                variables=['TMP:2 m'], blackout=None
+            )
+
+        self.assertEqual(2, download_url.call_count)
+        for call in download_url.call_args_list:
+            self.assertEqual(['TMP:2 m'], call[1]['variables'])
+
+
+class TestHRRRArchiveAdaptive(RMETestCase):
+    """Test adapting the concurrent downloads to throttling"""
+
+    start_date = pd.to_datetime('2018-07-22 00:00')
+    end_date = pd.to_datetime('2018-07-22 05:00')
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        archive_dir = self.remote_dir.joinpath('hrrr', 'sfc', '20180722')
+        archive_dir.mkdir(parents=True)
+        for hour in range(6):
+            shutil.copy(
+                self.hrrr_dir.joinpath(
+                    'hrrr.20180722', 'hrrr.t{:02d}z.wrfsfcf01.grib2'.format(hour)
+                ).as_posix(),
+                archive_dir.as_posix()
+            )
+
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+        self.controllers = []
+
+    def adaptive_concurrency(self, **kwargs):
+        controller = AdaptiveConcurrency(
+            backoff=0.05, max_backoff=0.2, **kwargs
+        )
+        self.controllers.append(controller)
+        return controller
+
+    def test_throttled(self):
+        with LocalHttpServer(
+            self.remote_dir, handler=ThrottlingRequestHandler, capacity=1
+        ) as server, mock.patch.object(
+            hrrr_archive, 'ARCHIVE_URL', server.url
+        ), mock.patch.object(
+            hrrr_archive, 'AdaptiveConcurrency',
+            side_effect=self.adaptive_concurrency
+        ), mock.patch.object(
+            hrrr_archive, 'download_adaptive',
+            partial(hrrr_archive.download_adaptive, retries=10)
+        ):
+            results = hrrr_archive.HRRR_from_UofU(
+                self.start_date,
+                self.end_date,
+                self.local_dir.as_posix(),
+                forecasts=[1],
+                workers=4,
+                rate=1000,
+                burst=6,
+                blackout=None,
+                adaptive=True
+            )
+
+        self.assertEqual([True] * 6, results)
+        self.assertEqual(1, len(self.controllers))
+        self.assertEqual(4, self.controllers[0].max_limit)
+        # every throttled request reached the controller
+        self.assertGreater(server.throttled, 0)
+        self.assertEqual(server.throttled, self.controllers[0].throttled)
+
+    def test_cli(self):
+        with mock.patch.object(hrrr_archive, 'HRRR_from_UofU') as backfill, \
+                mock.patch('sys.argv', [
+                    'hrrr_archive', '-s', '2018-07-22 00:00',
+                    '-e', '2018-07-22 05:00', '-o', 'output', '--adaptive'
+                ]):
+            hrrr_archive.cli()
+
+        self.assertTrue(backfill.call_args[1]['adaptive'])
+
+
+class TestHRRRArchiveDownload(RMETestCase):
+    """Test downloading complete files from the archive"""
+
+    FILE_NAME = 'hrrr.t01z.wrfsfcf01.grib2'
+    FILE_DAY = pd.to_datetime('2018-07-22')
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        archive_dir = self.remote_dir.joinpath('hrrr', 'sfc', '20180722')
+        archive_dir.mkdir(parents=True)
+        self.source_file = self.hrrr_dir.joinpath(
+            'hrrr.20180722', self.FILE_NAME
+        )
+        shutil.copy(self.source_file.as_posix(), archive_dir.as_posix())
+
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+        self.out_file = self.local_dir.joinpath('hrrr.20180722', self.FILE_NAME)
+
+    def download_url(self, server):
+        with mock.patch.object(hrrr_archive, 'ARCHIVE_URL', server.url):
+            return hrrr_archive.download_url(
+                self.FILE_NAME, self.local_dir.as_posix(), mock.MagicMock(),
+                self.FILE_DAY, http_session=download.create_session()
+            )
+
+    def test_single_request(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            self.assertTrue(self.download_url(server))
+
+        self.assertEqual(['GET'], [request[0] for request in server.requests])
+        self.assertEqual(
+            self.source_file.read_bytes(), self.out_file.read_bytes()
+        )
+
+    def test_skip_complete_file(self):
+        self.out_file.parent.mkdir()
+        shutil.copy(self.source_file.as_posix(), self.out_file.as_posix())
+
+        with LocalHttpServer(self.remote_dir) as server:
+            self.assertTrue(self.download_url(server))
+
+        self.assertEqual([], server.requests)
+
+    def test_replace_truncated_file(self):
+        self.out_file.parent.mkdir()
+        self.out_file.write_bytes(self.source_file.read_bytes()[:1000])
+
+        with LocalHttpServer(self.remote_dir) as server:
+            self.assertTrue(self.download_url(server))
+
+        self.assertEqual(1, len(server.requests))
+        self.assertEqual(
+            self.source_file.read_bytes(), self.out_file.read_bytes()
+        )
+
+    def test_missing_file(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            with mock.patch.object(
+                hrrr_archive, 'ARCHIVE_URL', server.url
+            ):
+                self.assertFalse(hrrr_archive.download_url(
+                    'hrrr.t02z.wrfsfcf01.grib2', self.local_dir.as_posix(),
+                    mock.MagicMock(), self.FILE_DAY,
+                    http_session=download.create_session(retries=0)
+                ))
+
+        self.assertEqual(1, len(server.requests))
+        self.assertEqual(
+            [], os.listdir(self.local_dir.joinpath('hrrr.20180722'))
+        )
+
+
+class TestHRRRArchivePlan(RMETestCase):
+    """Test planning a backfill from the files in the save_dir"""
+
+    start_date = pd.to_datetime('2018-07-22 01:00')
+    end_date = pd.to_datetime('2018-07-22 02:00')
+
+    def setUp(self):
+        super().setUp()
+        self.save_dir = self.output_path.joinpath('save')
+        day_dir = self.save_dir.joinpath('hrrr.20180722')
+        day_dir.mkdir(parents=True)
+        self.save_dir.joinpath('hrrr.20180721').mkdir()
+
+        self.source_file = self.hrrr_dir.joinpath(
+            'hrrr.20180722', 'hrrr.t01z.wrfsfcf01.grib2'
+        )
+        shutil.copy(self.source_file.as_posix(), day_dir.as_posix())
+        day_dir.joinpath('hrrr.t02z.wrfsfcf01.grib2').write_bytes(
+            self.source_file.read_bytes()[:1000]
+        )
+
+    def plan(self, **kwargs):
+        return hrrr_archive.plan_backfill(
+            self.start_date, self.end_date, self.save_dir.as_posix(),
+            forecasts=[1, 2], **kwargs
+        )
+
+    def test_plan(self):
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            plan = self.plan()
+
+        self.assertEqual(
+            [
+                ('hrrr.t01z.wrfsfcf01.grib2', hrrr_archive.COMPLETE),
+                ('hrrr.t01z.wrfsfcf02.grib2', hrrr_archive.MISSING),
+                ('hrrr.t02z.wrfsfcf01.grib2', hrrr_archive.INVALID),
+                ('hrrr.t02z.wrfsfcf02.grib2', hrrr_archive.MISSING),
+            ],
+            list(zip(plan.file_name, plan.status))
+        )
+        self.assertEqual(
+            self.save_dir.joinpath(
+                'hrrr.20180722', 'hrrr.t01z.wrfsfcf02.grib2'
+            ).as_posix(),
+            plan.out_file[1]
+        )
+
+        # one listing of the save_dir and the day in the date range
+        self.assertEqual(2, scandir.call_count)
+
+    def test_plan_without_validate(self):
+        plan = self.plan(validate=False)
+
+        self.assertEqual(
+            [hrrr_archive.COMPLETE, hrrr_archive.MISSING] * 2,
+            list(plan.status)
+        )
+
+    def test_estimate(self):
+        estimate = hrrr_archive.estimate_backfill(
+            self.plan(), rate=0.2, bandwidth=1
+        )
+
+        file_size = os.path.getsize(self.source_file)
+        self.assertEqual(3, estimate['files'])
+        self.assertEqual(2, estimate['missing'])
+        self.assertEqual(1, estimate['invalid'])
+        self.assertEqual(3 * file_size, estimate['bytes'])
+        self.assertEqual(3 * file_size, estimate['duration'].total_seconds())
+
+    def test_estimate_without_complete_files(self):
+        plan = self.plan()
+        plan = plan[plan.status != hrrr_archive.COMPLETE]
+
+        estimate = hrrr_archive.estimate_backfill(
+            plan, var_type='prs', rate=0.01
+        )
+
+        self.assertEqual(
+            3 * hrrr_archive.FILE_SIZES['prs'], estimate['bytes']
+        )
+        # bound by the rate of 0.01 files per second
+        self.assertEqual(300, estimate['duration'].total_seconds())
+        self.assertEqual(
+            3 * hrrr_archive.SUBSET_FILE_SIZE,
+            hrrr_archive.estimate_backfill(
+                plan, variables=['TMP:2 m']
+            )['bytes']
+        )
+
+    def test_dry_run(self):
+        with mock.patch.object(hrrr_archive, 'download_url') as download_url:
+            plan = hrrr_archive.HRRR_from_UofU(
+                self.start_date, self.end_date, self.save_dir.as_posix(),
+                forecasts=[1, 2], dry_run=True
+            )
+
+        download_url.assert_not_called()
+        self.assertEqual(4, len(plan))
+
+    def test_download_missing(self):
+        with mock.patch.object(
+            hrrr_archive, 'download_url', return_value=True
+        ) as download_url:
+            results = hrrr_archive.HRRR_from_UofU(
+                self.start_date, self.end_date, self.save_dir.as_posix(),
+                forecasts=[1, 2], rate=1000, blackout=None
+            )
+
+        self.assertEqual([True] * 3, results)
+        self.assertCountEqual(
+            [
+                'hrrr.t01z.wrfsfcf02.grib2',
+                'hrrr.t02z.wrfsfcf01.grib2',
+                'hrrr.t02z.wrfsfcf02.grib2',
+            ],
+            [call[0][0] for call in download_url.call_args_list]
+        )
+
+    def test_preprocess_during_blackout(self):
+        # the blackout ends after 0.3 seconds
+        release = time.monotonic() + 0.3
+        blackout = mock.MagicMock()
+        blackout.end.side_effect = lambda now: \
+            now + timedelta(seconds=0.1) \
+            if time.monotonic() < release else None
+        events = []
+
+        def download_url(fname, *args, **kwargs):
+            events.append(('download', fname))
+            return True
+
+        def crop_file(out_file):
+            events.append(('crop', os.path.basename(out_file)))
+            return out_file
+
+        with mock.patch.object(
+            hrrr_archive, 'download_url', side_effect=download_url
+        ), mock.patch.object(
+            hrrr_archive, 'HRRRPreprocessor'
+        ) as preprocessor:
+            preprocessor.return_value.crop_file.side_effect = crop_file
+            results = hrrr_archive.HRRR_from_UofU(
+                self.start_date, self.end_date, self.save_dir.as_posix(),
+                forecasts=[1, 2], rate=1000, blackout=blackout,
+                bbox=['-119', '-118', '37', '38'], output_path='cropped'
+            )
+
+        self.assertEqual([True] * 3, results)
+        self.assertEqual(
+            self.save_dir.as_posix(), preprocessor.call_args[0][0]
+        )
+        # the complete file is cropped while the downloads are deferred
+        self.assertEqual(('crop', 'hrrr.t01z.wrfsfcf01.grib2'), events[0])
+        self.assertCountEqual(
+            [
+                'hrrr.t01z.wrfsfcf01.grib2',
+                'hrrr.t01z.wrfsfcf02.grib2',
+                'hrrr.t02z.wrfsfcf01.grib2',
+                'hrrr.t02z.wrfsfcf02.grib2',
+            ],
+            [name for event, name in events if event == 'crop']
+        )
+        for event, name in events[1:]:
+            if event == 'crop':
+                self.assertLess(
+                    events.index(('download', name)),
+                    events.index(('crop', name))
+                )
+
+    def test_cli_preprocess(self):
+        with mock.patch.object(hrrr_archive, 'HRRR_from_UofU') as backfill, \
+                mock.patch('sys.argv', [
+                    'hrrr_archive', '-s', '2018-07-22 00:00',
+                    '-e', '2018-07-22 05:00', '-o', 'output',
+                    '--bbox', '-119, -118, 37, 38', '-p', 'cropped'
+                ]):
+            hrrr_archive.cli()
+
+        self.assertEqual(
+            ['-119', '-118', '37', '38'], backfill.call_args[1]['bbox']
+        )
+        self.assertEqual('cropped', backfill.call_args[1]['output_path'])
+
+
+class TestHRRRArchiveBlackout(RMETestCase):
+    """Test deferring the archive downloads during the blackout"""
+
+    def test_archive_blackout(self):
+        blackout = hrrr_archive.ARCHIVE_BLACKOUT
+
+        self.assertIsNone(blackout.end(
+            hrrr_archive.tzmdt.localize(datetime(2018, 7, 22, 3, 30))
+        ))
+        self.assertIsNone(blackout.end(
+            hrrr_archive.tzmdt.localize(datetime(2018, 7, 22, 4, 45))
+        ))
+        self.assertEqual(
+            hrrr_archive.tzmdt.localize(datetime(2018, 7, 22, 4, 0)),
+            blackout.end(
+                hrrr_archive.tzmdt.localize(datetime(2018, 7, 22, 3, 31))
+            )
+        )
+
+    def test_shared_scheduler(self):
+        # the blackout ends after 0.3 seconds
+        release = time.monotonic() + 0.3
+        blackout = mock.MagicMock()
+        blackout.end.side_effect = lambda now: \
+            now + timedelta(seconds=0.1) \
+            if time.monotonic() < release else None
+        job_scheduler = JobScheduler(workers=2)
+
+        with mock.patch.object(
+            hrrr_archive, 'download_url', return_value=True
+        ) as download_url:
+            jobs = hrrr_archive.HRRR_from_UofU(
+                pd.to_datetime('2018-07-22 00:00'),
+                pd.to_datetime('2018-07-22 01:00'),
+                self.output_path.as_posix(), forecasts=[1], rate=1000,
+                blackout=blackout, job_scheduler=job_scheduler
+            )
+            local = job_scheduler.submit(lambda: download_url.call_count)
+
+            self.assertEqual(2, len(jobs))
+            download_url.assert_not_called()
+
+            job_scheduler.run()
+
+        # the local job ran while the archive was in the blackout
+        self.assertEqual(0, local.result)
+        self.assertEqual([True, True], [job.result for job in jobs])
+        self.assertEqual(
+            {scheduler.COMPLETE: 3}, job_scheduler.status()
+        )
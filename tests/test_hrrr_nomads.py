@@ -1,8 +1,19 @@
-import mock
+import os
+import shutil
+import threading
+import time
 import unittest
+from datetime import datetime, timedelta
+
+import mock
+import requests
 
-from tests.helpers import mocked_requests_get, skip_on_github_actions
+from tests.helpers import (
+    LocalHttpServer, SlowRequestHandler, mocked_requests_get,
+    skip_on_github_actions
+)
 from tests.RME import RMETestCase
+from weather_forecast_retrieval.data.hrrr import HttpRetrieval
 from weather_forecast_retrieval.hrrr_nomads import HRRRNOMADS, main, parse_args
 
 START_DATE = '2019-07-10 09:00:00'
@@ -18,27 +29,29 @@ class TestHRRRNOMADS(RMETestCase):
 
     def test_init(self):
         self.assertTrue(self.subject.num_requests == 2)
+        self.assertEqual(2, self.subject.http_retrieval.number_requests)
+        self.assertIsNone(self.subject.http_retrieval.concurrency)
         self.assertFalse(self.subject.verbose)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_date_range(self, mock_get):
         res = self.subject.date_range(START_DATE, END_DATE)
         self.assertTrue(len(res) == 2)
         self.assertTrue(mock_get.call_count == 3)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_date_range_forecast_hr(self, mock_get):
         res = self.subject.date_range(START_DATE, END_DATE, forecast_hrs=[0, 1])
         self.assertTrue(len(res) == 2)
         self.assertTrue(mock_get.call_count == 3)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_date_range_forecast_hr_00(self, mock_get):
         res = self.subject.date_range(START_DATE, END_DATE, forecast_hrs=[0])
         self.assertTrue(len(res) == 1)
         self.assertTrue(mock_get.call_count == 2)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_latest_no_files(self, mock_get):
         res = self.subject.latest()
         self.assertIsNone(res)
@@ -71,6 +84,267 @@ class TestHRRRNOMADS(RMETestCase):
             )
 
 
+class NOMADSServerTestCase(RMETestCase):
+    """Serve a NOMADS listing of the test files with a local server"""
+
+    FILE_NAMES = [
+        'hrrr.t01z.wrfsfcf01.grib2',
+        'hrrr.t02z.wrfsfcf01.grib2',
+        'hrrr.t03z.wrfsfcf01.grib2',
+    ]
+    LISTING_ROW = '<a href="{0}">{0}</a>    22-Jul-2018 03:52  {1}\n'
+
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.output_path.joinpath('remote')
+        listing_dir = self.remote_dir.joinpath('hrrr.20180722', 'conus')
+        listing_dir.mkdir(parents=True)
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+
+        self.listing_dir = listing_dir
+        self.publish(self.FILE_NAMES)
+
+        self.subject = HRRRNOMADS(
+            output_dir=self.local_dir.as_posix(), num_requests=1
+        )
+
+    def publish(self, file_names, modified=None):
+        listing = '<html><body><pre>\n'
+        for file_name in file_names:
+            source = self.hrrr_dir.joinpath('hrrr.20180722', file_name)
+            shutil.copy(source.as_posix(), self.listing_dir.as_posix())
+            listing += self.LISTING_ROW.format(
+                file_name, os.path.getsize(source)
+            )
+        listing += '</pre></body></html>'
+
+        index = self.listing_dir.joinpath('index.html')
+        with open(index, 'w') as f:
+            f.write(listing)
+        if modified is not None:
+            os.utime(index, (modified, modified))
+
+
+class TestHRRRNOMADSPipeline(NOMADSServerTestCase):
+    """Test cropping files while downloading"""
+
+    @mock.patch('weather_forecast_retrieval.hrrr_nomads.HRRRPreprocessor')
+    def test_pipeline(self, preprocessor):
+        crop_starts = []
+
+        def crop_file(file):
+            crop_starts.append(time.monotonic())
+            return file
+
+        preprocessor.return_value.crop_file.side_effect = crop_file
+
+        with LocalHttpServer(
+            self.remote_dir, handler=SlowRequestHandler
+        ) as server:
+            request_times = []
+            server.process_request = self.record(
+                server.process_request, request_times
+            )
+            with mock.patch.object(
+                HttpRetrieval, 'URL', server.url + 'hrrr.{}/conus/'
+            ):
+                with self.subject.pipeline(BBOX, self.output_path.as_posix()):
+                    results = self.subject.date_range(
+                        '2018-07-22 01:00', '2018-07-22 03:00', [1]
+                    )
+
+        downloaded = [
+            self.local_dir.joinpath('hrrr.20180722', file_name).as_posix()
+            for file_name in self.FILE_NAMES
+        ]
+        self.assertEqual(downloaded, results)
+        self.assertCountEqual(downloaded, self.subject.cropped_files)
+        self.assertEqual(
+            None, preprocessor.call_args[0][1],
+            'Preprocessor does not need dates'
+        )
+        # the first file is cropped before the last download started
+        self.assertLess(min(crop_starts), max(request_times))
+        self.assertIsNone(self.subject.http_retrieval.callback)
+
+    @mock.patch('weather_forecast_retrieval.hrrr_nomads.HRRRPreprocessor')
+    def test_pipeline_crop_error(self, preprocessor):
+        preprocessor.return_value.crop_file.side_effect = IOError('wgrib2')
+
+        with LocalHttpServer(self.remote_dir) as server:
+            with mock.patch.object(
+                HttpRetrieval, 'URL', server.url + 'hrrr.{}/conus/'
+            ):
+                with self.subject.pipeline(BBOX, self.output_path.as_posix()):
+                    results = self.subject.date_range(
+                        '2018-07-22 01:00', '2018-07-22 03:00', [1]
+                    )
+
+        self.assertTrue(all(results))
+        self.assertEqual([], self.subject.cropped_files)
+
+    @staticmethod
+    def record(process_request, times):
+        def wrapper(*args):
+            times.append(time.monotonic())
+            return process_request(*args)
+        return wrapper
+
+    @mock.patch('weather_forecast_retrieval.hrrr_nomads.HRRRNOMADS.pipeline')
+    @mock.patch('weather_forecast_retrieval.hrrr_nomads.HRRRNOMADS.preprocessing')
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_main_pipeline(self, _mock_get, preprocessing, pipeline):
+        args = {
+            'output_dir': self.output_path,
+            'num_requests': 2,
+            'verbose': False,
+            'overwrite': False,
+            'start_date': START_DATE,
+            'end_date': END_DATE,
+            'forecast_hrs': [0, 1],
+            'bbox': BBOX,
+            'output_path': self.output_path.as_posix(),
+            'pipeline': True,
+            'workers': 3,
+        }
+        main(**args)
+
+        pipeline.assert_called_once_with(
+            BBOX, self.output_path.as_posix(), 3
+        )
+        preprocessing.assert_not_called()
+
+
+class TestHRRRNOMADSWatch(NOMADSServerTestCase):
+    """Test polling NOMADS for new files"""
+
+    FILE_NAMES = [
+        'hrrr.t01z.wrfsfcf01.grib2',
+        'hrrr.t02z.wrfsfcf01.grib2',
+    ]
+    NOW = datetime(2018, 7, 22, 3, 30)
+
+    def watch(self, server, now=None, **kwargs):
+        with mock.patch.object(
+            HttpRetrieval, 'URL', server.url + 'hrrr.{}/conus/'
+        ), mock.patch(
+            'weather_forecast_retrieval.hrrr_nomads.datetime'
+        ) as mock_datetime:
+            mock_datetime.utcnow.side_effect = now or (lambda: self.NOW)
+            return self.subject.watch(
+                interval=0, forecast_hrs=[1], **kwargs
+            )
+
+    def listing_requests(self, server):
+        return [
+            request for request in server.requests
+            if request[1].endswith('/conus/')
+        ]
+
+    def test_watch_unchanged(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            downloaded = self.watch(server, polls=3)
+
+        self.assertCountEqual(
+            [
+                self.local_dir.joinpath('hrrr.20180722', file_name).as_posix()
+                for file_name in self.FILE_NAMES
+            ],
+            downloaded
+        )
+
+        # one listing request per poll, the later ones are conditional
+        listings = self.listing_requests(server)
+        self.assertEqual(3, len(listings))
+        self.assertNotIn('If-Modified-Since', listings[0][2])
+        self.assertIn('If-Modified-Since', listings[1][2])
+        self.assertEqual(3 + len(self.FILE_NAMES), len(server.requests))
+
+    def test_watch_new_file(self):
+        with LocalHttpServer(self.remote_dir) as server:
+            self.watch(server, polls=1)
+
+            self.publish(
+                self.FILE_NAMES + ['hrrr.t03z.wrfsfcf01.grib2'],
+                modified=time.time() + 10
+            )
+            downloaded = self.watch(server, polls=1)
+
+        self.assertEqual(
+            [
+                self.local_dir.joinpath(
+                    'hrrr.20180722', 'hrrr.t03z.wrfsfcf01.grib2'
+                ).as_posix()
+            ],
+            downloaded
+        )
+
+    def test_watch_existing_files(self):
+        # files from an earlier run are only checked once
+        with LocalHttpServer(self.remote_dir) as server:
+            self.watch(server, polls=1)
+
+        self.subject = HRRRNOMADS(
+            output_dir=self.local_dir.as_posix(), num_requests=1
+        )
+        with mock.patch('os.path.getsize', wraps=os.path.getsize) as getsize:
+            with LocalHttpServer(self.remote_dir) as server:
+                downloaded = self.watch(server, polls=2)
+
+        self.assertEqual([], downloaded)
+        self.assertEqual(len(self.FILE_NAMES), getsize.call_count)
+
+    def test_watch_listing_error(self):
+        http_retrieval = self.subject.http_retrieval
+        request_listing = http_retrieval.request_listing
+        listings = []
+
+        def failing_listing(url):
+            listings.append(url)
+            if len(listings) == 1:
+                raise requests.ConnectionError('Connection refused')
+            return request_listing(url)
+
+        with mock.patch.object(
+            http_retrieval, 'request_listing', side_effect=failing_listing
+        ), LocalHttpServer(self.remote_dir) as server:
+            downloaded = self.watch(server, polls=2)
+
+        self.assertEqual(2, len(listings))
+        self.assertCountEqual(
+            [
+                self.local_dir.joinpath('hrrr.20180722', file_name).as_posix()
+                for file_name in self.FILE_NAMES
+            ],
+            downloaded
+        )
+
+    def test_watch_date_range(self):
+        times = iter([self.NOW, self.NOW + timedelta(hours=1)])
+
+        with LocalHttpServer(self.remote_dir) as server:
+            self.watch(server, now=lambda: next(times), polls=2)
+
+        self.assertEqual(
+            self.NOW - timedelta(hours=3), self.subject.start_date
+        )
+        self.assertEqual(
+            self.NOW + timedelta(hours=1), self.subject.end_date
+        )
+        self.assertEqual([1], self.subject.forecast_hrs)
+
+    def test_watch_stop(self):
+        stop = threading.Event()
+        stop.set()
+
+        with LocalHttpServer(self.remote_dir) as server:
+            downloaded = self.watch(server, stop=stop)
+
+        self.assertEqual([], downloaded)
+        self.assertEqual([], server.requests)
+
+
 class TestParseArgs(RMETestCase):
 
     def test_no_args(self):
@@ -86,6 +360,16 @@ class TestParseArgs(RMETestCase):
         self.assertEqual(args.latest, 3)
         self.assertEqual(args.num_requests, 2)
         self.assertFalse(args.overwrite)
+        self.assertFalse(args.subset)
+        self.assertEqual('thread', args.engine)
+        self.assertIsNone(args.rate_limit)
+        self.assertFalse(args.adaptive)
+        self.assertFalse(args.pipeline)
+        self.assertFalse(args.watch)
+        self.assertEqual('date', args.priority)
+        self.assertIsNone(args.journal)
+        self.assertEqual(HRRRNOMADS.WATCH_INTERVAL, args.interval)
+        self.assertEqual(2, args.workers)
         self.assertFalse(args.verbose)
         self.assertIsNone(args.forecast_hrs)
 
@@ -117,6 +401,90 @@ class TestParseArgs(RMETestCase):
         ])
         self.assertTrue(args.overwrite)
 
+    def test_subset(self):
+        args = parse_args([
+            '-o',
+            self.output_path.as_posix(),
+            '--subset',
+        ])
+        self.assertTrue(args.subset)
+
+    def test_engine(self):
+        args = parse_args([
+            '-o',
+            self.output_path.as_posix(),
+            '--engine',
+            'async',
+            '--rate_limit',
+            '10',
+        ])
+        self.assertEqual('async', args.engine)
+        self.assertEqual(10, args.rate_limit)
+
+        with self.assertRaises(SystemExit):
+            parse_args([
+                '-o',
+                self.output_path.as_posix(),
+                '--engine',
+                'process',
+            ])
+
+    def test_pipeline(self):
+        args = parse_args([
+            '-o',
+            self.output_path.as_posix(),
+            '--pipeline',
+            '-w',
+            '4',
+        ])
+        self.assertTrue(args.pipeline)
+        self.assertEqual(4, args.workers)
+
+    def test_priority(self):
+        args = parse_args([
+            '-o',
+            self.output_path.as_posix(),
+            '--priority',
+            'critical',
+        ])
+        self.assertEqual('critical', args.priority)
+
+        hn = HRRRNOMADS(self.output_path.as_posix(), priority='critical')
+        self.assertEqual('critical', hn.http_retrieval.priority)
+
+    def test_journal(self):
+        journal = self.output_path.joinpath('journal.sqlite').as_posix()
+        args = parse_args([
+            '-o',
+            self.output_path.as_posix(),
+            '-j',
+            journal,
+        ])
+        self.assertEqual(journal, args.journal)
+
+        hn = HRRRNOMADS(self.output_path.as_posix(), journal=journal)
+        self.assertEqual(journal, hn.http_retrieval.journal.path)
+        hn.http_retrieval.journal.close()
+
+    def test_watch(self):
+        args = parse_args([
+            '-o',
+            self.output_path.as_posix(),
+            '--watch',
+            '-i',
+            '30',
+        ])
+        self.assertTrue(args.watch)
+        self.assertEqual(30, args.interval)
+
+    def test_adaptive(self):
+        args = parse_args([
+            '-o',
+            self.output_path.as_posix(),
+            '--adaptive',
+        ])
+        self.assertTrue(args.adaptive)
+
     def test_verbose(self):
         args = parse_args([
             '-o',
@@ -138,7 +506,7 @@ class TestParseArgs(RMETestCase):
 
 class TestCli(RMETestCase):
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_latest(self, mock_get):
         args = {
             'output_dir': self.output_path,
@@ -157,7 +525,7 @@ class TestCli(RMETestCase):
         self.assertIsNone(res)
         self.assertTrue(mock_get.call_count == 1)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_start_end_date(self, mock_get):
         args = {
             'output_dir': self.output_path,
@@ -178,7 +546,7 @@ class TestCli(RMETestCase):
     @unittest.skipIf(
         skip_on_github_actions(), 'On Github Actions, skipping'
     )
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_start_end_date_preprocess(self, mock_get):
         args = {
             'output_dir': self.output_path,
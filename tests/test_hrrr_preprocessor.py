@@ -1,10 +1,15 @@
+import os
+import threading
+import time
 import unittest
 
+import mock
 import pandas as pd
 
 from tests.helpers import skip_on_github_actions
 from tests.RME import RMETestCase
 from weather_forecast_retrieval.data.hrrr import FileLoader
+from weather_forecast_retrieval import hrrr_preprocessor, scheduler
 from weather_forecast_retrieval.hrrr_preprocessor import HRRRPreprocessor
 
 
@@ -48,6 +53,23 @@ class TestHRRRPreprocessor(RMETestCase):
                 'in GRIB source file'.format(file)
             )
 
+    def test_crop_file(self):
+        self.test_subject.variables.pop(-1)
+        hrrr_file = self.hrrr_dir.joinpath(self.output_files[0]).as_posix()
+
+        cropped_file = self.test_subject.crop_file(hrrr_file)
+
+        self.assertEqual(
+            self.output_path.joinpath(self.output_files[0]).as_posix(),
+            cropped_file
+        )
+        self.assertTrue(os.path.exists(cropped_file))
+
+    def test_crop_bad_file(self):
+        hrrr_file = self.hrrr_dir.joinpath(self.output_files[0]).as_posix()
+
+        self.assertIsNone(self.test_subject.crop_file(hrrr_file))
+
     def test_pre_process(self):
         self.test_subject.variables.pop(-1)
         self.test_subject.run()
@@ -71,3 +93,126 @@ class TestHRRRPreprocessor(RMETestCase):
             data.keys(),
             ['air_temp', 'relative_humidity', 'wind_u', 'wind_v', 'precip_int', 'short_wave']
         )
+
+
+class TestHRRRPreprocessorWorkers(RMETestCase):
+    """
+    Test cropping the hours with a pool of workers, without calling wgrib2
+    """
+
+    start_date = '2018-07-22 00:00'
+    end_date = '2018-07-22 05:00'
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('shutil.which', return_value='wgrib2')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def subject(self, workers):
+        return HRRRPreprocessor(
+            self.hrrr_dir.as_posix(),
+            self.start_date,
+            self.end_date,
+            self.output_path.as_posix(),
+            [-116.9, 42.9, -116.5, 43.2],
+            1,
+            workers=workers
+        )
+
+    def crop_file(self, hrrr_file):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+
+        if 't03z' in hrrr_file:
+            return None
+        return hrrr_file.replace(
+            self.hrrr_dir.as_posix(), self.output_path.as_posix()
+        )
+
+    def test_workers(self):
+        subject = self.subject(3)
+        with mock.patch.object(
+            subject, 'crop_file', side_effect=self.crop_file
+        ) as crop_file, mock.patch.object(
+            hrrr_preprocessor, 'JobScheduler',
+            wraps=hrrr_preprocessor.JobScheduler
+        ) as job_scheduler:
+            status = subject.run()
+
+        self.assertEqual(6, crop_file.call_count)
+        self.assertEqual(3, self.max_active)
+        job_scheduler.assert_called_once_with(
+            3, max_queued=3 * HRRRPreprocessor.QUEUE_SIZE
+        )
+
+        self.assertEqual(list(subject.date_times), list(status.index))
+        self.assertEqual(
+            [scheduler.COMPLETE] * 3 + [scheduler.FAILED] +
+            [scheduler.COMPLETE] * 2,
+            list(status.status)
+        )
+        self.assertEqual(
+            self.output_path.joinpath(
+                'hrrr.20180722', 'hrrr.t00z.wrfsfcf01.grib2'
+            ).as_posix(),
+            status.file[0]
+        )
+        self.assertIsNone(status.file[3])
+        self.assertIn('hrrr.t03z.wrfsfcf01.grib2', status.error[3])
+
+    def test_default_worker(self):
+        subject = self.subject(HRRRPreprocessor.WORKERS)
+        with mock.patch.object(
+            subject, 'crop_file', side_effect=self.crop_file
+        ):
+            status = subject.run()
+
+        self.assertEqual(1, self.max_active)
+        self.assertEqual(6, len(status))
+
+    @mock.patch('os.cpu_count', return_value=8)
+    def test_ncpu_shared_by_workers(self, cpu_count):
+        self.assertEqual('', self.subject(1).ncpu)
+        self.assertEqual('-ncpu 2', self.subject(3).ncpu)
+        self.assertEqual('-ncpu 1', self.subject(16).ncpu)
+
+        cpu_count.return_value = None
+        self.assertEqual('-ncpu 1', self.subject(2).ncpu)
+
+    @mock.patch('os.cpu_count', return_value=8)
+    def test_ncpu(self, cpu_count):
+        subject = HRRRPreprocessor(
+            self.hrrr_dir.as_posix(), self.start_date, self.end_date,
+            self.output_path.as_posix(), [-116.9, 42.9, -116.5, 43.2], 1,
+            ncpu=4, workers=3
+        )
+        self.assertEqual('-ncpu 4', subject.ncpu)
+
+        subject = HRRRPreprocessor(
+            self.hrrr_dir.as_posix(), self.start_date, self.end_date,
+            self.output_path.as_posix(), [-116.9, 42.9, -116.5, 43.2], 1,
+            ncpu=0, workers=3
+        )
+        self.assertEqual('', subject.ncpu)
+
+    @mock.patch.object(hrrr_preprocessor, 'HRRRPreprocessor')
+    def test_cli_workers(self, preprocessor):
+        with mock.patch('sys.argv', [
+            'hrrr_preprocessor', '-s', self.start_date, '-e', self.end_date,
+            '-f', '1', '--bbox=-119,-118,37,38', '-o', 'output', '-w', '8',
+            'hrrr'
+        ]):
+            hrrr_preprocessor.cli()
+
+        self.assertEqual(8, preprocessor.call_args[1]['workers'])
+        self.assertIsNone(preprocessor.call_args[1]['ncpu'])
+        preprocessor.return_value.run.assert_called_once()
@@ -0,0 +1,367 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+from datetime import datetime
+
+import mock
+
+import tests.helpers
+from tests.helpers import LocalHttpServer
+from tests.RME import RMETestCase
+from weather_forecast_retrieval import hrrr_archive, journal
+from weather_forecast_retrieval.data.hrrr import HttpRetrieval
+from weather_forecast_retrieval.download import ValidationError
+from weather_forecast_retrieval.journal import DownloadJournal, open_journal
+
+
+class TestDownloadJournal(RMETestCase):
+    """Test recording downloads in the journal"""
+
+    URL = 'https://example.com/hrrr.20180722/conus/'
+
+    def setUp(self):
+        super().setUp()
+        self.path = self.output_path.joinpath('journal.sqlite').as_posix()
+        self.subject = DownloadJournal(self.path)
+
+        self.out_file = self.output_path.joinpath('file.grib2').as_posix()
+        with open(self.out_file, 'wb') as f:
+            f.write(b'GRIB' + b'0' * 96)
+
+    def tearDown(self):
+        self.subject.close()
+        super().tearDown()
+
+    def test_open_journal(self):
+        self.assertIsNone(open_journal(None))
+        self.assertIs(self.subject, open_journal(self.subject))
+
+        other = open_journal(self.path)
+        self.assertIsInstance(other, DownloadJournal)
+        other.close()
+
+    def test_complete(self):
+        url = self.URL + 'file.grib2'
+        self.assertTrue(self.subject.start(url, self.out_file, '100'))
+
+        entry = self.subject.get(url)
+        self.assertEqual(journal.DOWNLOADING, entry['status'])
+        self.assertEqual(1, entry['attempts'])
+        self.assertIsNotNone(entry['started'])
+
+        self.subject.complete(url)
+
+        entry = self.subject.get(url)
+        self.assertEqual(journal.COMPLETE, entry['status'])
+        self.assertEqual(100, entry['size'])
+        with open(self.out_file, 'rb') as f:
+            self.assertEqual(
+                hashlib.sha256(f.read()).hexdigest(), entry['checksum']
+            )
+        self.assertGreaterEqual(entry['finished'], entry['started'])
+        self.assertTrue(DownloadJournal.is_complete(entry, '100'))
+        self.assertFalse(DownloadJournal.is_complete(entry, '200'))
+
+    def test_checksum_while_downloading(self):
+        url = self.URL + 'file.grib2'
+        grib_validator = mock.MagicMock()
+        validator = self.subject.validator(url, grib_validator)
+        self.assertIs(validator, self.subject.validator(url, validator))
+
+        self.subject.start(url, self.out_file)
+        with open(self.out_file, 'rb') as f:
+            content = f.read()
+        validator.update(content[:10])
+        validator.update(content[10:])
+        validator.close()
+        self.assertEqual(2, grib_validator.update.call_count)
+        grib_validator.close.assert_called_once_with()
+
+        with mock.patch(
+            'weather_forecast_retrieval.journal.checksum'
+        ) as checksum:
+            self.subject.complete(url, self.out_file)
+
+        checksum.assert_not_called()
+        self.assertEqual(
+            hashlib.sha256(content).hexdigest(),
+            self.subject.get(url)['checksum']
+        )
+
+    def test_checksum_of_invalid_content(self):
+        url = self.URL + 'file.grib2'
+        grib_validator = mock.MagicMock()
+        grib_validator.close.side_effect = ValidationError('Invalid')
+        validator = self.subject.validator(url, grib_validator)
+
+        self.subject.start(url, self.out_file)
+        validator.update(b'invalid')
+        with self.assertRaises(ValidationError):
+            validator.close()
+
+        self.subject.complete(url, self.out_file)
+        with open(self.out_file, 'rb') as f:
+            self.assertEqual(
+                hashlib.sha256(f.read()).hexdigest(),
+                self.subject.get(url)['checksum']
+            )
+
+    def test_fail(self):
+        url = self.URL + 'file.grib2'
+        self.subject.start(url, self.out_file)
+        self.subject.fail(url, IOError('Connection lost'))
+
+        entry = self.subject.get(url)
+        self.assertEqual(journal.FAILED, entry['status'])
+        self.assertEqual('Connection lost', entry['error'])
+        self.assertFalse(DownloadJournal.is_complete(entry))
+        self.assertEqual([url], [
+            row['url'] for row in self.subject.unfinished()
+        ])
+
+        self.assertTrue(self.subject.start(url, self.out_file))
+        self.assertEqual(2, self.subject.get(url)['attempts'])
+
+    def test_files(self):
+        self.subject.add(self.URL + 'a.grib2', self.out_file, modified='1')
+        self.subject.queue(self.URL + 'b.grib2', self.out_file)
+        self.subject.queue('https://example.com/other.grib2', self.out_file)
+
+        files = self.subject.files(self.URL)
+        self.assertCountEqual(
+            [self.URL + 'a.grib2', self.URL + 'b.grib2'], files.keys()
+        )
+        self.assertTrue(
+            DownloadJournal.is_complete(files[self.URL + 'a.grib2'])
+        )
+        self.assertFalse(DownloadJournal.is_complete(
+            files[self.URL + 'a.grib2'], modified='2'
+        ))
+        self.assertEqual(
+            journal.QUEUED, files[self.URL + 'b.grib2']['status']
+        )
+        self.assertEqual(3, len(self.subject.files()))
+
+    def test_claimed_by_other_run(self):
+        url = self.URL + 'file.grib2'
+        other = DownloadJournal(self.path)
+        other.owner = 'other-host:1'
+
+        self.assertTrue(other.start(url, self.out_file))
+        self.assertFalse(self.subject.start(url, self.out_file))
+
+        # queued again by a new plan, the claim is kept
+        self.subject.queue(url, self.out_file)
+        self.assertEqual(
+            journal.DOWNLOADING, self.subject.get(url)['status']
+        )
+
+        # taken over once the claim is stale
+        self.subject.stale = -1
+        self.assertTrue(self.subject.start(url, self.out_file))
+        other.close()
+
+    def test_claim_of_stopped_run(self):
+        url = self.URL + 'file.grib2'
+        process = subprocess.run(
+            [sys.executable, '-c', 'import os; print(os.getpid())'],
+            stdout=subprocess.PIPE, check=True
+        )
+        other = DownloadJournal(self.path)
+        other.owner = '{}:{}'.format(
+            self.subject.owner.rsplit(':', 1)[0],
+            process.stdout.decode().strip()
+        )
+
+        self.assertTrue(other.start(url, self.out_file))
+        self.assertTrue(self.subject.start(url, self.out_file))
+        other.close()
+
+
+class TestJournalRetrieval(RMETestCase):
+    """Test planning downloads from the journal"""
+
+    FILE_NAMES = [
+        'hrrr.t01z.wrfsfcf01.grib2',
+        'hrrr.t02z.wrfsfcf01.grib2',
+    ]
+    LISTING_ROW = '<a href="{0}">{0}</a>    22-Jul-2018 03:52  {1}\n'
+
+    def setUp(self):
+        super().setUp()
+        listing_dir = self.output_path.joinpath(
+            'remote', 'hrrr.20180722', 'conus'
+        )
+        listing_dir.mkdir(parents=True)
+        self.local_dir = self.output_path.joinpath('local')
+        self.local_dir.mkdir()
+
+        listing = '<html><body><pre>\n'
+        for file_name in self.FILE_NAMES:
+            source = self.hrrr_dir.joinpath('hrrr.20180722', file_name)
+            shutil.copy(source.as_posix(), listing_dir.as_posix())
+            listing += self.LISTING_ROW.format(
+                file_name, source.stat().st_size
+            )
+        listing += '</pre></body></html>'
+        listing_dir.joinpath('index.html').write_text(listing)
+
+        self.journal = DownloadJournal(
+            self.output_path.joinpath('journal.sqlite').as_posix()
+        )
+
+    def tearDown(self):
+        self.journal.close()
+        super().tearDown()
+
+    def fetch(self, server, engine='thread'):
+        subject = HttpRetrieval(
+            engine=engine,
+            journal=self.journal,
+            config=tests.helpers.LOG_ERROR_CONFIG
+        )
+        subject.output_dir = self.local_dir.as_posix()
+
+        with mock.patch.object(
+            HttpRetrieval, 'URL', server.url + 'hrrr.{}/conus/'
+        ):
+            return subject.fetch_by_date(
+                '2018-07-22 01:00', '2018-07-22 02:00'
+            )
+
+    def assert_journal(self, server):
+        files = self.journal.files(server.url)
+        self.assertEqual(2, len(files))
+        for entry in files.values():
+            self.assertEqual(journal.COMPLETE, entry['status'])
+            self.assertEqual(journal.checksum(entry['out_file']),
+                             entry['checksum'])
+            self.assertEqual('2018-07-22 03:52:00+00:00', entry['modified'])
+
+    def test_plan_from_journal(self):
+        with LocalHttpServer(self.output_path.joinpath('remote')) as server:
+            self.assertEqual(2, len(self.fetch(server)))
+            self.assert_journal(server)
+
+            # complete files are not checked on disk again
+            with mock.patch(
+                'os.path.exists', wraps=os.path.exists
+            ) as exists:
+                self.assertIsNone(self.fetch(server))
+
+        checked = [call[0][0] for call in exists.call_args_list]
+        for file_name in self.FILE_NAMES:
+            self.assertNotIn(
+                self.local_dir.joinpath('hrrr.20180722', file_name).as_posix(),
+                checked
+            )
+
+    def test_plan_from_journal_async(self):
+        with LocalHttpServer(self.output_path.joinpath('remote')) as server:
+            self.assertEqual(2, len(self.fetch(server, 'async')))
+            self.assert_journal(server)
+
+    def test_checksum_while_downloading(self):
+        for engine in ['thread', 'async']:
+            with self.subTest(engine=engine), LocalHttpServer(
+                self.output_path.joinpath('remote')
+            ) as server:
+                self.journal._execute('DELETE FROM downloads')
+                shutil.rmtree(
+                    self.local_dir.joinpath('hrrr.20180722').as_posix(),
+                    ignore_errors=True
+                )
+
+                with mock.patch(
+                    'weather_forecast_retrieval.journal.checksum'
+                ) as checksum:
+                    self.assertEqual(2, len(self.fetch(server, engine)))
+
+                checksum.assert_not_called()
+                self.assert_journal(server)
+
+    def test_resume_first(self):
+        with LocalHttpServer(self.output_path.joinpath('remote')) as server:
+            url = server.url + 'hrrr.20180722/conus/'
+            self.journal.queue(url + self.FILE_NAMES[0], 'file')
+            self.journal.start(url + self.FILE_NAMES[1], 'file')
+            self.journal.fail(url + self.FILE_NAMES[1])
+
+            with mock.patch.object(
+                HttpRetrieval, 'fetch_files', return_value=[]
+            ) as fetch_files:
+                self.fetch(server)
+
+        self.assertEqual(
+            [url + self.FILE_NAMES[1], url + self.FILE_NAMES[0]],
+            fetch_files.call_args[0][0]
+        )
+
+    def test_resume_failed(self):
+        with LocalHttpServer(self.output_path.joinpath('remote')) as server:
+            self.fetch(server)
+
+            url = server.url + 'hrrr.20180722/conus/' + self.FILE_NAMES[0]
+            self.journal.fail(url)
+
+            results = self.fetch(server)
+
+        self.assertEqual(1, len(results))
+        self.assertTrue(results[0].endswith(self.FILE_NAMES[0]))
+
+    def test_record_existing_files(self):
+        with LocalHttpServer(self.output_path.joinpath('remote')) as server:
+            self.fetch(server)
+            self.journal._execute('DELETE FROM downloads')
+
+            self.assertIsNone(self.fetch(server))
+
+            files = self.journal.files(server.url)
+            self.assertEqual(2, len(files))
+            for entry in files.values():
+                self.assertTrue(DownloadJournal.is_complete(entry))
+                self.assertIsNone(entry['checksum'])
+
+    def test_skip_claimed(self):
+        other = DownloadJournal(self.journal.path)
+        other.owner = 'other-host:1'
+
+        with LocalHttpServer(self.output_path.joinpath('remote')) as server:
+            url = server.url + 'hrrr.20180722/conus/' + self.FILE_NAMES[0]
+            other.start(url, 'file')
+
+            results = self.fetch(server)
+
+        self.assertFalse(results[0])
+        self.assertTrue(results[1])
+        other.close()
+
+
+class TestJournalArchive(RMETestCase):
+    """Test the journal for downloads from the archive"""
+
+    def test_skip_complete(self):
+        subject = DownloadJournal(
+            self.output_path.joinpath('journal.sqlite').as_posix()
+        )
+        file_day = datetime(2018, 7, 22)
+        url = 'https://pando-rgw01.chpc.utah.edu/hrrr/sfc/20180722/' \
+              'hrrr.t01z.wrfsfcf01.grib2'
+        out_file = self.output_path.joinpath(
+            'hrrr.20180722', 'hrrr.t01z.wrfsfcf01.grib2'
+        )
+        out_file.parent.mkdir()
+        out_file.write_bytes(b'GRIB')
+        subject.add(url, out_file.as_posix())
+
+        session = mock.MagicMock()
+        self.assertTrue(hrrr_archive.download_url(
+            'hrrr.t01z.wrfsfcf01.grib2', self.output_path.as_posix(),
+            mock.MagicMock(), file_day, http_session=session,
+            journal=subject
+        ))
+        session.head.assert_not_called()
+        session.get.assert_not_called()
+        subject.close()
@@ -0,0 +1,175 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from tests.RME import RMETestCase
+from weather_forecast_retrieval import scheduler
+from weather_forecast_retrieval.scheduler import BlackoutWindow, JobScheduler
+
+
+class TimedBlackout:
+    """Blackout for the first seconds after it was created"""
+
+    def __init__(self, seconds):
+        self.release = time.monotonic() + seconds
+
+    def end(self, now):
+        remaining = self.release - time.monotonic()
+        if remaining <= 0:
+            return None
+        return now + timedelta(seconds=remaining)
+
+
+class TestBlackoutWindow(RMETestCase):
+    """Test the recurring blackout of a source"""
+
+    def setUp(self):
+        super().setUp()
+        self.timezone = pytz.timezone('America/Denver')
+        self.subject = BlackoutWindow(
+            [0, 12], start_minute=30, timezone=self.timezone
+        )
+
+    def at(self, hour, minute):
+        return self.timezone.localize(datetime(2021, 6, 15, hour, minute))
+
+    def test_outside(self):
+        self.assertIsNone(self.subject.end(self.at(0, 29)))
+        self.assertIsNone(self.subject.end(self.at(1, 30)))
+        self.assertIsNone(self.subject.end(self.at(13, 0)))
+
+    def test_inside(self):
+        self.assertEqual(self.at(1, 0), self.subject.end(self.at(0, 30)))
+        self.assertEqual(self.at(13, 0), self.subject.end(self.at(12, 59)))
+
+    def test_other_time_zone(self):
+        now = self.at(12, 45).astimezone(pytz.utc)
+
+        self.assertEqual(self.at(13, 0), self.subject.end(now))
+
+    def test_consecutive_hours(self):
+        subject = BlackoutWindow([0, 1, 2], timezone=self.timezone)
+
+        self.assertEqual(self.at(3, 0), subject.end(self.at(1, 10)))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            BlackoutWindow([0], start_minute=30, end_minute=30)
+        with self.assertRaises(ValueError):
+            BlackoutWindow(range(24)).end(self.at(5, 0))
+
+
+class TestJobScheduler(RMETestCase):
+    """Test running jobs around the blackouts of their sources"""
+
+    def test_run(self):
+        subject = JobScheduler()
+        jobs = [subject.submit(pow, 2, exponent) for exponent in range(4)]
+
+        self.assertEqual(jobs, subject.run())
+        self.assertEqual([1, 2, 4, 8], [job.result for job in jobs])
+        self.assertEqual({scheduler.COMPLETE: 4}, subject.status())
+        for job in jobs:
+            self.assertLessEqual(job.started, job.finished)
+
+    def test_keyword_arguments(self):
+        subject = JobScheduler()
+        job = subject.submit(int, '11', base=2)
+        subject.run()
+
+        self.assertEqual(3, job.result)
+
+    def test_failed_job(self):
+        subject = JobScheduler()
+        job = subject.submit(int, 'a')
+        other = subject.submit(int, '1')
+        subject.run()
+
+        self.assertEqual(scheduler.FAILED, job.status)
+        self.assertIsInstance(job.error, ValueError)
+        self.assertEqual(1, other.result)
+
+    def test_workers(self):
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def work():
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+
+        subject = JobScheduler(workers=3)
+        for _ in range(9):
+            subject.submit(work)
+        subject.run()
+
+        self.assertEqual(3, active[1])
+
+    def test_defer_source(self):
+        order = []
+        subject = JobScheduler(
+            blackouts={'archive': TimedBlackout(0.2)}
+        )
+        archive = subject.submit(order.append, 'archive', source='archive')
+        subject.submit(order.append, 'nomads', source='nomads')
+        subject.submit(order.append, 'local')
+
+        subject.run()
+
+        self.assertEqual(['nomads', 'local', 'archive'], order)
+        self.assertGreaterEqual(
+            archive.started, subject.jobs[2].finished
+        )
+
+    def test_deferred_status(self):
+        subject = JobScheduler(
+            blackouts={'archive': TimedBlackout(0.2)}
+        )
+        archive = subject.submit(time.sleep, 0, source='archive')
+        statuses = []
+
+        subject.submit(lambda: statuses.append(archive.status))
+        subject.run()
+
+        self.assertEqual([scheduler.DEFERRED], statuses)
+        self.assertEqual(scheduler.COMPLETE, archive.status)
+
+    def test_submit_while_running(self):
+        subject = JobScheduler(workers=2)
+        results = []
+
+        def download(name):
+            results.append(name)
+            subject.submit(results.append, 'process ' + name)
+
+        subject.submit(download, 'a')
+        subject.submit(download, 'b')
+        subject.run()
+
+        self.assertCountEqual(
+            ['a', 'b', 'process a', 'process b'], results
+        )
+        self.assertEqual(4, len(subject.jobs))
+
+    def test_max_queued(self):
+        subject = JobScheduler(max_queued=2)
+        queued = []
+
+        def work():
+            queued.append(len(subject._queue))
+            time.sleep(0.01)
+
+        subject.start()
+        for _ in range(6):
+            subject.submit(work)
+            self.assertLessEqual(len(subject._queue), 2)
+        subject.join()
+
+        self.assertEqual(6, len(queued))
+        self.assertLessEqual(max(queued), 2)
+        self.assertEqual({scheduler.COMPLETE: 6}, subject.status())
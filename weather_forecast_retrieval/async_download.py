@@ -0,0 +1,339 @@
+"""
+Download files with asyncio.
+
+All downloads run as tasks on one event loop. The number of requests in
+flight and the rate of new requests are limited per host, so one process can
+keep many downloads going without a thread for each of them. Responses are
+streamed to disk and partial files are resumed the same way as the blocking
+downloads in weather_forecast_retrieval.download. File and journal access
+runs in the default executor of the loop, so it does not hold up the other
+transfers.
+"""
+
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from weather_forecast_retrieval import download
+
+
+async def run_blocking(function, *args):
+    """
+    Run a blocking function in the default executor of the event loop
+
+    Args:
+        function: Function to run
+        args:     Positional arguments of the function
+
+    Returns:
+        Result of the function
+    """
+    return await asyncio.get_event_loop().run_in_executor(
+        None, function, *args
+    )
+
+
+class AtomicWriter:
+    """
+    Asynchronous version of download.atomic_write. Opening, writing,
+    syncing and renaming the partial file run in the default executor.
+
+    Example:
+        async with AtomicWriter(out_file) as writer:
+            await writer.write(chunk)
+    """
+
+    def __init__(self, out_file, offset=0, keep_partial=False):
+        """
+        Args:
+            out_file:     Path of the final file
+            offset:       Continue the partial file from this byte
+            keep_partial: Keep the partial file on an error to resume later
+        """
+        self._context = download.atomic_write(out_file, offset, keep_partial)
+        self._file = None
+
+    async def __aenter__(self):
+        self._file = await run_blocking(self._context.__enter__)
+        return self
+
+    async def write(self, data):
+        await run_blocking(self._file.write, data)
+
+    async def __aexit__(self, *exc_info):
+        return await run_blocking(self._context.__exit__, *exc_info)
+
+
+class HostLimit:
+    """
+    Limit the concurrent requests and the request rate for one host
+    """
+
+    def __init__(self, concurrency, rate_limit=None):
+        """
+        Args:
+            concurrency: Maximum number of requests in flight
+            rate_limit:  (Optional) Maximum number of new requests per second
+        """
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 1. / rate_limit if rate_limit else 0
+        self._next_start = 0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+
+        if self.interval > 0:
+            async with self._lock:
+                now = time.monotonic()
+                wait = self._next_start - now
+                self._next_start = max(now, self._next_start) + self.interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        return self
+
+    async def __aexit__(self, *args):
+        self.semaphore.release()
+
+
+class AsyncDownloader:
+    """
+    Download a list of files concurrently on an asyncio event loop.
+
+    Example:
+        downloader = AsyncDownloader(host_limit=8, rate_limit=10)
+        results = downloader.run([(url, out_file), ...])
+    """
+
+    HOST_LIMIT = 8
+    REQUEST_TIMEOUT = 600
+
+    def __init__(self, host_limit=HOST_LIMIT, rate_limit=None,
+                 timeout=REQUEST_TIMEOUT, buffer_size=download.BUFFER_SIZE,
+                 retries=download.RETRIES, callback=None, journal=None,
+                 validator=None, external_logger=None):
+        """
+        Args:
+            host_limit:      Maximum number of requests in flight per host
+            rate_limit:      (Optional) Maximum number of new requests per
+                             second and host
+            timeout:         Total timeout of one request in seconds
+            buffer_size:     Chunk size in bytes to write to disk
+            retries:         Number of retries for failed connections and
+                             download.RETRY_STATUS responses
+            callback:        (Optional) Function called with the url and the
+                             result once a download completes
+            journal:         (Optional) DownloadJournal to claim the
+                             downloads and record the results
+            validator:       (Optional) Function called with the url that
+                             returns a validator of the content or None,
+                             see download.download_file
+            external_logger: (Optional) Specify an existing logger instance
+        """
+        self.host_limit = int(host_limit)
+        self.rate_limit = rate_limit
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self.retries = retries
+        self.callback = callback
+        self.journal = journal
+        self.validator = validator
+        self.log = external_logger or logging.getLogger(__name__)
+
+        self._hosts = {}
+
+    def limit(self, url):
+        """
+        Get the limit for the host of the url
+
+        Args:
+            url: URL of the request
+
+        Returns:
+            HostLimit
+        """
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = HostLimit(self.host_limit, self.rate_limit)
+        return self._hosts[host]
+
+    async def fetch(self, session, url, out_file, size=None):
+        """
+        Stream the file at the url to out_file. Failed connections and
+        download.RETRY_STATUS responses are retried with a backoff. A
+        partial file from an earlier attempt is resumed with a Range request.
+        With a journal, files claimed by another running process are skipped.
+        Content rejected by the validator is requested again right away.
+
+        Args:
+            session:  aiohttp.ClientSession
+            url:      URL of the file
+            out_file: Path to save the file to
+            size:     (Optional) Expected size, see download.size_matches
+
+        Returns:
+            False if failed or path to saved file
+        """
+        success = False
+
+        if self.journal is not None and not await run_blocking(
+            self.journal.start, url, out_file, size
+        ):
+            self.log.info('{} is downloaded by another run'.format(url))
+            attempts = 0
+        else:
+            attempts = self.retries + 1
+
+        backoff = False
+        for attempt in range(attempts):
+            if backoff:
+                await asyncio.sleep(
+                    download.BACKOFF_FACTOR * 2 ** (attempt - 1)
+                )
+            backoff = True
+
+            try:
+                async with self.limit(url):
+                    self.log.debug('Fetching {}'.format(url))
+                    offset = download.partial_size(out_file)
+                    tag = None
+                    if offset > 0:
+                        tag = await run_blocking(download.read_tag, out_file)
+                    async with session.get(
+                        url, headers=download.range_header(offset, tag)
+                    ) as response:
+                        # partial file is at least as large as the remote
+                        if response.status == 416 and offset > 0:
+                            await run_blocking(
+                                download.remove_partial, out_file
+                            )
+                            raise aiohttp.ClientResponseError(
+                                response.request_info,
+                                response.history,
+                                status=response.status
+                            )
+                        if response.status in download.RETRY_STATUS:
+                            raise aiohttp.ClientResponseError(
+                                response.request_info,
+                                response.history,
+                                status=response.status
+                            )
+                        response.raise_for_status()
+
+                        if response.status != 206:
+                            offset = 0
+                        total = download.content_size(
+                            response.status, response.headers
+                        )
+                        validator = None
+                        if self.validator is not None:
+                            validator = self.validator(url)
+                        if self.journal is not None:
+                            validator = self.journal.validator(
+                                url, validator
+                            )
+
+                        async with AtomicWriter(
+                            out_file, offset, keep_partial=True
+                        ) as writer:
+                            if offset == 0:
+                                await run_blocking(
+                                    download.write_tag, out_file,
+                                    response.headers
+                                )
+                            if validator is not None and offset > 0:
+                                await run_blocking(
+                                    download.validate_partial,
+                                    validator, out_file, offset,
+                                    self.buffer_size
+                                )
+                            file_size = offset
+                            async for chunk in response.content.iter_chunked(
+                                self.buffer_size
+                            ):
+                                if validator is not None:
+                                    validator.update(chunk)
+                                await writer.write(chunk)
+                                file_size += len(chunk)
+
+                            download.check_size(
+                                out_file, file_size, total, size
+                            )
+                            if validator is not None:
+                                validator.close()
+
+                self.log.debug('Saved to {}'.format(out_file))
+                success = out_file
+                break
+
+            except download.ValidationError as e:
+                self.log.warning('Invalid file {}: {}'.format(url, e))
+                backoff = False
+
+            except aiohttp.ClientResponseError as e:
+                self.log.warning('Problem fetching {}: {}'.format(url, e))
+                if e.status not in download.RETRY_STATUS + (416,):
+                    break
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+                self.log.warning('Problem fetching {}: {}'.format(url, e))
+
+            except Exception as e:
+                self.log.warning('Problem processing response')
+                self.log.warning(e)
+                break
+
+        if self.journal is not None and attempts > 0:
+            if success:
+                await run_blocking(self.journal.complete, url, out_file)
+            else:
+                await run_blocking(self.journal.fail, url)
+
+        if self.callback is not None:
+            self.callback(url, success)
+
+        return success
+
+    async def fetch_all(self, downloads):
+        """
+        Download all files concurrently
+
+        Args:
+            downloads: List of (url, out_file) or (url, out_file, size)
+                       tuples
+
+        Returns:
+            List with the result of fetch for each download
+        """
+        self._hosts = {}
+        connector = aiohttp.TCPConnector(limit_per_host=self.host_limit)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as session:
+            return await asyncio.gather(*[
+                self.fetch(session, *download_args)
+                for download_args in downloads
+            ])
+
+    def run(self, downloads):
+        """
+        Run the downloads on a new event loop and wait for all of them
+
+        Args:
+            downloads: List of (url, out_file) or (url, out_file, size)
+                       tuples
+
+        Returns:
+            List with the path of the saved file or False for each download
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.fetch_all(downloads))
+        finally:
+            loop.close()
@@ -0,0 +1,294 @@
+"""
+Adaptive limit for the number of concurrent downloads.
+
+The limit grows by one while the throughput of the completed downloads rises
+and their latency stays stable. When the server throttles (HTTP 429 or 503)
+or a request times out, the limit is halved and new requests wait for an
+exponential backoff with jitter. Waiting requests start in the order they
+arrived, so a prioritized queue keeps its order.
+
+The RateLimiter holds the rate at which requests start with a token bucket,
+independent of how many transfers are running at the same time.
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from weather_forecast_retrieval import download
+
+
+class Request:
+    """
+    A running request of the AdaptiveConcurrency. Set size to the number
+    of bytes transferred to count towards the throughput.
+    """
+
+    def __init__(self):
+        self.size = 0
+
+
+class AdaptiveConcurrency:
+    """
+    Thread safe limit for concurrent requests that adapts to the observed
+    throughput, latency and throttling.
+
+    Example:
+        concurrency = AdaptiveConcurrency(initial=2, max_limit=16)
+
+        with concurrency.request() as request:
+            request.size = download.download_file(url, out_file)
+    """
+
+    MIN_LIMIT = 1
+    MAX_LIMIT = 16
+
+    # Wait after the first throttled request in seconds. The wait doubles
+    # for every following throttled request up to MAX_BACKOFF.
+    BACKOFF = 1.
+    MAX_BACKOFF = 60.
+
+    # Throughput has to rise by this factor to grow the limit
+    GROWTH = 1.05
+    # Shrink the limit when the latency rises by more than this factor
+    LATENCY_TOLERANCE = 1.5
+
+    def __init__(self, initial=2, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+        """
+        Args:
+            initial:     Limit to start with
+            min_limit:   Smallest limit
+            max_limit:   Largest limit
+            backoff:     Wait after the first throttled request in seconds
+            max_backoff: Longest wait after throttled requests in seconds
+        """
+        self.min_limit = int(min_limit)
+        self.max_limit = int(max_limit)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._limit = min(max(int(initial), self.min_limit), self.max_limit)
+        self._active = 0
+        self._condition = threading.Condition()
+
+        # tickets to start the waiting requests first in first out
+        self._next_ticket = 0
+        self._serving = 0
+
+        self._throughput = 0.
+        self._latency = None
+        self._throttled = 0
+        self._consecutive_throttled = 0
+        self._resume_at = 0.
+        self._reset_window()
+
+    @property
+    def limit(self):
+        """Current number of allowed concurrent requests"""
+        return self._limit
+
+    @property
+    def active(self):
+        """Number of running requests"""
+        return self._active
+
+    @property
+    def throughput(self):
+        """Throughput of the last completed window in bytes per second"""
+        return self._throughput
+
+    @property
+    def latency(self):
+        """Mean duration of the requests in the last completed window in
+        seconds or None before the first window completed"""
+        return self._latency
+
+    @property
+    def throttled(self):
+        """Total number of throttled requests"""
+        return self._throttled
+
+    def _reset_window(self):
+        self._window = []
+        self._window_start = time.monotonic()
+
+    def acquire(self):
+        """
+        Wait until a request can start. Requests wait while the number of
+        active requests is at the limit or during a backoff and start in the
+        order they called acquire.
+        """
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+
+            while True:
+                wait = self._resume_at - time.monotonic()
+                if ticket != self._serving:
+                    self._condition.wait()
+                elif wait > 0:
+                    self._condition.wait(wait)
+                elif self._active < self._limit:
+                    self._active += 1
+                    self._serving += 1
+                    self._condition.notify_all()
+                    return
+                else:
+                    self._condition.wait()
+
+    def release(self, size=0, elapsed=0., throttled=False, failed=False):
+        """
+        Record a finished request and let the next one start
+
+        Args:
+            size:      Bytes transferred
+            elapsed:   Duration of the request in seconds
+            throttled: The server throttled the request or it timed out
+            failed:    The request failed for another reason. It does not
+                       count towards the throughput and latency.
+        """
+        with self._condition:
+            self._active -= 1
+
+            if throttled:
+                self._throttle()
+            elif not failed:
+                self._consecutive_throttled = 0
+                self._record(size, elapsed)
+
+            self._condition.notify_all()
+
+    def _throttle(self):
+        self._throttled += 1
+        self._consecutive_throttled += 1
+        self._limit = max(self.min_limit, self._limit // 2)
+
+        delay = min(
+            self.max_backoff,
+            self.backoff * 2 ** (self._consecutive_throttled - 1)
+        )
+        delay = random.uniform(delay / 2, delay)
+        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+        self._reset_window()
+
+    def _record(self, size, elapsed):
+        self._window.append((size, elapsed))
+        if len(self._window) < self._limit:
+            return
+
+        duration = max(time.monotonic() - self._window_start, 1e-6)
+        throughput = sum(size for size, _ in self._window) / duration
+        latency = sum(elapsed for _, elapsed in self._window) / \
+            len(self._window)
+
+        if self._latency is not None and \
+                latency > self._latency * self.LATENCY_TOLERANCE:
+            self._limit = max(self.min_limit, self._limit - 1)
+        elif throughput > self._throughput * self.GROWTH:
+            self._limit = min(self.max_limit, self._limit + 1)
+
+        self._throughput = throughput
+        self._latency = latency
+        self._reset_window()
+
+    @contextmanager
+    def request(self):
+        """
+        Context manager for one request. Waits for a free slot, measures
+        the duration and records the result. Errors that download.is_throttled
+        classifies as throttling back off the limit. Other errors are not
+        recorded. All errors are raised again.
+
+        Yields:
+            Request to set the transferred size on
+        """
+        self.acquire()
+        request = Request()
+        start = time.monotonic()
+
+        try:
+            yield request
+        except Exception as e:
+            throttled = download.is_throttled(e)
+            self.release(
+                elapsed=time.monotonic() - start,
+                throttled=throttled,
+                failed=not throttled
+            )
+            raise
+
+        self.release(request.size, time.monotonic() - start)
+
+
+class RateLimiter:
+    """
+    Thread safe token bucket that limits the rate at which requests start.
+    The bucket holds up to burst tokens and refills with rate tokens per
+    second. Each request takes one token and waits until one is available.
+    Waiting requests start in the order they called acquire.
+
+    Example:
+        limiter = RateLimiter(rate=0.5, burst=2)
+
+        limiter.acquire()
+        download.download_file(url, out_file)
+    """
+
+    RATE = 1.
+    BURST = 1
+
+    def __init__(self, rate=RATE, burst=BURST):
+        """
+        Args:
+            rate:  Requests per second
+            burst: Number of requests that can start at once after the
+                   limiter was idle
+        """
+        if rate <= 0:
+            raise ValueError('rate must be greater than 0')
+        if burst < 1:
+            raise ValueError('burst must be at least 1')
+
+        self.rate = float(rate)
+        self.burst = int(burst)
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def reserve(self):
+        """
+        Take a token without waiting for it
+
+        Returns:
+            Seconds to wait before the request can start
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+
+            if self._tokens >= 0:
+                return 0.
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """
+        Wait until a request can start
+
+        Returns:
+            Seconds waited
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
@@ -2,12 +2,16 @@ from .file_handler import FileHandler
 from .file_loader import FileLoader
 from .ftp_retrieval import FtpRetrieval
 from .grib_file import GribFile
+from .grib_inventory import GribInventory
 from .http_retrieval import HttpRetrieval
+from .reference_index import ReferenceIndex
 
 __all__ = [
     FileHandler,
     FileLoader,
     FtpRetrieval,
     GribFile,
+    GribInventory,
     HttpRetrieval,
+    ReferenceIndex,
 ]
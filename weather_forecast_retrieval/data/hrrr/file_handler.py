@@ -1,4 +1,5 @@
 import re
+from datetime import datetime
 
 import pandas as pd
 
@@ -107,11 +108,12 @@ class FileHandler:
         """
 
         # parse the folder date
-        date = pd.to_datetime(folder_date.split('.')[-1])
+        date = datetime.strptime(
+            folder_date.split('.')[-1], FileHandler.SINGLE_DAY_FORMAT
+        )
 
         # parse the file name
         res = re.search(FileHandler.FILE_PATTERN, file_name)
         hour = int(res.group(1))
 
-        date = date.replace(hour=hour)
-        return date.tz_localize(tz='UTC')
+        return pd.Timestamp(date.replace(hour=hour), tz='UTC')
@@ -1,5 +1,6 @@
 import os
 from datetime import timedelta
+from multiprocessing.pool import ThreadPool
 
 import pandas as pd
 import utm
@@ -39,9 +40,6 @@ class FileLoader(ConfigFile):
             __name__, config=config, external_logger=external_logger
         )
 
-        self.data = None
-        self.force_zone_number = None
-
         self.file_type = file_type
         self.file_dir = file_dir
 
@@ -73,11 +71,15 @@ class FileLoader(ConfigFile):
     def get_saved_data(self,
                        start_date, end_date, bbox,
                        force_zone_number=None,
-                       var_keys=None):
+                       var_keys=None,
+                       return_sources=False):
         """
         Get the saved data from above for a particular time and a particular
         bounding box.
 
+        All state of a request is kept local to the call, which allows one
+        loader instance to serve multiple threads at the same time.
+
         Args:
             start_date:     datetime for the start
             end_date:       datetime for the end
@@ -85,19 +87,17 @@ class FileLoader(ConfigFile):
             force_zone_number: UTM zone number to convert datetime to
             var_keys:       which keys to grab from smrf variables,
                             default is var_map
+            return_sources: (Optional) Also return the record of which
+                            file served each variable. Default: False
 
         Returns:
             List containing dataframe for the metadata adn for each read
-            variable.
+            variable. The sources dataframe is appended when requested.
         """
 
         if start_date > end_date:
             raise ValueError('start_date before end_date')
 
-        self.start_date = start_date
-        self.end_date = end_date
-        self.file_loader.bbox = bbox
-
         # filter to desired keys if specified
         if var_keys is not None:
             var_map = {key: self.file_loader.VAR_MAP[key] for key in var_keys}
@@ -107,17 +107,21 @@ class FileLoader(ConfigFile):
                 'var_map not specified, will return default outputs'
             )
 
-        self.force_zone_number = force_zone_number
-
         self.log.info('Getting saved data')
-        self.get_data(var_map)
+        data, sources = self.get_data(var_map, start_date, end_date, bbox)
+
+        metadata, dataframe = self.convert_to_dataframes(
+            data, var_map, force_zone_number
+        )
+
+        if return_sources:
+            return metadata, dataframe, sources
 
-        return self.convert_to_dataframes(var_map)
+        return metadata, dataframe
 
-    def get_data(self, var_map):
+    def get_data(self, var_map, start_date, end_date, bbox):
         """
-        Get the HRRR data for set start and end date.
-        Read data is stored on instance attribute.
+        Get the HRRR data for given start and end date.
 
         hours    0    1    2    3    4
                  |----|----|----|----|
@@ -129,13 +133,31 @@ class FileLoader(ConfigFile):
         02                 01   02   03
         03                      01   02
 
+        The fallback to the next forecast hour is done per variable for
+        GRIB files. Variables that were read successfully are kept and
+        only the missing ones are requested from the next file. Accumulated
+        variables are read with the accumulation over the last hour of the
+        forecast hour, see GribFile.forecast_hour_params.
+
+        Args:
+            var_map:    Variable map of variables to load
+            start_date: datetime for the start
+            end_date:   datetime for the end
+            bbox:       list of  [lonmin, latmin, lonmax, latmax]
+
+        Returns:
+            Tuple of the combined xarray Dataset, or None if the data could
+            not be combined, and a dataframe with the file that served each
+            variable for each time step
         """
-        date = self.start_date
+        date = start_date
         data = []
+        sources = {}
 
-        while date <= self.end_date:
+        while date <= end_date:
             self.log.debug('Reading file for date: {}'.format(date))
-            forecast_data = None
+            missing = dict(var_map)
+            sources[date] = {}
 
             # make sure we get a working file. This allows for six tries,
             # accounting for the fact that we start at forecast hour 1
@@ -144,6 +166,7 @@ class FileLoader(ConfigFile):
                 day_folder, file_name = FileHandler.folder_and_file(
                     file_time, fx_hr, self.file_type
                 )
+                forecast_data = None
 
                 try:
                     if self.file_type == GribFile.SUFFIX:
@@ -151,14 +174,23 @@ class FileLoader(ConfigFile):
                         file = os.path.join(base_path, day_folder, file_name)
                         if os.path.exists(file):
                             forecast_data = self.file_loader.load(
-                                file, var_map
+                                file,
+                                {
+                                    key: GribFile.forecast_hour_params(
+                                        params, fx_hr
+                                    )
+                                    for key, params in missing.items()
+                                },
+                                bbox=bbox
                             )
                         else:
                             self.log.error('  No file for {}'.format(file))
 
                     elif self.file_type == NetCdfFile.SUFFIX:
                         file = [self.file_dir, day_folder, file_name]
-                        forecast_data = self.file_loader.load(file)
+                        forecast_data = self.file_loader.load(
+                            file, bbox=bbox
+                        )
 
                 except Exception as e:
                     self.log.debug(e)
@@ -167,33 +199,159 @@ class FileLoader(ConfigFile):
                         'successfully'.format(fx_hr, date)
                     )
 
-                if fx_hr == self.MAX_FORECAST_HOUR:
-                    raise IOError(
-                        'Not able to find good file for {}'
-                        .format(file_time.strftime('%Y-%m-%d %H:%M'))
-                    )
-
                 if forecast_data is not None:
                     data += forecast_data
-                    break
+
+                    if self.file_type == GribFile.SUFFIX:
+                        loaded = [
+                            key for dataset in forecast_data
+                            for key in dataset.data_vars
+                        ]
+                    else:
+                        loaded = list(missing.keys())
+                        file = '/'.join(file)
+
+                    for key in loaded:
+                        if key in missing:
+                            sources[date][key] = file
+                            del missing[key]
+
+                    if len(missing) == 0:
+                        break
+
+                    self.log.debug(
+                        '  Missing {} for date {} in forecast hour {}'.format(
+                            ', '.join(missing.keys()), date, fx_hr
+                        )
+                    )
+            else:
+                raise IOError(
+                    'Not able to find good file for {}'
+                    .format(file_time.strftime('%Y-%m-%d %H:%M'))
+                )
 
             date += self.NEXT_HOUR
 
+        sources = pd.DataFrame.from_dict(sources, orient='index')
+
         try:
-            self.data = xr.combine_by_coords(data)
+            return xr.combine_by_coords(data), sources
         except Exception as e:
             self.log.debug(e)
             self.log.debug(
                 '  Could not combine forecast data for given dates: {} - {}'
-                    .format(self.start_date, self.end_date)
+                    .format(start_date, end_date)
+            )
+
+        return None, sources
+
+    def load_forecast_run(self, init_time, forecast_hours, bbox,
+                          var_keys=None, num_workers=None):
+        """
+        Load all forecast hours of a single model initialization time.
+
+        The files are read in parallel. The crop window for the bounding
+        box is computed once from the first file and shared with all
+        others, since all forecast hours are on the same grid.
+        Accumulated variables are the accumulation over the hour before
+        each forecast hour.
+
+        Args:
+            init_time:      datetime of the model initialization
+            forecast_hours: list of forecast hours to load
+            bbox:           list of  [lonmin, latmin, lonmax, latmax]
+            var_keys:       which keys to grab from smrf variables,
+                            default is var_map
+            num_workers:    (Optional) Number of files read in parallel.
+                            Default: number of forecast hours, up to the
+                            number of CPUs
+
+        Returns:
+            Xarray Dataset with the variables stacked along the
+            forecast_hour dimension
+        """
+        if self.file_type != GribFile.SUFFIX:
+            raise ValueError(
+                'Loading a forecast run is only supported for grib2 files'
+            )
+
+        init_time = pd.to_datetime(init_time)
+
+        if var_keys is not None:
+            var_map = {key: self.file_loader.VAR_MAP[key] for key in var_keys}
+        else:
+            var_map = self.file_loader.VAR_MAP
+
+        base_path = os.path.join(
+            os.path.abspath(self.file_dir), FileHandler.folder_name(init_time)
+        )
+        files = {}
+        for fx_hr in forecast_hours:
+            file = os.path.join(
+                base_path, FileHandler.file_name(init_time.hour, fx_hr)
+            )
+            if os.path.exists(file):
+                files[fx_hr] = file
+            else:
+                self.log.error('  No file for {}'.format(file))
+
+        if len(files) == 0:
+            raise IOError(
+                'No files found for forecast run {}'.format(
+                    init_time.strftime('%Y-%m-%d %H:%M')
+                )
+            )
+
+        # Compute the crop window from the first variable of the first file
+        fx_hr, file = next(iter(files.items()))
+        grid = self.file_loader.open_variable(
+            file, GribFile.forecast_hour_params(
+                next(iter(var_map.values())), fx_hr
             )
+        )
+        window = GribFile.crop_window(
+            grid.latitude.values, grid.longitude.values, bbox
+        )
+        grid.close()
+
+        def load_forecast_hour(fx_hr):
+            data = [
+                self.file_loader.load_variable(
+                    files[fx_hr], key,
+                    GribFile.forecast_hour_params(params, fx_hr),
+                    window=window
+                )
+                for key, params in var_map.items()
+            ]
+            data = xr.merge(data, compat='override').squeeze('time')
+            return data.rename({'time': 'valid_time'})
+
+        if num_workers is None:
+            num_workers = min(len(files), os.cpu_count() or 1)
+
+        self.log.info('Loading {} forecast hours for {}'.format(
+            len(files), init_time
+        ))
+        with ThreadPool(processes=num_workers) as pool:
+            data = pool.map(load_forecast_hour, files.keys())
+
+        data = xr.concat(
+            data,
+            dim=pd.Index(list(files.keys()), name='forecast_hour'),
+            coords=['valid_time'],
+            compat='override',
+        )
+
+        return data.assign_coords(time=init_time)
 
-    def convert_to_dataframes(self, var_map):
+    def convert_to_dataframes(self, data, var_map, force_zone_number=None):
         """
         Convert the xarray's to dataframes to return
 
         Args:
+            data:    Xarray Dataset returned from get_data
             var_map: Variable map
+            force_zone_number: UTM zone number to convert datetime to
 
         Returns
             Tuple of metadata and dataframe
@@ -203,9 +361,9 @@ class FileLoader(ConfigFile):
 
         for key, value in var_map.items():
             if self.file_type == GribFile.SUFFIX:
-                df = self.data[key].to_dataframe()
+                df = data[key].to_dataframe()
             else:
-                df = self.data[value].to_dataframe()
+                df = data[value].to_dataframe()
                 key = value
 
             # convert from a row multi-index to a column multi-index
@@ -227,7 +385,7 @@ class FileLoader(ConfigFile):
                 metadata = pd.concat(metadata, axis=1)
                 metadata = metadata.apply(
                     FileLoader.apply_utm,
-                    args=(self.force_zone_number,),
+                    args=(force_zone_number,),
                     axis=1
                 )
                 metadata.rename(columns={value: key}, inplace=True)
@@ -1,9 +1,96 @@
-import fnmatch
+import ftplib
 import os
+import queue
+import re
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from ftplib import FTP
+from multiprocessing.pool import ThreadPool
 
-from weather_forecast_retrieval import utils
+import pandas as pd
+
+from weather_forecast_retrieval import download, utils
+from weather_forecast_retrieval.grib_framing import GribFramingValidator
+from weather_forecast_retrieval.journal import DownloadJournal, open_journal
+
+from .file_handler import FileHandler
+
+
+class FtpConnectionPool:
+    """
+    Pool of logged-in FTP connections that are shared by threads. A
+    connection is opened when no idle connection is available and at most
+    size connections are in use at the same time. A permanent error like
+    a missing file is an answer of the server and the connection is reused.
+    Connections that raised any other error, i.e. a lost connection or a
+    temporary error, are closed and not reused.
+
+    Example:
+        with FtpConnectionPool(connect, 4) as pool:
+            with pool.connection() as ftp:
+                ftp.nlst()
+    """
+
+    def __init__(self, connect, size):
+        """
+        Args:
+            connect: Function that returns a new logged-in FTP connection
+            size:    Maximum number of connections
+        """
+        self.size = int(size)
+        self.opened = 0
+
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that yields an idle or new connection
+
+        Yields:
+            ftplib.FTP
+        """
+        with self._slots:
+            try:
+                ftp = self._idle.get_nowait()
+            except queue.Empty:
+                ftp = self._connect()
+                self.opened += 1
+
+            try:
+                yield ftp
+            except ftplib.error_perm:
+                self._idle.put(ftp)
+                raise
+            except BaseException:
+                self._close(ftp)
+                raise
+
+            self._idle.put(ftp)
+
+    @staticmethod
+    def _close(ftp):
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 class FtpRetrieval:
@@ -11,42 +98,294 @@ class FtpRetrieval:
     Retrieve the data from the ftp site. First read the ftp_url and
     determine what dates are available. Then use that to download
     the required data.
+
+    The listings and downloads share a pool of num_connections logged-in
+    connections. The listing of each day is requested once and filtered by
+    the forecast hours and date range. Interrupted downloads are resumed
+    with the REST command.
+
+    With sync, the size and modification time of the remote files are
+    requested with one MLSD listing per day, or SIZE and MDTM for each file
+    if the ftp site does not support MLSD. Only files that are missing or
+    changed compared to the journal or the local files are downloaded.
     """
     URl = 'ftp.ncep.noaa.gov'
     REMOTE_DIR = '/pub/data/nccf/com/hrrr/prod'
     FILE_PATTERN = 'hrrr.t*z.wrfsfcf{:02d}.grib2'
+    FILE_REGEX = re.compile(FileHandler.FILE_PATTERN + '$')
+    DAY_REGEX = re.compile(r'hrrr\.(\d{8})$')
+    MLSD_FACTS = ['type', 'size', 'modify']
+    MODIFIED_FORMAT = '%Y%m%d%H%M%S'
+
+    FORECAST_HOURS = range(24)
+    NUMBER_CONNECTIONS = 1
+    RETRIES = download.RETRIES
+    BUFFER_SIZE = download.BUFFER_SIZE
+
+    # Errors of a connection or transfer that are retried, a permanent
+    # error like a missing file is not
+    RETRY_ERRORS = (ftplib.error_temp, ftplib.error_reply, EOFError, OSError)
 
-    def __init__(self, output_dir, external_logger=None):
+    def __init__(self, output_dir, external_logger=None, journal=None,
+                 num_connections=NUMBER_CONNECTIONS, retries=RETRIES,
+                 sync=False):
+        """
+        Args:
+            output_dir:      Directory to download the files to
+            external_logger: (Optional) Specify an existing logger instance
+            journal:         (Optional) DownloadJournal or path of the
+                             journal database to plan from and record the
+                             downloads
+            num_connections: (Optional) Number of connections to list and
+                             download with at the same time
+            retries:         (Optional) Number of retries for a failed
+                             download
+            sync:            (Optional) Compare the size and modification
+                             time of the remote files to download changed
+                             files too. Default: only missing files
+        """
         self.output_dir = output_dir
         self._logger = external_logger or utils.setup_local_logger(__name__)
+        self.journal = open_journal(journal)
+        self.num_connections = int(num_connections)
+        self.retries = retries
+        self.buffer_size = FtpRetrieval.BUFFER_SIZE
+        self.sync = sync
+        self.pool = None
 
-    def fetch(self):
-        self._logger.info('Retrieving data from the ftp site')
-        ftp = FTP(FtpRetrieval.URl)
+        # Set to False once the ftp site refused an MLSD listing
+        self._mlsd = True
 
-        ftp.connect()
+    def connect(self):
+        """
+        Open a new connection to the ftp site and log in
+
+        Returns:
+            ftplib.FTP
+        """
+        ftp = FTP(FtpRetrieval.URl)
         self._logger.debug('Connected to FTP')
 
         ftp.login()
         self._logger.debug('Logged into FTP')
 
-        ftp.cwd(FtpRetrieval.REMOTE_DIR)
-        self._logger.debug(
-            'Changed directory to {}'.format(FtpRetrieval.REMOTE_DIR)
-        )
+        return ftp
+
+    def fetch(self, forecast_hours=None, start_date=None, end_date=None):
+        """
+        Download the files for the forecast hours between the start and end
+        date that are not in the output directory.
+
+        Args:
+            forecast_hours: (Optional) List of forecast hours.
+                            Default: FORECAST_HOURS
+            start_date:     (Optional) First initialization time.
+                            Default: all available
+            end_date:       (Optional) Last initialization time.
+                            Default: all available
+
+        Returns:
+            List with False if failed or path to saved file for each
+            download
+        """
+        self._logger.info('Retrieving data from the ftp site')
+
+        with FtpConnectionPool(self.connect, self.num_connections) as pool:
+            self.pool = pool
+
+            downloads = self.plan(forecast_hours, start_date, end_date)
+            self._logger.info('Retrieving {} files with {} connections'.format(
+                len(downloads), self.num_connections
+            ))
+
+            with ThreadPool(self.num_connections) as threads:
+                results = threads.starmap(
+                    self.retrieve, downloads, chunksize=1
+                )
+
+            self.pool = None
+
+        self._logger.info(
+            '{} -- Done with downloads'.format(datetime.now().isoformat()))
+
+        return results
+
+    @staticmethod
+    def to_utc(date):
+        """Timestamp in UTC, dates without a time zone are assumed UTC"""
+        if date is None:
+            return None
+
+        date = pd.to_datetime(date)
+        if date.tzinfo is None:
+            return date.tz_localize(tz='UTC')
+        return date.tz_convert(tz='UTC')
+
+    def list_directory(self, ftp_dir):
+        """
+        Names in a directory on the ftp site
+
+        Args:
+            ftp_dir: Path of the directory
+
+        Returns:
+            List of names
+        """
+        with self.pool.connection() as ftp:
+            return [
+                os.path.basename(name.rstrip('/'))
+                for name in ftp.nlst(ftp_dir)
+            ]
+
+    @staticmethod
+    def parse_modified(value):
+        """
+        Modification time of an MLSD listing or MDTM response
+
+        Args:
+            value: Time as YYYYMMDDHHMMSS with optional fractions of a second
+
+        Returns:
+            pandas.Timestamp in UTC
+        """
+        return pd.to_datetime(
+            value.split('.')[0], format=FtpRetrieval.MODIFIED_FORMAT
+        ).tz_localize(tz='UTC')
 
-        # get directory listing on server
-        dir_list = ftp.nlst()
+    def list_files(self, ftp_dir):
+        """
+        Files in a directory on the ftp site. With sync, the size and
+        modification time come from an MLSD listing. They are None if the ftp
+        site does not support MLSD or sync is off.
 
-        # go through the directory list and see if we need to add
-        # any new data files
-        for d in dir_list:
-            ftp_dir = os.path.join(FtpRetrieval.REMOTE_DIR, d, 'conus')
-            self._logger.info('Changing directory to {}'.format(ftp_dir))
+        Args:
+            ftp_dir: Path of the directory
 
-            # get the files in the new directory
-            ftp.cwd(ftp_dir)
-            ftp_files = ftp.nlst()
+        Returns:
+            Dictionary of name to (size, modified) tuple
+        """
+        if self.sync and self._mlsd:
+            try:
+                with self.pool.connection() as ftp:
+                    return {
+                        name: (
+                            int(facts['size']),
+                            self.parse_modified(facts['modify'])
+                        )
+                        for name, facts in ftp.mlsd(
+                            ftp_dir, facts=self.MLSD_FACTS
+                        )
+                        if facts.get('type') == 'file'
+                    }
+            except ftplib.error_perm as e:
+                self._logger.info(
+                    'MLSD is not supported, using SIZE and MDTM: {}'.format(e)
+                )
+                self._mlsd = False
+
+        return {
+            name: (None, None) for name in self.list_directory(ftp_dir)
+        }
+
+    def file_details(self, ftp_file):
+        """
+        Size and modification time of a file with the SIZE and MDTM commands
+
+        Args:
+            ftp_file: Path of the file on the ftp site
+
+        Returns:
+            (size, modified) tuple, modified is None if MDTM is not supported
+        """
+        with self.pool.connection() as ftp:
+            ftp.voidcmd('TYPE I')
+            size = ftp.size(ftp_file)
+            try:
+                modified = self.parse_modified(
+                    ftp.sendcmd('MDTM {}'.format(ftp_file)).split()[-1]
+                )
+            except ftplib.error_perm:
+                modified = None
+
+        return size, modified
+
+    def is_current(self, out_file, size, modified, entry=None):
+        """
+        Check if the local file is a complete copy of the remote file. Without
+        sync, an existing file is current. With sync, the size has to match
+        and the file can not be older than the remote file. A journal entry is
+        checked instead of the local file.
+
+        Args:
+            out_file: Path of the local file
+            size:     Size of the remote file or None
+            modified: Modification time of the remote file or None
+            entry:    (Optional) Journal entry of the file
+
+        Returns:
+            True if the file does not need to be downloaded
+        """
+        if entry is not None:
+            if not self.sync:
+                size = modified = None
+            return DownloadJournal.is_complete(entry, size, modified)
+
+        if not os.path.exists(out_file):
+            return False
+        if not self.sync:
+            return True
+        if size is not None and os.path.getsize(out_file) != size:
+            return False
+
+        return modified is None or \
+            os.path.getmtime(out_file) >= modified.timestamp()
+
+    def plan(self, forecast_hours=None, start_date=None, end_date=None):
+        """
+        Find the files to download. The day folders are filtered by the date
+        range and each day listing is requested once and filtered by the
+        forecast hours and the date range.
+
+        Args:
+            forecast_hours: (Optional) List of forecast hours
+            start_date:     (Optional) First initialization time
+            end_date:       (Optional) Last initialization time
+
+        Returns:
+            List of (ftp_file, out_file, size, modified) tuples, size and
+            modified are None without sync
+        """
+        if forecast_hours is None:
+            forecast_hours = self.FORECAST_HOURS
+        forecast_hours = set(int(hour) for hour in forecast_hours)
+        start_date = self.to_utc(start_date)
+        end_date = self.to_utc(end_date)
+
+        days = []
+        for d in self.list_directory(FtpRetrieval.REMOTE_DIR):
+            match = self.DAY_REGEX.match(d)
+            if match is None:
+                continue
+
+            day = pd.Timestamp(match.group(1), tz='UTC')
+            if start_date is not None and day < start_date.normalize():
+                continue
+            if end_date is not None and day > end_date.normalize():
+                continue
+            days.append((d, day))
+
+        self._logger.debug('Listing {} days'.format(len(days)))
+        ftp_dirs = [
+            os.path.join(FtpRetrieval.REMOTE_DIR, d, 'conus') for d, _ in days
+        ]
+        with ThreadPool(max(1, min(self.num_connections, len(days)))) as pool:
+            listings = pool.map(self.list_files, ftp_dirs)
+
+        wanted = []
+        for (d, day), ftp_dir, ftp_files in zip(days, ftp_dirs, listings):
+            journal = {}
+            if self.journal is not None:
+                journal = self.journal.files(self.url(ftp_dir))
 
             # check if d exists in output_dir
             out_path = os.path.join(self.output_dir, d)
@@ -54,27 +393,182 @@ class FtpRetrieval:
                 os.mkdir(out_path)
                 self._logger.info('mkdir {}'.format(out_path))
 
-            forecast_hours = range(24)
-            for fhr in forecast_hours:
+            wanted_files = 0
+            for f, (size, modified) in ftp_files.items():
+                match = self.FILE_REGEX.match(f)
+                if match is None or int(match.group(2)) not in forecast_hours:
+                    continue
 
-                wanted_files = fnmatch.filter(
-                    ftp_files, FtpRetrieval.FILE_PATTERN.format(fhr))
+                file_date = day + pd.Timedelta(hours=int(match.group(1)))
+                if start_date is not None and file_date < start_date:
+                    continue
+                if end_date is not None and file_date > end_date:
+                    continue
+                wanted_files += 1
+                wanted.append([
+                    os.path.join(ftp_dir, f), os.path.join(out_path, f),
+                    size, modified, journal
+                ])
 
-                self._logger.debug(
-                    'Found {} files matching pattern'.format(
-                        len(wanted_files)
-                    ))
+            self._logger.debug('Found {} files matching in {}'.format(
+                wanted_files, ftp_dir
+            ))
 
-                # go through each file and see if it exists, retrieve if not
-                for f in wanted_files:
-                    out_file = os.path.join(out_path, f)
-                    ftp_file = os.path.join(ftp_dir, f)
-                    if not os.path.exists(out_file):
-                        self._logger.debug('Retrieving {}'.format(ftp_file))
-                        h = open(out_file, 'wb')
-                        ftp.retrbinary('RETR {}'.format(ftp_file), h.write)
-                        h.close()
+        # SIZE and MDTM for each file when the listings had no details
+        missing = [file for file in wanted if file[2] is None]
+        if self.sync and len(missing) > 0:
+            threads = max(1, min(self.num_connections, len(missing)))
+            with ThreadPool(threads) as pool:
+                details = pool.map(
+                    self.file_details, [file[0] for file in missing]
+                )
+            for file, (size, modified) in zip(missing, details):
+                file[2:4] = size, modified
 
-        ftp.close()
-        self._logger.info(
-            '{} -- Done with downloads'.format(datetime.now().isoformat()))
+        downloads = []
+        for ftp_file, out_file, size, modified, journal in wanted:
+            url = self.url(ftp_file)
+            entry = journal.get(url)
+
+            if self.is_current(out_file, size, modified, entry):
+                # record files from before the journal was used
+                if self.journal is not None and entry is None:
+                    self.journal.add(url, out_file, size, modified)
+            else:
+                downloads.append((ftp_file, out_file, size, modified))
+
+        return downloads
+
+    @staticmethod
+    def url(ftp_path):
+        """
+        URL of a path on the ftp site as recorded in the journal
+
+        Args:
+            ftp_path: Path on the ftp site
+
+        Returns:
+            ftp url
+        """
+        return 'ftp://{}{}'.format(FtpRetrieval.URl, ftp_path)
+
+    def retrieve(self, ftp_file, out_file, size=None, modified=None):
+        """
+        Retrieve a file with a connection of the pool and record the
+        download in the journal. Failed transfers are retried and resume
+        the partial file.
+
+        Args:
+            ftp_file: Path of the file on the ftp site
+            out_file: Path to save the file to
+            size:     (Optional) Size of the remote file
+            modified: (Optional) Modification time of the remote file
+
+        Returns:
+            False if failed or path to saved file
+        """
+        url = self.url(ftp_file)
+        if self.journal is not None and \
+                not self.journal.start(url, out_file, size, modified):
+            self._logger.info('{} is downloaded by another run'.format(url))
+            return False
+
+        success = False
+        for attempt in range(self.retries + 1):
+            try:
+                with self.pool.connection() as ftp:
+                    self.download(ftp, ftp_file, out_file, size, modified)
+                success = out_file
+                break
+
+            except download.ValidationError as e:
+                self._logger.warning('Invalid file {}: {}'.format(ftp_file, e))
+
+            except self.RETRY_ERRORS as e:
+                self._logger.warning('Problem retrieving {}: {}'.format(
+                    ftp_file, e
+                ))
+
+            except Exception as e:
+                self._logger.warning('Problem retrieving {}: {}'.format(
+                    ftp_file, e
+                ))
+                break
+
+        if self.journal is not None:
+            if success:
+                self.journal.complete(url, out_file)
+            else:
+                self.journal.fail(url)
+
+        return success
+
+    def download(self, ftp, ftp_file, out_file, size=None, modified=None):
+        """
+        Retrieve a file in binary mode to a partial file that is renamed
+        once complete. An existing partial file is resumed with the REST
+        command unless the remote file changed since. The file has to match
+        the size on the ftp site and GRIB2 files need a valid framing. The
+        modification time of the remote file is set on the saved file.
+
+        Args:
+            ftp:      Logged-in FTP connection
+            ftp_file: Path of the file on the ftp site
+            out_file: Path to save the file to
+            size:     (Optional) Size of the remote file. Default: SIZE
+            modified: (Optional) Modification time of the remote file
+
+        Returns:
+            Size of the file in bytes
+        """
+        ftp.voidcmd('TYPE I')
+        if size is None:
+            size = ftp.size(ftp_file)
+
+        offset = download.partial_size(out_file)
+        if size is not None and offset > size:
+            offset = 0
+        if offset > 0 and modified is not None and os.path.getmtime(
+            download.partial_file(out_file)
+        ) < modified.timestamp():
+            offset = 0
+        if offset > 0:
+            self._logger.debug('Resuming {} from byte {}'.format(
+                ftp_file, offset
+            ))
+        else:
+            self._logger.debug('Retrieving {}'.format(ftp_file))
+
+        validator = None
+        if ftp_file.endswith('.grib2'):
+            validator = GribFramingValidator()
+        if self.journal is not None:
+            validator = self.journal.validator(self.url(ftp_file), validator)
+
+        with download.atomic_write(out_file, offset, keep_partial=True) as f:
+            if validator is not None and offset > 0:
+                download.validate_partial(
+                    validator, out_file, offset, self.buffer_size
+                )
+
+            file_size = [offset]
+
+            def write(block):
+                if validator is not None:
+                    validator.update(block)
+                f.write(block)
+                file_size[0] += len(block)
+
+            ftp.retrbinary(
+                'RETR {}'.format(ftp_file), write,
+                blocksize=self.buffer_size, rest=offset or None
+            )
+
+            download.check_size(out_file, file_size[0], size)
+            if validator is not None:
+                validator.close()
+
+        if modified is not None:
+            os.utime(out_file, (modified.timestamp(), modified.timestamp()))
+
+        return file_size[0]
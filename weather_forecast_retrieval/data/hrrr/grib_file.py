@@ -1,3 +1,4 @@
+import numpy as np
 import xarray as xr
 
 from weather_forecast_retrieval.data.hrrr.base_file import BaseFile
@@ -22,6 +23,7 @@ class GribFile(BaseFile):
         'precip_int': {
             'name': 'Total Precipitation',
             'shortName': 'tp',
+            'stepType': 'accum',
             **SURFACE,
         },
         'short_wave': {
@@ -88,17 +90,24 @@ class GribFile(BaseFile):
         """
         return longitude % 360
 
-    def load(self, file, var_map):
+    def load(self, file, var_map, bbox=None):
         """
         Get valid HRRR data using Xarray
 
+        Variables that fail to decode are skipped and logged, so a partially
+        corrupt file still returns all readable variables. Callers can find
+        the missing ones by comparing the returned variable names against
+        the requested var_map.
+
         Args:
             file:    Path to grib2 file to open
             var_map: Var map of variables to load from file
+            bbox:    (Optional) Bounding box to crop to, defaults to the
+                     bbox attribute
 
         Returns:
-            Array with Xarray Datasets for each variable and
-            cropped to bounding box
+            Array with Xarray Datasets for each successfully read variable
+            and cropped to bounding box
         """
 
         variable_data = []
@@ -107,42 +116,151 @@ class GribFile(BaseFile):
 
         # open just one dataset at a time
         for key, params in var_map.items():
-            data = xr.open_dataset(
-                file,
-                engine='cfgrib',
-                backend_kwargs={
-                    'filter_by_keys': params,
-                    'indexpath': '',  # Don't create an .idx file when reading
-                }
+            try:
+                variable_data.append(
+                    self.load_variable(file, key, params, bbox=bbox)
+                )
+            except Exception as e:
+                self.log.debug(e)
+                self.log.debug(
+                    '  Could not load {} from {}'.format(key, file)
+                )
+
+        return variable_data
+
+    @staticmethod
+    def forecast_hour_params(params, forecast_hour):
+        """
+        Filter keys of a variable for a file of a forecast hour. Files from
+        forecast hour 2 on have two messages for accumulated variables, the
+        accumulation since the initialization and the one over the last
+        hour. This selects the accumulation over the last hour.
+
+        Args:
+            params:        cfgrib filter keys for the variable
+            forecast_hour: Forecast hour of the file
+
+        Returns:
+            Filter keys for the file
+        """
+        if params.get('stepType') != 'accum':
+            return params
+
+        return {
+            **params,
+            'stepRange': '{}-{}'.format(
+                max(forecast_hour - 1, 0), forecast_hour
+            ),
+        }
+
+    @staticmethod
+    def crop_window(latitude, longitude, bbox):
+        """
+        Get the grid rectangle and mask for a bounding box. Files from the
+        same model grid share the window, so it only needs to be computed
+        once for a set of files.
+
+        Args:
+            latitude:  2D array of latitudes
+            longitude: 2D array of longitudes, degrees from the east
+            bbox:      list of [lonmin, latmin, lonmax, latmax]
+
+        Returns:
+            Tuple of the y and x slices as dictionary for isel and the
+            mask of cells inside the bounding box within those slices
+        """
+        mask = (latitude >= bbox[1]) & \
+            (latitude <= bbox[3]) & \
+            (longitude >= GribFile.longitude_east(bbox[0])) & \
+            (longitude <= GribFile.longitude_east(bbox[2]))
+
+        if not mask.any():
+            raise ValueError('Bounding box is outside of the grid')
+
+        y_index = np.flatnonzero(mask.any(axis=1))
+        x_index = np.flatnonzero(mask.any(axis=0))
+        index = {
+            'y': slice(y_index[0], y_index[-1] + 1),
+            'x': slice(x_index[0], x_index[-1] + 1),
+        }
+
+        return index, mask[index['y'], index['x']]
+
+    def open_variable(self, file, params):
+        """
+        Open a single variable from a GRIB2 file without reading the data
+
+        Args:
+            file:   Path to grib2 file to open
+            params: cfgrib filter keys for the variable
+
+        Returns:
+            Xarray Dataset
+        """
+        data = xr.open_dataset(
+            file,
+            engine='cfgrib',
+            backend_kwargs={
+                'filter_by_keys': params,
+                'indexpath': '',  # Don't create an .idx file when reading
+            }
+        )
+
+        if len(data) != 1:
+            data.close()
+            raise Exception(
+                'Expected one grib variable, found {}'.format(len(data))
             )
 
-            if len(data) > 1:
-                raise Exception('More than one grib variable returned')
+        return data
 
+    def load_variable(self, file, key, params, window=None, bbox=None):
+        """
+        Read a single variable from a GRIB2 file
+
+        Args:
+            file:   Path to grib2 file to open
+            key:    Name of the variable in the returned dataset
+            params: cfgrib filter keys for the variable
+            window: (Optional) Crop window from crop_window to use instead
+                    of the bounding box
+            bbox:   (Optional) Bounding box to crop to, defaults to the
+                    bbox attribute
+
+        Returns:
+            Xarray Dataset cropped to the bounding box
+        """
+        data = self.open_variable(file, params)
+        bbox = bbox or self.bbox
+
+        if window is None:
             data = data.where(
-                (data.latitude >= self.bbox[1]) &
-                (data.latitude <= self.bbox[3]) &
-                (data.longitude >= self.longitude_east(self.bbox[0])) &
-                (data.longitude <= self.longitude_east(self.bbox[2])),
+                (data.latitude >= bbox[1]) &
+                (data.latitude <= bbox[3]) &
+                (data.longitude >= self.longitude_east(bbox[0])) &
+                (data.longitude <= self.longitude_east(bbox[2])),
                 drop=True
             )
+        else:
+            index, mask = window
+            data = data.isel(index).where(
+                xr.DataArray(mask, dims=('y', 'x'))
+            )
 
-            # Remove some dimensions so all read variables can
-            # be combined into one dataset
-            del data[params['typeOfLevel']]
-            del data['step']
+        # Remove some dimensions so all read variables can
+        # be combined into one dataset
+        del data[params['typeOfLevel']]
+        del data['step']
 
-            # rename the data variable
-            variable = params.get('cfVarName') or params.get('shortName')
-            data = data.rename({variable: key})
+        # rename the data variable
+        variable = params.get('cfVarName') or params.get('shortName')
+        data = data.rename({variable: key})
 
-            # Make the time an index coordinate
-            data = data.assign_coords(time=data['valid_time'])
-            data = data.expand_dims('time')
-            del data['valid_time']
+        # Make the time an index coordinate
+        data = data.assign_coords(time=data['valid_time'])
+        data = data.expand_dims('time')
+        del data['valid_time']
 
-            variable_data.append(data)
+        data.close()
 
-            data.close()
-
-        return variable_data
+        return data
@@ -0,0 +1,167 @@
+import re
+
+
+class GribInventory:
+    """
+    Class to parse the wgrib2 inventory (.idx) files that are published next
+    to the HRRR GRIB2 files.
+
+    Each line of an inventory describes one GRIB message with the message
+    number, the byte offset in the GRIB2 file and the description of the
+    variable, level and forecast. Example:
+        71:38916211:d=2021061504:TMP:2 m above ground:1 hour fcst:
+
+    The byte offsets allow to request only the messages of the needed
+    variables with HTTP range requests.
+    """
+    SUFFIX = '.idx'
+
+    # Variables that are used from a HRRR file, given as wgrib2 match
+    # strings of variable name and level
+    VARIABLES = tuple([
+        'TMP:2 m',
+        'RH:2 m',
+        'UGRD:10 m',
+        'VGRD:10 m',
+        'APCP:surface',
+        'DSWRF:surface',
+        'HGT:surface',
+        'TCDC:entire atmosphere'
+    ])
+
+    def __init__(self, inventory):
+        """
+        Args:
+            inventory: Text content of a .idx file
+        """
+        self.messages = self.parse(inventory)
+
+    @staticmethod
+    def parse(inventory):
+        """
+        Parse the inventory lines into the byte range of each message.
+
+        Messages with sub-messages (e.g. 10.1 and 10.2) share the byte
+        offset and are read with the same range. The last message in the
+        file has no known end and is read to the end of the file.
+
+        Args:
+            inventory: Text content of a .idx file
+
+        Returns:
+            List of dictionaries with the keys line, start and end. The end
+            byte is inclusive and None for the last message.
+        """
+        messages = []
+
+        for line in inventory.splitlines():
+            line = line.strip()
+            if len(line) == 0:
+                continue
+
+            fields = line.split(':')
+            messages.append({
+                'line': line,
+                'start': int(fields[1]),
+                'end': None,
+            })
+
+        offsets = sorted(set(message['start'] for message in messages))
+        next_offset = dict(zip(offsets[:-1], offsets[1:]))
+
+        for message in messages:
+            if message['start'] in next_offset:
+                message['end'] = next_offset[message['start']] - 1
+
+        return messages
+
+    def select(self, variables=None):
+        """
+        Select the messages that match any of the variables. Matching
+        follows the wgrib2 -match option against the inventory line.
+
+        Args:
+            variables: (Optional) list of wgrib2 match strings.
+                       Default: VARIABLES
+
+        Returns:
+            List of matching messages
+        """
+        variables = variables or self.VARIABLES
+        pattern = re.compile('|'.join(variables))
+
+        return [
+            message for message in self.messages
+            if pattern.search(message['line'])
+        ]
+
+    def byte_ranges(self, variables=None):
+        """
+        Get the byte ranges to request for the variables. Ranges of
+        messages that are adjacent in the file are merged into one.
+
+        Args:
+            variables: (Optional) list of wgrib2 match strings.
+                       Default: VARIABLES
+
+        Returns:
+            List of (start, end) tuples with an inclusive end byte or
+            None for reading to the end of the file
+        """
+        ranges = []
+
+        for message in sorted(
+            self.select(variables), key=lambda message: message['start']
+        ):
+            start, end = message['start'], message['end']
+
+            if len(ranges) > 0:
+                last_start, last_end = ranges[-1]
+
+                # previous range is already read to the end of the file
+                if last_end is None:
+                    continue
+
+                # same or adjacent message
+                if start <= last_end + 1:
+                    if end is None or end > last_end:
+                        ranges[-1] = (last_start, end)
+                    continue
+
+            ranges.append((start, end))
+
+        return ranges
+
+    def missing(self, variables=None):
+        """
+        Get the variables that are not in the inventory
+
+        Args:
+            variables: (Optional) list of wgrib2 match strings.
+                       Default: VARIABLES
+
+        Returns:
+            List of variables without a matching message
+        """
+        variables = variables or self.VARIABLES
+
+        return [
+            variable for variable in variables
+            if len(self.select([variable])) == 0
+        ]
+
+    @staticmethod
+    def range_header(start, end=None):
+        """
+        Create the HTTP Range header for a byte range
+
+        Args:
+            start: First byte
+            end:   (Optional) Last byte, inclusive
+
+        Returns:
+            Dictionary with the Range header
+        """
+        return {
+            'Range': 'bytes={}-{}'.format(start, '' if end is None else end)
+        }
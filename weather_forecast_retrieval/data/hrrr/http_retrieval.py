@@ -1,14 +1,23 @@
 import os
 import re
+import threading
 from datetime import datetime
 from multiprocessing.pool import ThreadPool
 
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+
+from weather_forecast_retrieval import download
+from weather_forecast_retrieval.async_download import AsyncDownloader
+from weather_forecast_retrieval.concurrency import AdaptiveConcurrency
+from weather_forecast_retrieval.grib_framing import GribFramingValidator
+from weather_forecast_retrieval.journal import (
+    QUEUED, DownloadJournal, open_journal
+)
 
 from .config_file import ConfigFile
 from .file_handler import FileHandler
+from .file_loader import FileLoader
+from .grib_inventory import GribInventory
 
 
 class HttpRetrieval(ConfigFile):
@@ -16,10 +25,60 @@ class HttpRetrieval(ConfigFile):
           '/hrrr.{}/conus/'
     FILE_PATTERN = r'hrrr\.t\d\dz\.wrfsfcf{}.grib2'
 
+    # Row of the directory listing with the file name, modification time
+    # and size, i.e.
+    # <a href="hrrr.t10z.wrfsfcf00.grib2">...</a>   14-Jun-2021 00:52  134M
+    LISTING_PATTERN = re.compile(
+        r'<a href="(?P<file_name>[^"/]+)">[^<]*</a>\s+'
+        r'(?P<modified>\d{2}-\w{3}-\d{4} \d{2}:\d{2})\s+(?P<size>\S+)'
+    )
+    LISTING_DATE_FORMAT = '%d-%b-%Y %H:%M'
+    COLUMNS = [
+        'modified', 'file_date', 'forecast_hour', 'file_name', 'out_file',
+        'new_file', 'url', 'size'
+    ]
+
     NUMBER_REQUESTS = 2
     REQUEST_TIMEOUT = 600
-
-    def __init__(self, overwrite=False, config=None, external_logger=None):
+    BUFFER_SIZE = download.BUFFER_SIZE
+    RETRIES = download.RETRIES
+    ENGINES = ('thread', 'async')
+    ENGINE = 'thread'
+    MAX_REQUESTS = AdaptiveConcurrency.MAX_LIMIT
+
+    # Order of the download queue:
+    #   date:     oldest initialization time first
+    #   newest:   newest initialization time first
+    #   critical: forecast hours 1 to FileLoader.MAX_FORECAST_HOUR that the
+    #             loader falls back to first, each newest first, then all
+    #             other files newest first
+    PRIORITIES = ('date', 'newest', 'critical')
+    PRIORITY = 'date'
+    CRITICAL_HOURS = range(1, FileLoader.MAX_FORECAST_HOUR + 1)
+
+    def __init__(self, overwrite=False, subset=False, config=None,
+                 external_logger=None, num_requests=None, engine=None,
+                 callback=None, priority=None, journal=None):
+        """
+        Args:
+            overwrite:       Download and overwrite existing files
+            subset:          Only download the GRIB messages of the
+                             subset_variables using the .idx inventory
+            config:          (Optional) Full path to a .ini file or
+                             a dictionary
+            external_logger: (Optional) Specify an existing logger instance
+            num_requests:    (Optional) Number of concurrent requests,
+                             overrides the config
+            engine:          (Optional) Download with a pool of threads
+                             ('thread') or on an asyncio event loop
+                             ('async'), overrides the config
+            callback:        (Optional) Function called with the url and
+                             the result of each completed download
+            priority:        (Optional) Order of the download queue, one
+                             of PRIORITIES, overrides the config
+            journal:         (Optional) DownloadJournal or path of the
+                             journal database, overrides the config
+        """
         super().__init__(
             __name__, config=config, external_logger=external_logger
         )
@@ -32,11 +91,75 @@ class HttpRetrieval(ConfigFile):
             if 'request_timeout' in self._config['output'].keys():
                 self._request_timeout = int(
                     self._config['output']['request_timeout'])
+            if 'retries' in self._config['output'].keys():
+                self._retries = int(self._config['output']['retries'])
+            if 'buffer_size' in self._config['output'].keys():
+                self._buffer_size = int(
+                    self._config['output']['buffer_size'])
+            if 'engine' in self._config['output'].keys():
+                self._engine = self._config['output']['engine']
+            if 'rate_limit' in self._config['output'].keys():
+                self._rate_limit = float(
+                    self._config['output']['rate_limit'])
+            if 'adaptive' in self._config['output'].keys():
+                self._adaptive = self._config['output']['adaptive']
+            if 'max_requests' in self._config['output'].keys():
+                self._max_requests = int(
+                    self._config['output']['max_requests'])
+            if 'priority' in self._config['output'].keys():
+                self._priority = self._config['output']['priority']
+            if 'validate' in self._config['output'].keys():
+                self._validate = self._config['output']['validate']
+            if 'journal' in self._config['output'].keys():
+                journal = journal or self._config['output']['journal']
+            if 'subset' in self._config['output'].keys():
+                subset = subset or self._config['output']['subset']
+            if 'subset_variables' in self._config['output'].keys():
+                self._subset_variables = self._config['output'][
+                    'subset_variables']
+
+        if num_requests is not None:
+            self._number_requests = int(num_requests)
+        if engine is not None:
+            self._engine = engine
+        if priority is not None:
+            self._priority = priority
+
+        if self.engine not in self.ENGINES:
+            raise ValueError('Unknown download engine {}, use one of {}'.format(
+                self.engine, ', '.join(self.ENGINES)
+            ))
+        if self.priority not in self.PRIORITIES:
+            raise ValueError('Unknown priority {}, use one of {}'.format(
+                self.priority, ', '.join(self.PRIORITIES)
+            ))
+        if self.adaptive and self.engine == 'async':
+            raise ValueError(
+                'The adaptive concurrency is only used by the thread engine, '
+                'use rate_limit to limit the async engine'
+            )
 
         self.overwrite = overwrite
+        self.subset = subset
+        self.callback = callback
+        self.journal = open_journal(journal)
         self.date_folder = True
         self.forecast_hour = None
 
+        self.concurrency = None
+        if self.adaptive:
+            self.concurrency = AdaptiveConcurrency(
+                initial=self.number_requests, max_limit=self.max_requests
+            )
+
+        # cached listings by url
+        self._listings = {}
+        self._listing_lock = threading.Lock()
+
+        # urls of files that were downloaded or found in the output
+        # directory, these are not checked again
+        self.seen = set()
+
     @property
     def number_requests(self):
         return getattr(self, '_number_requests', HttpRetrieval.NUMBER_REQUESTS)
@@ -45,6 +168,115 @@ class HttpRetrieval(ConfigFile):
     def request_timeout(self):
         return getattr(self, '_request_timeout', HttpRetrieval.REQUEST_TIMEOUT)
 
+    @property
+    def engine(self):
+        return getattr(self, '_engine', HttpRetrieval.ENGINE)
+
+    @property
+    def priority(self):
+        return getattr(self, '_priority', HttpRetrieval.PRIORITY)
+
+    @property
+    def rate_limit(self):
+        """Maximum number of new requests per second with the async engine
+
+        Returns:
+            float: requests per second or None for no limit
+        """
+        return getattr(self, '_rate_limit', None)
+
+    @property
+    def adaptive(self):
+        """Adapt the number of concurrent requests with an
+        AdaptiveConcurrency between 1 and max_requests, starting at
+        number_requests
+
+        Returns:
+            bool: True if adaptive
+        """
+        return getattr(self, '_adaptive', False)
+
+    @property
+    def validate(self):
+        """Check the GRIB2 framing of the files while they are written
+
+        Returns:
+            bool: True if validated, the default
+        """
+        return getattr(self, '_validate', True)
+
+    def validator(self, uri, messages=None):
+        """Validator for the content of a downloaded file. With a journal,
+        the checksum for the journal is calculated by the validator.
+
+        Args:
+            uri (str): url of the file
+            messages (int, optional): expected number of GRIB messages.
+                Defaults to None.
+
+        Returns:
+            GribFramingValidator: validator for GRIB2 files, wrapped in a
+                ChecksumValidator with a journal, or None if not validated
+        """
+        validator = None
+        if self.validate and uri.endswith('.grib2'):
+            validator = GribFramingValidator(messages)
+        if self.journal is not None:
+            validator = self.journal.validator(uri, validator)
+        return validator
+
+    @property
+    def max_requests(self):
+        return getattr(self, '_max_requests', HttpRetrieval.MAX_REQUESTS)
+
+    @property
+    def pool_size(self):
+        """Number of download threads and pooled connections
+
+        Returns:
+            int: max_requests if adaptive, number_requests otherwise
+        """
+        if self.adaptive:
+            return self.max_requests
+        return self.number_requests
+
+    @property
+    def retries(self):
+        return getattr(self, '_retries', HttpRetrieval.RETRIES)
+
+    @property
+    def session(self):
+        """Shared session with a connection pool for the number of
+        concurrent requests. With adaptive concurrency, throttled requests
+        are not retried by the session but by fetch_from_url so that the
+        AdaptiveConcurrency sees them.
+
+        Returns:
+            requests.Session
+        """
+        if self.adaptive:
+            return download.session(self.pool_size, 0)
+        return download.session(self.pool_size, self.retries)
+
+    @property
+    def buffer_size(self):
+        return getattr(self, '_buffer_size', HttpRetrieval.BUFFER_SIZE)
+
+    @property
+    def subset_variables(self):
+        """wgrib2 match strings of the variables to download in
+        subset mode
+
+        Returns:
+            list: variables, defaults to the GribInventory variables
+        """
+        variables = getattr(
+            self, '_subset_variables', GribInventory.VARIABLES
+        )
+        if isinstance(variables, str):
+            variables = [variables]
+        return list(variables)
+
     @property
     def forecast_str(self):
         """Turn a list of forecast hours to strings with 2 digits. For
@@ -72,21 +304,56 @@ class HttpRetrieval(ConfigFile):
 
     @property
     def url_date(self):
+        return self.day_url(self.start_date)
+
+    @staticmethod
+    def day_url(day):
+        """NOMADS url of the folder for a day
+
+        Args:
+            day (datetime): day of the folder
+
+        Returns:
+            str: url of the hrrr.YYYYMMDD folder
+        """
         return HttpRetrieval.URL.format(
-            self.start_date.strftime(FileHandler.SINGLE_DAY_FORMAT)
+            day.strftime(FileHandler.SINGLE_DAY_FORMAT)
         )
 
+    def day_folder(self, day):
+        """Local output folder for a day, the folder is created if it does
+        not exist.
+
+        Args:
+            day (datetime): day of the folder
+
+        Returns:
+            str: path to the hrrr.YYYYMMDD folder or the output_dir when
+                date_folder is False
+        """
+        if not self.date_folder:
+            return self.output_dir
+
+        out_path = os.path.join(self.output_dir, FileHandler.folder_name(day))
+        if not os.path.isdir(out_path):
+            os.makedirs(out_path, exist_ok=True)
+            self.log.info('mkdir {}'.format(out_path))
+
+        return out_path
+
     def output_folder(self):
-        if self.date_folder:
-            self.folder_date = FileHandler.folder_name(self.start_date)
-            out_path = os.path.join(self.output_dir, self.folder_date)
+        self.folder_date = FileHandler.folder_name(self.start_date)
+        self.out_path = self.day_folder(self.start_date)
 
-            if not os.path.isdir(out_path):
-                os.mkdir(out_path)
-                self.log.info('mkdir {}'.format(out_path))
-        else:
-            out_path = self.output_dir
-        self.out_path = out_path
+    def days(self):
+        """Days of the folders between the start and end date
+
+        Returns:
+            pd.DatetimeIndex: one entry per day
+        """
+        return pd.date_range(
+            self.start_date.normalize(), self.end_date.normalize(), freq='D'
+        )
 
     def fetch_by_date(self, start_date, end_date, forecast_hour=None):
         """Fetch data from NOMADS between a date range for a given forecast hour.
@@ -110,112 +377,575 @@ class HttpRetrieval(ConfigFile):
         self.check_dates()
         self.output_folder()
 
-        df = self.parse_html_for_files()
+        df = self.plan_downloads()
 
         if len(df) == 0:
             self.log.warning('No files found that match request')
             return None
 
-        self.log.debug('Generating requests')
-        pool = ThreadPool(processes=self.number_requests)
-
         self.log.info('Sendings {} requests'.format(len(df)))
 
-        # map_async will convert the iterable to a list right away and wait
-        # for the requests to finish before continuing
-        res = pool.map(self.fetch_from_url, df.url.to_list())
+        if self.journal is not None:
+            for row in df.itertuples():
+                self.journal.queue(
+                    row.url, row.out_file, row.size, row.modified
+                )
+
+        res = self.fetch_files(
+            df.url.to_list(), df['size'].to_list(), df.out_file.to_list()
+        )
+        self.seen.update(url for url, result in zip(df.url, res) if result)
 
         self.log.info(
             '{} -- Done with downloads'.format(datetime.now().isoformat()))
 
         return res
 
-    def parse_html_for_files(self):
-        """Parse the url from NOMADS with BeautifulSoup and look for matching
-        filenames.
+    def plan_downloads(self):
+        """Get the files to download for all days between the start and end
+        date. The listing of each day is requested concurrently and all
+        matching files are merged into one queue. With a journal, the
+        downloads that a previous run started and did not finish are
+        resumed first.
 
         Returns:
-            pd.DataFrame: data frame of files that match the pattern
+            pd.DataFrame: data frame of files to download, in the order of
+                the priority
+        """
+        days = self.days()
+        self.log.debug('Requesting listings for {} days'.format(len(days)))
+        if len(days) == 0:
+            return pd.DataFrame(columns=self.COLUMNS)
+
+        pool = ThreadPool(processes=min(self.number_requests, len(days)))
+        listings = pool.map(self.parse_html_for_files, days)
+        pool.close()
+
+        df = pd.concat(listings, ignore_index=True)
+        if len(df) > 0:
+            df = self.prioritize(df)
+            if self.journal is not None:
+                df = self.resume_first(df)
+
+        return df
+
+    def resume_first(self, df):
+        """Move the downloads that were started by a previous run and did
+        not finish to the front of the queue, so a restarted run continues
+        where the previous run stopped. The partial files of these are
+        resumed.
+
+        Args:
+            df (pd.DataFrame): prioritized files to download
+
+        Returns:
+            pd.DataFrame: sorted data frame
+        """
+        started = [
+            entry['url']
+            for entry in self.journal.unfinished(
+                os.path.commonprefix(df.url.to_list())
+            )
+            if entry['status'] != QUEUED
+        ]
+        resume = df.url.isin(started)
+        if resume.any():
+            self.log.info(
+                'Resuming {} downloads of a previous run'.format(resume.sum())
+            )
+
+        return pd.concat([df[resume], df[~resume]])
+
+    def prioritize(self, df):
+        """Sort the files to download by the priority. Files with the same
+        priority keep their order.
+
+        Args:
+            df (pd.DataFrame): files to download with the file_date and
+                forecast_hour
+
+        Returns:
+            pd.DataFrame: sorted data frame
+        """
+        if self.priority == 'date':
+            return df.sort_values('file_date', kind='mergesort')
+
+        keys = ['file_date', 'forecast_hour']
+        ascending = [False, True]
+        if self.priority == 'critical':
+            df = df.assign(
+                _critical=df.forecast_hour.isin(self.CRITICAL_HOURS)
+            )
+            keys.insert(0, '_critical')
+            ascending.insert(0, False)
+
+        df = df.sort_values(keys, ascending=ascending, kind='mergesort')
+
+        return df.drop(columns='_critical', errors='ignore')
+
+    def fetch_files(self, urls, sizes=None, out_files=None):
+        """Download the files with the selected engine. Subset downloads
+        always use the thread engine.
+
+        Args:
+            urls (list): urls of the files
+            sizes (list, optional): expected size of each file from the
+                listing. Defaults to None.
+            out_files (list, optional): path to save each file to.
+                Defaults to None or the file name in the out_path.
+
+        Returns:
+            list: False if failed or path to saved file for each url
+        """
+        sizes = sizes or [None] * len(urls)
+        out_files = out_files or [
+            os.path.join(self.out_path, url.split('/')[-1]) for url in urls
+        ]
+
+        if self.engine == 'async' and not self.subset:
+            return self.fetch_async(urls, sizes, out_files)
+
+        self.log.debug('Generating requests')
+        pool = ThreadPool(processes=self.pool_size)
+
+        # starmap will convert the iterable to a list right away and wait
+        # for the requests to finish before continuing. With a chunksize of
+        # one, the threads take the files in the order of the queue.
+        res = pool.starmap(
+            self.fetch_with_callback, zip(urls, sizes, out_files),
+            chunksize=1
+        )
+        pool.close()
+
+        return res
+
+    def fetch_with_callback(self, uri, size=None, out_file=None):
+        """Fetch the file at the uri and pass the result to the callback
+
+        Args:
+            uri: url of the file
+            size: (Optional) expected size of the file
+            out_file: (Optional) path to save the file to
+
+        Returns:
+            False if failed or path to saved file
+        """
+        result = self.fetch_from_url(uri, size, out_file)
+
+        if self.callback is not None:
+            self.callback(uri, result)
+
+        return result
+
+    def fetch_async(self, urls, sizes, out_files):
+        """Download the files on an asyncio event loop. The number of
+        concurrent requests and the rate_limit apply per host.
+
+        Args:
+            urls (list): urls of the files
+            sizes (list): expected size of each file
+            out_files (list): path to save each file to
+
+        Returns:
+            list: False if failed or path to saved file for each url
+        """
+        downloader = AsyncDownloader(
+            host_limit=self.number_requests,
+            rate_limit=self.rate_limit,
+            timeout=self.request_timeout,
+            buffer_size=self.buffer_size,
+            retries=self.retries,
+            callback=self.callback,
+            journal=self.journal,
+            validator=self.validator,
+            external_logger=self.log,
+        )
+
+        return downloader.run(list(zip(urls, out_files, sizes)))
+
+    @staticmethod
+    def parse_listing(page):
+        """Parse all file rows of a NOMADS directory listing in one pass
+
+        Args:
+            page (str): html text of the listing
+
+        Returns:
+            pd.DataFrame: data frame with the file_name, modified and size
+                of each file
         """
+        df = pd.DataFrame(
+            HttpRetrieval.LISTING_PATTERN.findall(page),
+            columns=['file_name', 'modified', 'size']
+        )
+        df['modified'] = pd.to_datetime(
+            df['modified'], format=HttpRetrieval.LISTING_DATE_FORMAT
+        ).dt.tz_localize(tz='UTC')
+
+        return df
+
+    def request_listing(self, url):
+        """Request and parse the listing at the url. Listings are cached and
+        requested again with the ETag and Last-Modified of the cached
+        response. The cached listing is used when the server answers with
+        304 Not Modified.
+
+        Args:
+            url (str): url of the listing
+
+        Returns:
+            pd.DataFrame: parsed listing, see parse_listing
+        """
+        with self._listing_lock:
+            cached = self._listings.get(url)
+
+        headers = {}
+        if cached is not None:
+            if cached['etag'] is not None:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified'] is not None:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        self.log.debug('Requesting html text from {}'.format(url))
+        r = self.session.get(
+            url, headers=headers, timeout=self.request_timeout
+        )
+
+        if r.status_code == 304 and cached is not None:
+            self.log.debug('Listing not modified {}'.format(url))
+            return cached['files']
+
+        if r.status_code != 200:
+            self.log.warning('Listing not available {}, status {}'.format(
+                url, r.status_code
+            ))
+            return self.parse_listing('')
+
+        files = self.parse_listing(r.text)
+
+        etag = r.headers.get('ETag')
+        last_modified = r.headers.get('Last-Modified')
+        if etag is not None or last_modified is not None:
+            with self._listing_lock:
+                self._listings[url] = {
+                    'etag': etag,
+                    'last_modified': last_modified,
+                    'files': files,
+                }
 
-        # get the html text
-        self.log.debug('Requesting html text from {}'.format(self.url_date))
-        page = requests.get(self.url_date).text
-
-        soup = BeautifulSoup(page, 'html.parser')
-
-        # parse
-        columns = ['modified', 'file_date', 'file_name', 'out_file', 'new_file', 'url', 'size']
-        df = pd.DataFrame(columns=columns)
-
-        regex = re.compile(self.regex_file_name)
-        for node in soup.find_all('a'):
-            if node.get('href').endswith('grib2'):
-                file_name = node.get('href')
-                result = regex.match(file_name)
-
-                if result:
-                    # matched a file name so get more information about it
-                    file_url = self.url_date + file_name
-                    data = node.next_element.next_element.strip()
-                    el = data.split(' ')
-                    modified = pd.to_datetime(
-                        el[0] + ' ' + el[1]).tz_localize(tz='UTC')
-                    size = el[3]
-                    out_file = os.path.join(self.out_path, file_name)
-
-                    df = df.append({
-                        'modified': modified,
-                        'file_date': FileHandler.folder_to_date(self.folder_date, file_name),
-                        'file_name': file_name,
-                        'out_file': out_file,
-                        'new_file': not os.path.exists(out_file),
-                        'url': file_url,
-                        'size': size
-                    }, ignore_index=True)
+        return files
+
+    def parse_html_for_files(self, day=None):
+        """Parse the listing from NOMADS and look for matching filenames.
+
+        Args:
+            day (datetime, optional): day of the listing. Defaults to None
+                or the day of the start date.
+
+        Returns:
+            pd.DataFrame: data frame of files that match the pattern
+        """
+        if day is None:
+            day = self.start_date
+        url_date = self.day_url(day)
+
+        files = self.request_listing(url_date)
+        files = files[
+            files.file_name.str.match(self.regex_file_name + '$') &
+            ~(url_date + files.file_name).isin(self.seen)
+        ].reset_index(drop=True)
+
+        # initialization and forecast hour from the file name, on the day
+        # of the folder
+        hours = files.file_name.str.extract(FileHandler.FILE_PATTERN)
+        file_date = pd.Timestamp(day.strftime('%Y-%m-%d'), tz='UTC') + \
+            pd.to_timedelta(hours[0].astype(int), unit='h')
+
+        # parse by the date before looking at the local files
+        idx = (file_date >= self.start_date) & (file_date <= self.end_date)
+        files = files[idx].reset_index(drop=True)
+        hours = hours[idx].reset_index(drop=True)
+        file_date = file_date[idx].reset_index(drop=True)
+        self.log.debug(
+            'Found {} files between start and end date'.format(len(files)))
+
+        if len(files) == 0:
+            return pd.DataFrame(columns=self.COLUMNS)
+
+        out_path = self.day_folder(day)
+        journal = {}
+        if self.journal is not None:
+            journal = self.journal.files(url_date)
+
+        out_files = [
+            os.path.join(out_path, file_name) for file_name in files.file_name
+        ]
+        df = pd.DataFrame({
+            'modified': files['modified'],
+            'file_date': file_date,
+            'forecast_hour': hours[1].astype(int),
+            'file_name': files.file_name,
+            'out_file': out_files,
+            'new_file': [
+                self.is_new_file(
+                    out_file, size, journal.get(url_date + file_name),
+                    modified
+                )
+                for out_file, size, file_name, modified in zip(
+                    out_files, files['size'], files.file_name,
+                    files['modified']
+                )
+            ],
+            'url': url_date + files.file_name,
+            'size': files['size'],
+        }, columns=self.COLUMNS)
 
         self.log.debug('Found {} matching files'.format(len(df)))
 
-        if len(df) == 0:
-            return df
+        if self.journal is not None:
+            # record existing files so the next plan does not check them
+            for row in df[~df.new_file & ~df.url.isin(list(journal))].itertuples():
+                self.journal.add(row.url, row.out_file, row.size, row.modified)
 
         if not self.overwrite:
+            self.seen.update(df.url[~df.new_file])
             df = df[df.new_file]
             self.log.debug(
                 '{} files do not exist in output directory'.format(len(df)))
 
-        # parse by the date
-        idx = (df['file_date'] >= self.start_date) & \
-              (df['file_date'] <= self.end_date)
-        df = df.loc[idx]
-        self.log.debug(
-            'Found {} files between start and end date'.format(len(df)))
-
         return df
 
-    def fetch_from_url(self, uri):
+    def is_new_file(self, out_file, size, entry=None, modified=None):
+        """Check if a file from the listing needs to be downloaded. This is
+        the case when it does not exist in the output directory or it does
+        not match the size of the listing. The size is not checked for
+        subset downloads.
+
+        Files in the journal are checked against the journal entry instead
+        of the output directory. These need to be downloaded when the
+        journal has no complete download with the size and modification
+        time of the listing.
+
+        Args:
+            out_file (str): path of the local file
+            size (str): size of the file in the listing
+            entry (sqlite3.Row, optional): journal entry of the file.
+                Defaults to None.
+            modified (datetime, optional): modification time of the file in
+                the listing. Defaults to None.
+
+        Returns:
+            bool: True if the file needs to be downloaded
+        """
+        if entry is not None:
+            return not DownloadJournal.is_complete(
+                entry, None if self.subset else size, modified
+            )
+        if not os.path.exists(out_file):
+            return True
+        if self.subset:
+            return False
+
+        return not download.size_matches(os.path.getsize(out_file), size)
+
+    def fetch_from_url(self, uri, size=None, out_file=None):
+        """
+        Fetch the file at the uri and save the file to the out_path. With a
+        journal, the download is claimed and the result recorded in the
+        journal. Files that are claimed by another running process are
+        skipped.
+
+        Args:
+            uri: url of the file
+            size: (Optional) expected size, bytes or the size of the listing
+            out_file: (Optional) path to save the file to. Default: file
+                      name of the uri in the out_path
+
+        Returns:
+            False if failed or path to saved file
+        """
+        out_file = out_file or os.path.join(
+            self.out_path, uri.split('/')[-1]
+        )
+
+        if self.journal is not None and \
+                not self.journal.start(uri, out_file, size):
+            self.log.info('{} is downloaded by another run'.format(uri))
+            return False
+
+        if self.subset:
+            success = self.fetch_subset_from_url(uri, out_file)
+        else:
+            success = self.fetch_file(uri, out_file, size)
+
+        if self.journal is not None:
+            if success:
+                self.journal.complete(uri, out_file)
+            else:
+                self.journal.fail(uri)
+
+        return success
+
+    def fetch_file(self, uri, out_file, size=None):
+        """
+        Fetch the complete file at the uri.
+
+        The response is streamed to a partial file in chunks of buffer_size
+        and renamed to the file name once complete. When a download fails,
+        the partial file is kept and resumed with a range request on the next
+        attempt. The file has to match the content length of the response
+        and the given size. The GRIB2 framing is checked while the file is
+        written and files with an invalid framing are downloaded again right
+        away.
+
+        Args:
+            uri: url of the file
+            out_file: path to save the file to
+            size: (Optional) expected size, bytes or the size of the listing
+
+        Returns:
+            False if failed or path to saved file
+        """
+        success = False
+
+        for attempt in range(self.retries + 1):
+            try:
+                self.log.debug('Fetching {}'.format(uri))
+                offset = download.partial_size(out_file)
+                if offset > 0:
+                    self.log.debug(
+                        'Resuming {} from byte {}'.format(uri, offset))
+
+                if self.concurrency is None:
+                    download.download_file(
+                        uri,
+                        out_file,
+                        http_session=self.session,
+                        timeout=self.request_timeout,
+                        buffer_size=self.buffer_size,
+                        size=size,
+                        validator=self.validator(uri)
+                    )
+                else:
+                    self.fetch_adaptive(uri, out_file, size)
+
+                self.log.debug('Saved to {}'.format(out_file))
+                success = out_file
+                break
+
+            except download.ValidationError as e:
+                self.log.warning('Invalid file {}: {}'.format(uri, e))
+
+            except Exception as e:
+                self.log.warning('Problem processing response')
+                self.log.warning(e)
+                break
+
+        return success
+
+    def fetch_adaptive(self, uri, out_file, size=None):
         """
-        Fetch the file at the uri and save the file to the out_path
+        Download a file within the limit of the AdaptiveConcurrency.
+        Throttled requests are retried after the backoff of the
+        AdaptiveConcurrency.
 
         Args:
             uri: url of the file
+            out_file: path to save the file to
+            size: (Optional) expected size, bytes or the size of the listing
+
+        Raises:
+            The error of the last attempt
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with self.concurrency.request() as request:
+                    offset = download.partial_size(out_file)
+                    request.size = download.download_file(
+                        uri,
+                        out_file,
+                        http_session=self.session,
+                        timeout=self.request_timeout,
+                        buffer_size=self.buffer_size,
+                        size=size,
+                        validator=self.validator(uri)
+                    ) - offset
+                return
+
+            except Exception as e:
+                if attempt == self.retries or not download.is_throttled(e):
+                    raise
+                self.log.debug('Throttled {}, limit {}'.format(
+                    uri, self.concurrency.limit
+                ))
+
+    def fetch_subset_from_url(self, uri, out_file=None):
+        """
+        Fetch only the GRIB messages of the subset_variables from the file at
+        the uri. The byte ranges of the messages are looked up in the .idx
+        inventory next to the file and requested with HTTP range requests.
+        Adjacent messages are requested together. The messages are written
+        to the out_path as a smaller GRIB2 file. The written file has to have
+        a valid GRIB2 framing with one message per selected message of the
+        inventory and is requested again right away otherwise.
+
+        Args:
+            uri: url of the file
+            out_file: (Optional) path to save the file to. Default: file
+                      name of the uri in the out_path
 
         Returns:
             False if failed or path to saved file
         """
+        out_file = out_file or os.path.join(
+            self.out_path, uri.split('/')[-1]
+        )
 
         success = False
         try:
-            self.log.debug('Fetching {}'.format(uri))
-            r = requests.get(uri, timeout=self.request_timeout)
-            if r.status_code == 200:
-                f = r.url.split('/')[-1]
-                out_file = os.path.join(self.out_path, f)
-                with open(out_file, 'wb') as f:
-                    f.write(r.content)
-                    f.close()
-                    self.log.debug('Saved to {}'.format(out_file))
-                    success = out_file
+            self.log.debug('Fetching inventory for {}'.format(uri))
+            r = self.session.get(
+                uri + GribInventory.SUFFIX, timeout=self.request_timeout
+            )
+            if r.status_code != 200:
+                raise Exception(
+                    'Inventory not available, status {}'.format(
+                        r.status_code)
+                )
+
+            inventory = GribInventory(r.text)
+            missing = inventory.missing(self.subset_variables)
+            if len(missing) > 0:
+                self.log.warning('{} not in {}'.format(
+                    ', '.join(missing), uri
+                ))
+
+            byte_ranges = inventory.byte_ranges(self.subset_variables)
+            if len(byte_ranges) == 0:
+                raise Exception('No matching messages in inventory')
+
+            messages = len(set(
+                message['start']
+                for message in inventory.select(self.subset_variables)
+            ))
+
+            self.log.debug('Fetching {} byte ranges from {}'.format(
+                len(byte_ranges), uri
+            ))
+            for attempt in range(self.retries + 1):
+                try:
+                    self.fetch_byte_ranges(
+                        uri, out_file, byte_ranges,
+                        self.validator(uri, messages)
+                    )
+                    break
+                except download.ValidationError as e:
+                    if attempt == self.retries:
+                        raise
+                    self.log.warning('Invalid file {}: {}'.format(uri, e))
+
+            self.log.debug('Saved to {}'.format(out_file))
+            success = out_file
 
         except Exception as e:
             self.log.warning('Problem processing response')
@@ -223,15 +953,36 @@ class HttpRetrieval(ConfigFile):
 
         return success
 
+    def fetch_byte_ranges(self, uri, out_file, byte_ranges, validator=None):
+        """
+        Request the byte ranges of the file at the uri and write them to
+        out_file
+
+        Args:
+            uri: url of the file
+            out_file: path to save the file to
+            byte_ranges: list of (start, end) tuples, see
+                GribInventory.byte_ranges
+            validator: (Optional) validator of the written content
+
+        Raises:
+            IOError if the server does not support range requests
+            download.ValidationError if the validator rejects the content
+        """
+        download.download_byte_ranges(
+            uri, out_file, byte_ranges, http_session=self.session,
+            timeout=self.request_timeout, buffer_size=self.buffer_size,
+            validator=validator
+        )
+
     def check_dates(self):
+        """Convert the start and end date to UTC timestamps
 
-        # if self.start_date is not None:
+        Raises:
+            ValueError: if the end date is before the start date
+        """
         self.start_date = pd.to_datetime(self.start_date)
-        # self.start_date = start_date
-
-        # if self.end_date is not None:
         self.end_date = pd.to_datetime(self.end_date)
-        # self.end_date = end_date
 
         # check if dates are timezone aware, if not then assume UTC
         if self.start_date.tzinfo is None or \
@@ -246,10 +997,10 @@ class HttpRetrieval(ConfigFile):
         else:
             self.end_date = self.end_date.tz_convert(tz='UTC')
 
-        # The retrieval is only setup of a day at a time
-        diff = self.end_date - self.start_date
-        if diff.days > 0:
-            self.log.error('Can only download 1 day at a time')
+        if self.end_date < self.start_date:
+            raise ValueError('End date {} is before start date {}'.format(
+                self.end_date, self.start_date
+            ))
 
         # NOAA only keeps the last two days of data
         diff = pd.Timestamp.utcnow() - self.start_date
@@ -1,3 +1,5 @@
+import threading
+
 import xarray as xr
 from siphon.catalog import TDSCatalog
 
@@ -27,6 +29,9 @@ class NetCdfFile(BaseFile):
 
         self.main_cat = None
         self.day_cat = None
+        # The catalogs are shared between calls and need to be swapped
+        # by one thread at a time
+        self._catalog_lock = threading.Lock()
 
     def __del__(self):
         """
@@ -40,19 +45,17 @@ class NetCdfFile(BaseFile):
             if hasattr(self.day_cat, 'session'):
                 self.day_cat.session.close()
 
-    def load(self, file):
+    def day_dataset(self, file):
         """
-        Get valid HRRR data
+        Find the dataset for a file in the THREDDS catalog of its day
 
         Args:
             file: Path of file to open
 
         Returns:
-            Array with Xarray dataset for all variables
+            Siphon dataset
         """
-        variable_data = []
-
-        try:
+        with self._catalog_lock:
             # instead of opening a session every time, just reuse
             if self.main_cat is None:
                 self.main_cat = TDSCatalog(file[0])
@@ -80,15 +83,33 @@ class NetCdfFile(BaseFile):
                     '{}/{} does not exist on THREDDS server'.format(
                         file[1], file[2]))
 
-            d = self.day_cat.datasets[file[2]]
+            return self.day_cat.datasets[file[2]]
+
+    def load(self, file, bbox=None):
+        """
+        Get valid HRRR data
+
+        Args:
+            file: Path of file to open
+            bbox: (Optional) Bounding box to crop to, defaults to the
+                  bbox attribute
+
+        Returns:
+            Array with Xarray dataset for all variables
+        """
+        variable_data = []
+        bbox = bbox or self.bbox
+
+        try:
+            d = self.day_dataset(file)
 
             self.log.info('Reading {}'.format(file[2]))
             data = xr.open_dataset(d.access_urls['OPENDAP'])
 
-            s = data.where((data.latitude >= self.bbox[1]) &
-                           (data.latitude <= self.bbox[3]) &
-                           (data.longitude >= self.bbox[0] + 360) &
-                           (data.longitude <= self.bbox[2] + 360),
+            s = data.where((data.latitude >= bbox[1]) &
+                           (data.latitude <= bbox[3]) &
+                           (data.longitude >= bbox[0] + 360) &
+                           (data.longitude <= bbox[2] + 360),
                            drop=True)
 
             data.close()
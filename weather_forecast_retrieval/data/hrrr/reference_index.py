@@ -0,0 +1,501 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from xarray.backends.common import BackendArray
+from xarray.core import indexing
+
+from .config_file import ConfigFile
+from .file_handler import FileHandler
+from .grib_file import GribFile
+
+
+class GribMessageArray(BackendArray):
+    """
+    Lazy array of GRIB messages over the (time, forecast_hour, y, x)
+    dimensions. Messages are only read and decoded from disk for the
+    time and forecast hour combinations that are indexed.
+    Combinations without a reference are filled with NaN.
+    """
+
+    def __init__(self, reference_index, references, shape):
+        """
+        Args:
+            reference_index: ReferenceIndex instance to read messages with
+            references:      Dictionary with (time, forecast hour) index
+                             tuples as keys and (file, offset, length) as
+                             values
+            shape:           Shape of the full array
+        """
+        self.reference_index = reference_index
+        self.references = references
+        self.shape = shape
+        self.dtype = np.dtype('float32')
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.OUTER, self._getitem
+        )
+
+    def _getitem(self, key):
+        selection = [
+            np.arange(size)[dim_key] for size, dim_key in zip(self.shape, key)
+        ]
+        y_index = np.atleast_1d(selection[2])
+        x_index = np.atleast_1d(selection[3])
+
+        result = np.full(
+            [np.size(dim_index) for dim_index in selection],
+            np.nan,
+            dtype=self.dtype,
+        )
+
+        for i, time in enumerate(np.atleast_1d(selection[0])):
+            for j, hour in enumerate(np.atleast_1d(selection[1])):
+                reference = self.references.get((time, hour))
+                if reference is None:
+                    continue
+
+                values = self.reference_index.read_message(*reference)
+                result[i, j] = values[y_index][:, x_index]
+
+        # Remove the dimensions that were indexed with an integer
+        squeeze = tuple(
+            axis for axis, dim_index in enumerate(selection)
+            if np.ndim(dim_index) == 0
+        )
+        return result.squeeze(axis=squeeze) if squeeze else result
+
+
+class GribGridArray(BackendArray):
+    """
+    Lazy latitude or longitude array decoded from a single GRIB message.
+    """
+
+    def __init__(self, reference_index, reference, key, shape):
+        """
+        Args:
+            reference_index: ReferenceIndex instance to read messages with
+            reference:       (file, offset, length) of the grid message
+            key:             ecCodes key to decode, 'latitudes' or
+                             'longitudes'
+            shape:           Shape of the grid as (y, x)
+        """
+        self.reference_index = reference_index
+        self.reference = reference
+        self.key = key
+        self.shape = shape
+        self.dtype = np.dtype('float64')
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.OUTER, self._getitem
+        )
+
+    def _getitem(self, key):
+        values = self.reference_index.read_message(
+            *self.reference, key=self.key
+        )
+        return values[key[0]][..., key[1]]
+
+
+class ReferenceIndex(ConfigFile):
+    """
+    Byte-range reference index for a local HRRR directory tree.
+
+    Scanning the tree once records the location (file, offset, length) and
+    the decoded metadata of every GRIB message that is listed in the
+    variable map. The saved index can then be opened as a single lazy
+    xarray Dataset over the time and forecast hour dimensions without
+    opening each file with cfgrib. Messages are only read and decoded for
+    the parts of the dataset that are accessed.
+
+    Accumulated variables are indexed with the accumulation over the hour
+    before the forecast hour. Files from forecast hour 2 on also have the
+    accumulation since the initialization, which is skipped.
+
+    The ecCodes Python binding is only imported when scanning or reading
+    messages.
+    """
+    VERSION = 2
+    FOLDER_PATTERN = FileHandler.FOLDER_NAME_BASE.format('[0-9]' * 8)
+    FILE_PATTERN = re.compile(FileHandler.FILE_PATTERN)
+    DIMS = ('time', 'forecast_hour', 'y', 'x')
+    LEVEL_KEYS = ('typeOfLevel', 'level')
+
+    def __init__(self, file_dir, var_map=None, config=None,
+                 external_logger=None):
+        """
+        Args:
+            file_dir:        Base directory of the hrrr.YYYYMMDD folders
+            var_map:         (Optional) Variable map of messages to index.
+                             Default: GribFile.VAR_MAP
+            config:          (Optional) Full path to a .ini file or
+                             a dictionary
+            external_logger: (Optional) Specify an existing logger instance
+        """
+        super().__init__(
+            __name__, config=config, external_logger=external_logger
+        )
+
+        self.file_dir = file_dir
+        self.var_map = var_map or GribFile.VAR_MAP
+        self.grid = None
+        self.variables = {}
+        self.messages = []
+
+    def files(self):
+        """
+        Find all HRRR surface files in the directory tree
+
+        Returns:
+            Sorted list of file paths relative to the file_dir
+        """
+        files = []
+        for folder in glob.glob(
+            os.path.join(self.file_dir, self.FOLDER_PATTERN)
+        ):
+            for file_name in os.listdir(folder):
+                if self.FILE_PATTERN.fullmatch(file_name):
+                    files.append(os.path.relpath(
+                        os.path.join(folder, file_name), self.file_dir
+                    ))
+
+        return sorted(files)
+
+    def match_variable(self, handle):
+        """
+        Find the variable in the var_map that the GRIB message belongs to.
+        The level keys are compared first and each key is only read once
+        from the message, since most messages fail on those.
+
+        Args:
+            handle: ecCodes handle of the message
+
+        Returns:
+            Variable name or None if the message is not in the var_map
+        """
+        import eccodes
+
+        header = {}
+
+        def value_of(name, ktype):
+            if name not in header:
+                try:
+                    header[name] = eccodes.codes_get(
+                        handle, name, ktype=ktype
+                    )
+                except eccodes.KeyValueNotFoundError:
+                    header[name] = None
+            return header[name]
+
+        for key, params in self.var_map.items():
+            if all(
+                value_of(name, type(params[name])) == params[name]
+                for name in sorted(params, key=self.LEVEL_KEYS.__contains__,
+                                   reverse=True)
+            ):
+                return key
+
+        return None
+
+    def scan_file(self, file):
+        """
+        Read the GRIB headers of a single file and record the references
+        for all messages in the var_map.
+
+        Args:
+            file: Path relative to the file_dir
+
+        Returns:
+            List of message references
+        """
+        import eccodes
+
+        messages = []
+
+        with open(os.path.join(self.file_dir, file), 'rb') as grib:
+            while True:
+                handle = eccodes.codes_grib_new_from_file(
+                    grib, headers_only=True
+                )
+                if handle is None:
+                    break
+
+                try:
+                    key = self.match_variable(handle)
+                    if key is None:
+                        continue
+
+                    forecast_hour = eccodes.codes_get(
+                        handle, 'endStep', ktype=int
+                    )
+                    if eccodes.codes_get(handle, 'stepType') == 'accum' and \
+                            forecast_hour - eccodes.codes_get(
+                                handle, 'startStep', ktype=int
+                            ) > 1:
+                        continue
+
+                    init_time = pd.to_datetime('{:08d}{:04d}'.format(
+                        eccodes.codes_get(handle, 'dataDate'),
+                        eccodes.codes_get(handle, 'dataTime'),
+                    ), format='%Y%m%d%H%M')
+
+                    messages.append({
+                        'variable': key,
+                        'time': init_time.isoformat(),
+                        'forecast_hour': forecast_hour,
+                        'file': file,
+                        'offset': int(eccodes.codes_get(handle, 'offset')),
+                        'length': eccodes.codes_get(handle, 'totalLength'),
+                    })
+
+                    if key not in self.variables:
+                        self.variables[key] = {
+                            'name': eccodes.codes_get(handle, 'name'),
+                            'units': eccodes.codes_get(handle, 'units'),
+                        }
+
+                    if self.grid is None:
+                        self.grid = {
+                            'shape': [
+                                eccodes.codes_get(handle, 'Nj'),
+                                eccodes.codes_get(handle, 'Ni'),
+                            ],
+                            'reference': [
+                                file,
+                                messages[-1]['offset'],
+                                messages[-1]['length'],
+                            ],
+                        }
+                finally:
+                    eccodes.codes_release(handle)
+
+        return messages
+
+    def scan(self):
+        """
+        Scan all files in the directory tree
+
+        Returns:
+            The instance to allow chaining with save or open_dataset
+        """
+        self.messages = []
+        files = self.files()
+
+        self.log.info('Scanning {} files in {}'.format(
+            len(files), self.file_dir
+        ))
+
+        for file in files:
+            try:
+                self.messages += self.scan_file(file)
+            except Exception as e:
+                self.log.warning('Could not scan {}'.format(file))
+                self.log.warning(e)
+
+        self.log.info('Indexed {} messages'.format(len(self.messages)))
+
+        return self
+
+    def save(self, index_file):
+        """
+        Write the index as JSON
+
+        Args:
+            index_file: Path to the index file
+        """
+        with open(index_file, 'w') as f:
+            json.dump({
+                'version': self.VERSION,
+                'file_dir': os.path.abspath(self.file_dir),
+                'grid': self.grid,
+                'variables': self.variables,
+                'messages': self.messages,
+            }, f)
+
+        self.log.info('Saved index to {}'.format(index_file))
+
+    @classmethod
+    def load(cls, index_file, file_dir=None, config=None,
+             external_logger=None):
+        """
+        Read a saved index
+
+        Args:
+            index_file:      Path to the index file
+            file_dir:        (Optional) Base directory of the HRRR files,
+                             overrides the directory stored in the index
+            config:          (Optional) Full path to a .ini file or
+                             a dictionary
+            external_logger: (Optional) Specify an existing logger instance
+
+        Returns:
+            ReferenceIndex instance
+        """
+        with open(index_file) as f:
+            index = json.load(f)
+
+        if index['version'] != cls.VERSION:
+            raise ValueError(
+                'Unsupported index version {}'.format(index['version'])
+            )
+
+        reference_index = cls(
+            file_dir or index['file_dir'],
+            config=config,
+            external_logger=external_logger,
+        )
+        reference_index.grid = index['grid']
+        reference_index.variables = index['variables']
+        reference_index.messages = index['messages']
+
+        return reference_index
+
+    def read_message(self, file, offset, length, key='values'):
+        """
+        Read and decode a single GRIB message with a byte range read
+
+        Args:
+            file:   Path relative to the file_dir
+            offset: Byte offset of the message
+            length: Length of the message in bytes
+            key:    ecCodes array key to decode. Default: values
+
+        Returns:
+            Numpy array with the shape of the grid
+        """
+        import eccodes
+
+        with open(os.path.join(self.file_dir, file), 'rb') as grib:
+            grib.seek(offset)
+            message = grib.read(length)
+
+        handle = eccodes.codes_new_from_message(message)
+        try:
+            values = eccodes.codes_get_array(handle, key)
+            if key == 'values' and \
+                    eccodes.codes_get(handle, 'bitmapPresent'):
+                values[
+                    values == eccodes.codes_get(handle, 'missingValue')
+                ] = np.nan
+        finally:
+            eccodes.codes_release(handle)
+
+        return values.reshape(self.grid['shape'])
+
+    def open_dataset(self, bbox=None):
+        """
+        Open the indexed messages as one lazy Dataset with the dimensions
+        (time, forecast_hour, y, x). The time dimension is the
+        initialization time of the forecast.
+
+        Args:
+            bbox: (Optional) list of [lonmin, latmin, lonmax, latmax] to
+                  crop the grid to the rectangle containing the box
+
+        Returns:
+            xarray Dataset
+        """
+        if len(self.messages) == 0:
+            raise ValueError('Index has no messages, run scan first')
+
+        messages = pd.DataFrame(self.messages)
+        messages['time'] = pd.to_datetime(messages['time'])
+
+        times = np.sort(messages['time'].unique())
+        hours = np.sort(messages['forecast_hour'].unique())
+        shape = (len(times), len(hours), *self.grid['shape'])
+
+        messages['time_index'] = np.searchsorted(times, messages['time'])
+        messages['hour_index'] = np.searchsorted(
+            hours, messages['forecast_hour']
+        )
+
+        data_vars = {}
+        for key, variable in messages.groupby('variable'):
+            references = {
+                (row.time_index, row.hour_index):
+                    (row.file, row.offset, row.length)
+                for row in variable.itertuples()
+            }
+            data_vars[key] = xr.Variable(
+                self.DIMS,
+                indexing.LazilyOuterIndexedArray(
+                    GribMessageArray(self, references, shape)
+                ),
+                attrs=self.variables.get(key, {}),
+            )
+
+        coords = {
+            'time': times,
+            'forecast_hour': hours,
+            'valid_time': (
+                self.DIMS[:2],
+                times[:, np.newaxis] +
+                pd.to_timedelta(hours, unit='h').values[np.newaxis, :]
+            ),
+        }
+        for name, key in [('latitude', 'latitudes'),
+                          ('longitude', 'longitudes')]:
+            coords[name] = xr.Variable(
+                self.DIMS[2:],
+                indexing.LazilyOuterIndexedArray(GribGridArray(
+                    self, self.grid['reference'], key, shape[2:]
+                )),
+            )
+
+        dataset = xr.Dataset(data_vars, coords=coords)
+
+        if bbox is not None:
+            dataset = self.crop(dataset, bbox)
+
+        return dataset
+
+    @staticmethod
+    def crop(dataset, bbox):
+        """
+        Crop the dataset to the grid rectangle containing the bounding box
+
+        Args:
+            dataset: Dataset returned from open_dataset
+            bbox:    list of [lonmin, latmin, lonmax, latmax]
+
+        Returns:
+            Cropped dataset
+        """
+        index, _mask = GribFile.crop_window(
+            dataset.latitude.values, dataset.longitude.values, bbox
+        )
+
+        return dataset.isel(index)
+
+
+def cli():
+    """
+    Command line tool to build a reference index for a HRRR directory
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Scan a local HRRR directory once and write a byte-range "
+                    "reference index of the surface variables. The index "
+                    "can be opened as a single lazy dataset with "
+                    "ReferenceIndex.load(index_file).open_dataset()"
+    )
+
+    parser.add_argument('hrrr_dir', metavar='hrrr_dir', type=str,
+                        help='Directory of HRRR files to index')
+
+    parser.add_argument('-o', '--output', dest='index_file', type=str,
+                        required=True,
+                        help='Path of the JSON index file to write')
+
+    args = parser.parse_args(sys.argv[1:])
+
+    ReferenceIndex(args.hrrr_dir).scan().save(args.index_file)
@@ -0,0 +1,552 @@
+"""
+Helpers to download files over HTTP and write them to disk.
+
+Requests go through shared sessions that keep the connections to a host
+alive in a pool, so a TCP and TLS handshake is only needed once per pooled
+connection instead of once per file. Failed connections and server errors
+are retried with a backoff.
+
+Downloads are streamed in chunks into a partial file next to the final
+output file. The partial file is flushed to disk and renamed to the final
+name once the transfer is complete. A file with the final name is therefore
+always complete, and the memory used does not depend on the file size.
+When a transfer fails, the partial file can be kept and the download resumed
+with an HTTP Range request for the missing bytes. The ETag or Last-Modified
+header of the response is kept in a tag file next to the partial file and
+sent as If-Range, so a file that changed on the server since is downloaded
+again from the start instead of being appended to the old partial file.
+
+A validator can check the content while it is written. It gets every chunk
+with update and is closed before the partial file is renamed. A partial file
+with invalid content is always removed.
+"""
+
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Default chunk size to read from a response and write to disk
+BUFFER_SIZE = 1024 * 1024
+
+PART_SUFFIX = '.part'
+# Suffix of the file next to the partial file with the If-Range tag
+TAG_SUFFIX = '.tag'
+
+# Size of a file in a directory listing, i.e. 512, 9.3K or 141M
+LISTING_SIZE = re.compile(r'(\d+(?:\.(\d+))?)([KMGT]?)')
+LISTING_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+                 'T': 1024 ** 4}
+
+# Default number of pooled connections per host
+POOL_SIZE = 10
+
+# Default number of retries for failed connections and the RETRY_STATUS
+# responses. The wait between retries is BACKOFF_FACTOR * 2^(retry - 1)
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Responses of a server that rejects requests because of the load
+THROTTLE_STATUS = (429, 503)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class ValidationError(IOError):
+    """The downloaded content is not valid"""
+
+
+def create_session(pool_size=POOL_SIZE, retries=RETRIES):
+    """
+    Create a session with a connection pool and retries for http and https
+
+    Args:
+        pool_size: Number of connections kept alive per host. Should be at
+                   least the number of concurrent requests.
+        retries:   Number of retries for a failed request
+
+    Returns:
+        requests.Session
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_maxsize=pool_size, max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def session(pool_size=POOL_SIZE, retries=RETRIES):
+    """
+    Get the shared session for the pool size and retries. The session is
+    created on the first call and reused by all later calls with the same
+    arguments, including calls from other threads.
+
+    Args:
+        pool_size: Number of connections kept alive per host
+        retries:   Number of retries for a failed request
+
+    Returns:
+        requests.Session
+    """
+    key = (int(pool_size), int(retries))
+
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = create_session(*key)
+
+        return _sessions[key]
+
+
+def is_throttled(error):
+    """
+    Check if a request failed because the server is throttling or
+    overloaded
+
+    Args:
+        error: Exception raised by the request
+
+    Returns:
+        True for THROTTLE_STATUS responses, timeouts and connection errors
+    """
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and \
+            error.response.status_code in THROTTLE_STATUS
+
+    return isinstance(error, (requests.Timeout, requests.ConnectionError))
+
+
+def partial_file(out_file):
+    """
+    Name of the partial file used while downloading to out_file
+
+    Args:
+        out_file: Path of the final file
+
+    Returns:
+        Path of the partial file
+    """
+    return out_file + PART_SUFFIX
+
+
+def tag_file(out_file):
+    """
+    Name of the file with the If-Range tag of the partial file of out_file
+
+    Args:
+        out_file: Path of the final file
+
+    Returns:
+        Path of the tag file
+    """
+    return partial_file(out_file) + TAG_SUFFIX
+
+
+def resume_tag(headers):
+    """
+    Tag of a response to resume the download with If-Range. This is a
+    strong ETag or the Last-Modified date.
+
+    Args:
+        headers: Response headers
+
+    Returns:
+        Tag or None if the response has neither header
+    """
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def read_tag(out_file):
+    """
+    If-Range tag of the partial file of out_file
+
+    Args:
+        out_file: Path of the final file
+
+    Returns:
+        Tag or None if there is none
+    """
+    try:
+        with open(tag_file(out_file)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_tag(out_file, headers):
+    """
+    Keep the If-Range tag of a response next to the partial file of
+    out_file. An old tag is removed when the response has none.
+
+    Args:
+        out_file: Path of the final file
+        headers:  Response headers
+    """
+    tag = resume_tag(headers)
+    if tag is None:
+        remove_file(tag_file(out_file))
+        return
+
+    with open(tag_file(out_file), 'w') as f:
+        f.write(tag)
+
+
+def remove_file(file_name):
+    """Remove a file if it exists"""
+    try:
+        os.remove(file_name)
+    except FileNotFoundError:
+        pass
+
+
+def remove_partial(out_file):
+    """
+    Remove the partial file of out_file and its If-Range tag
+
+    Args:
+        out_file: Path of the final file
+    """
+    remove_file(partial_file(out_file))
+    remove_file(tag_file(out_file))
+
+
+def partial_size(out_file):
+    """
+    Number of bytes already downloaded to the partial file of out_file
+
+    Args:
+        out_file: Path of the final file
+
+    Returns:
+        Size of the partial file or 0 if there is none
+    """
+    part_file = partial_file(out_file)
+    if os.path.exists(part_file):
+        return os.path.getsize(part_file)
+    return 0
+
+
+@contextmanager
+def atomic_write(out_file, offset=0, keep_partial=False):
+    """
+    Context manager that yields a file object to the partial file of
+    out_file. When the block completes, the file is synced to disk and
+    renamed to out_file. On an error, the partial file is removed unless
+    keep_partial is set and the error is raised again. Partial files with
+    a ValidationError are always removed. The If-Range tag of the partial
+    file is removed together with it.
+
+    Args:
+        out_file:     Path of the final file
+        offset:       Continue the partial file from this byte. Any bytes
+                      after the offset are discarded.
+        keep_partial: Keep the partial file on an error to resume later
+    """
+    part_file = partial_file(out_file)
+
+    try:
+        if offset > 0:
+            f = open(part_file, 'r+b')
+            f.seek(offset)
+            f.truncate()
+        else:
+            f = open(part_file, 'wb')
+
+        with f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(part_file, out_file)
+        remove_file(tag_file(out_file))
+
+    except BaseException as e:
+        if not keep_partial or isinstance(e, ValidationError):
+            remove_partial(out_file)
+        raise
+
+
+def range_header(offset, tag=None):
+    """
+    Range header to request the bytes of a file from offset to the end.
+    With a tag, the server sends the whole file when it changed since.
+
+    Args:
+        offset: First byte to request
+        tag:    (Optional) ETag or Last-Modified date for If-Range
+
+    Returns:
+        Dictionary with the Range header or an empty one for offset 0
+    """
+    if offset == 0:
+        return {}
+
+    headers = {'Range': 'bytes={}-'.format(offset)}
+    if tag is not None:
+        headers['If-Range'] = tag
+    return headers
+
+
+def content_size(status, headers):
+    """
+    Full size of the remote file given the headers of a response
+
+    Args:
+        status:  HTTP status code of the response
+        headers: Response headers
+
+    Returns:
+        Size in bytes or None if the headers do not give the size
+    """
+    if status == 206:
+        content_range = headers.get('Content-Range', '')
+        total = content_range.split('/')[-1]
+        if total.isdigit():
+            return int(total)
+        return None
+
+    if headers.get('Content-Length', '').isdigit():
+        return int(headers['Content-Length'])
+
+    return None
+
+
+def size_matches(size, expected):
+    """
+    Check the size of a downloaded file against the expected size. The
+    expected size can be the exact number of bytes or the rounded size of a
+    directory listing (i.e. 9.3K or 141M) that has to match to the last
+    shown digit.
+
+    Args:
+        size:     Size in bytes
+        expected: Expected size as integer, listing string or None
+
+    Returns:
+        False if the size does not match, True otherwise or if the expected
+        size is not known
+    """
+    if expected is None:
+        return True
+    if isinstance(expected, int):
+        return size == expected
+
+    result = LISTING_SIZE.fullmatch(str(expected).strip().upper())
+    if result is None:
+        return True
+
+    value, decimals, unit = result.groups()
+    unit = LISTING_UNITS[unit]
+    if unit == 1:
+        return size == int(value)
+
+    step = unit * 10 ** -len(decimals or '')
+    return abs(size - float(value) * unit) <= step
+
+
+def check_size(out_file, size, *expected):
+    """
+    Check that a download has all the expected bytes
+
+    Args:
+        out_file: Path of the final file
+        size:     Number of bytes downloaded
+        expected: Expected sizes, see size_matches
+
+    Raises:
+        IOError if any of the expected sizes does not match
+    """
+    for expected_size in expected:
+        if not size_matches(size, expected_size):
+            raise IOError(
+                'Size of {} is {} bytes, expected {}'.format(
+                    out_file, size, expected_size
+                )
+            )
+
+
+def validate_partial(validator, out_file, offset, buffer_size=BUFFER_SIZE):
+    """
+    Pass the bytes of the partial file that a download resumes from to the
+    validator
+
+    Args:
+        validator:   Validator with an update method
+        out_file:    Path of the final file
+        offset:      Number of bytes to read from the partial file
+        buffer_size: Chunk size in bytes
+    """
+    with open(partial_file(out_file), 'rb') as f:
+        while offset > 0:
+            chunk = f.read(min(buffer_size, offset))
+            if len(chunk) == 0:
+                break
+            validator.update(chunk)
+            offset -= len(chunk)
+
+
+def write_response(response, file_object, buffer_size=BUFFER_SIZE,
+                   validator=None):
+    """
+    Write the body of a streamed requests response in chunks
+
+    Args:
+        response:    requests response opened with stream=True
+        file_object: File object to write to
+        buffer_size: Chunk size in bytes
+        validator:   (Optional) Validator that gets each chunk with update
+
+    Returns:
+        Number of bytes written
+    """
+    size = 0
+    for chunk in response.iter_content(chunk_size=buffer_size):
+        if validator is not None:
+            validator.update(chunk)
+        file_object.write(chunk)
+        size += len(chunk)
+
+    return size
+
+
+def download_file(url, out_file, http_session=None, timeout=None,
+                  buffer_size=BUFFER_SIZE, resume=True, size=None,
+                  validator=None):
+    """
+    Stream the file at the url to out_file.
+
+    With resume, a partial file from an earlier attempt is continued with a
+    Range request and kept when the transfer fails again. The If-Range tag
+    of the first response makes the server send the whole file when it
+    changed in the meantime. The downloaded
+    file has to match the size given by the server and the expected size.
+
+    Args:
+        url:          URL of the file
+        out_file:     Path to save the file to
+        http_session: (Optional) Session to use. Default: shared session
+        timeout:      (Optional) Request timeout in seconds
+        buffer_size:  (Optional) Chunk size in bytes
+        resume:       (Optional) Resume and keep partial files.
+                      Default: True
+        size:         (Optional) Expected size, see size_matches
+        validator:    (Optional) Validator of the content, with an update
+                      method for each chunk and a close method that raises
+                      a ValidationError for invalid content
+
+    Returns:
+        Size of the file in bytes
+
+    Raises:
+        requests.HTTPError for a response that is not successful
+        IOError if the file does not have the expected size
+        ValidationError if the validator rejects the content
+    """
+    http_session = http_session or session()
+    offset = partial_size(out_file) if resume else 0
+    tag = read_tag(out_file) if offset > 0 else None
+
+    with http_session.get(
+        url, headers=range_header(offset, tag), timeout=timeout, stream=True
+    ) as response:
+        # The partial file is at least as large as the remote file
+        if response.status_code == 416 and offset > 0:
+            remove_partial(out_file)
+            return download_file(
+                url, out_file, http_session, timeout, buffer_size,
+                resume=resume, size=size, validator=validator
+            )
+
+        response.raise_for_status()
+
+        # The server does not support ranges or the file changed and the
+        # server sends the full file
+        if response.status_code != 206:
+            offset = 0
+
+        total = content_size(response.status_code, response.headers)
+        with atomic_write(out_file, offset, keep_partial=resume) as f:
+            if resume and offset == 0:
+                write_tag(out_file, response.headers)
+            if validator is not None and offset > 0:
+                validate_partial(validator, out_file, offset, buffer_size)
+            file_size = offset + write_response(
+                response, f, buffer_size, validator
+            )
+            check_size(out_file, file_size, total, size)
+            if validator is not None:
+                validator.close()
+
+    return file_size
+
+
+def download_byte_ranges(url, out_file, byte_ranges, http_session=None,
+                         timeout=None, buffer_size=BUFFER_SIZE,
+                         validator=None):
+    """
+    Request byte ranges of the file at the url and write them one after
+    the other to out_file, i.e. to extract GRIB messages of a larger file.
+
+    Args:
+        url:          URL of the file
+        out_file:     Path to save the file to
+        byte_ranges:  List of (start, end) tuples with an inclusive end byte
+                      or None for reading to the end of the file
+        http_session: (Optional) Session to use. Default: shared session
+        timeout:      (Optional) Request timeout in seconds
+        buffer_size:  (Optional) Chunk size in bytes
+        validator:    (Optional) Validator of the written content
+
+    Returns:
+        Size of the file in bytes
+
+    Raises:
+        IOError if the server does not support range requests
+        ValidationError if the validator rejects the content
+    """
+    http_session = http_session or session()
+    file_size = 0
+
+    with atomic_write(out_file) as f:
+        for start, end in byte_ranges:
+            with http_session.get(
+                url,
+                headers={'Range': 'bytes={}-{}'.format(
+                    start, '' if end is None else end
+                )},
+                timeout=timeout,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise IOError(
+                        'Range request not supported, status {}'.format(
+                            response.status_code
+                        )
+                    )
+                file_size += write_response(
+                    response, f, buffer_size, validator
+                )
+
+        if validator is not None:
+            validator.close()
+
+    return file_size
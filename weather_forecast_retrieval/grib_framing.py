@@ -0,0 +1,211 @@
+"""
+Validate the framing of GRIB2 files while they are written.
+
+A GRIB2 message starts with the indicator section: 'GRIB', two reserved
+bytes, the discipline, the edition number 2 and the total length of the
+message as 8 byte integer. Sections 1 to 7 follow, each starting with its
+length as 4 byte integer and the section number. The message ends with
+'7777'. A file is a sequence of messages.
+
+The validator only reads the section headers and skips over the section
+contents, so checking a file costs no more than passing each downloaded
+chunk to it. Truncated files, files with an error page instead of GRIB
+data and messages with inconsistent lengths are rejected before the file
+is renamed to its final name. Files on disk are checked by reading the
+section headers and seeking over the section contents.
+"""
+
+import os
+
+from weather_forecast_retrieval import download
+
+INDICATOR = b'GRIB'
+END = b'7777'
+EDITION = 2
+
+INDICATOR_LENGTH = 16
+SECTION_LENGTH = 4
+
+
+class GribFramingError(download.ValidationError):
+    """The content does not have a valid GRIB2 framing"""
+
+
+class GribFramingValidator:
+    """
+    Streaming validator of the GRIB2 framing that counts the messages.
+
+    Example:
+        validator = GribFramingValidator()
+        for chunk in chunks:
+            validator.update(chunk)
+        validator.close()
+    """
+
+    def __init__(self, messages=None):
+        """
+        Args:
+            messages: (Optional) Expected number of messages
+        """
+        self.expected = messages
+        self.messages = 0
+        self.position = 0
+
+        self._buffer = bytearray()
+        self._parse = self._indicator
+        self._need = INDICATOR_LENGTH
+        self._skip = 0
+        self._section_length = 0
+        self._message_start = 0
+        self._message_end = 0
+
+    def update(self, data):
+        """
+        Check the next bytes of the file
+
+        Args:
+            data: bytes following the previous update
+
+        Raises:
+            GribFramingError if the bytes break the framing
+        """
+        data = memoryview(data)
+        index = 0
+
+        while index < len(data):
+            if self._skip > 0:
+                step = min(self._skip, len(data) - index)
+                self._skip -= step
+                index += step
+                self.position += step
+                continue
+
+            step = min(self._need - len(self._buffer), len(data) - index)
+            self._buffer += data[index:index + step]
+            index += step
+            self.position += step
+
+            if len(self._buffer) == self._need:
+                header = bytes(self._buffer)
+                self._buffer.clear()
+                self._parse(header)
+
+    def read(self, file_object):
+        """
+        Check an open file from its current position to the end. Only the
+        section headers are read, the section contents are seeked over.
+
+        Args:
+            file_object: File opened in binary mode
+
+        Returns:
+            Number of messages, see close
+
+        Raises:
+            GribFramingError if the file does not have a valid framing
+        """
+        while True:
+            if self._skip > 0:
+                start = file_object.tell()
+                end = file_object.seek(self._skip, 1)
+                # seeking past the end of the file does not read bytes
+                size = min(end, os.fstat(file_object.fileno()).st_size)
+                self.position += size - start
+                self._skip = 0
+                if size < end:
+                    break
+
+            data = file_object.read(self._need - len(self._buffer))
+            if len(data) == 0:
+                break
+            self.update(data)
+
+        return self.close()
+
+    def close(self):
+        """
+        Check that the file ended after a complete message
+
+        Returns:
+            Number of messages
+
+        Raises:
+            GribFramingError for a truncated or empty file or a different
+            number of messages than expected
+        """
+        if self._parse != self._indicator or len(self._buffer) > 0:
+            self._error(
+                'File ends at byte {} within message {}'.format(
+                    self.position, self.messages + 1
+                )
+            )
+        if self.messages == 0:
+            self._error('File has no GRIB messages')
+        if self.expected is not None and self.messages != self.expected:
+            self._error('File has {} GRIB messages, expected {}'.format(
+                self.messages, self.expected
+            ))
+
+        return self.messages
+
+    def _error(self, message):
+        raise GribFramingError(message)
+
+    def _indicator(self, header):
+        self._message_start = self.position - INDICATOR_LENGTH
+
+        if header[:4] != INDICATOR:
+            self._error('Expected GRIB at byte {}'.format(
+                self._message_start
+            ))
+        if header[7] != EDITION:
+            self._error('GRIB edition {} at byte {}, expected {}'.format(
+                header[7], self._message_start, EDITION
+            ))
+
+        length = int.from_bytes(header[8:16], 'big')
+        if length < INDICATOR_LENGTH + len(END):
+            self._error('Message length {} at byte {} is too short'.format(
+                length, self._message_start
+            ))
+
+        self._message_end = self._message_start + length
+        self._parse = self._section
+        self._need = SECTION_LENGTH
+
+    def _section(self, header):
+        if header == END:
+            if self.position != self._message_end:
+                self._error(
+                    'Message {} at byte {} ends at {}, expected {}'.format(
+                        self.messages + 1, self._message_start,
+                        self.position, self._message_end
+                    )
+                )
+            self.messages += 1
+            self._parse = self._indicator
+            self._need = INDICATOR_LENGTH
+            return
+
+        length = int.from_bytes(header, 'big')
+        start = self.position - SECTION_LENGTH
+        if length <= SECTION_LENGTH or \
+                start + length > self._message_end - len(END):
+            self._error('Section length {} at byte {} does not fit in '
+                        'message {}'.format(length, start, self.messages + 1))
+
+        self._section_length = length
+        self._parse = self._section_number
+        self._need = 1
+
+    def _section_number(self, header):
+        number = header[0]
+        if not 1 <= number <= 7:
+            self._error('Unknown section {} at byte {}'.format(
+                number, self.position - SECTION_LENGTH - 1
+            ))
+
+        # the section contents are skipped in update before the next header
+        self._skip = self._section_length - SECTION_LENGTH - 1
+        self._parse = self._section
+        self._need = SECTION_LENGTH
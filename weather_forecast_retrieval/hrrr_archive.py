@@ -18,63 +18,216 @@ http://hrrr.chpc.utah.edu/
 
 import argparse
 import os
-import time
-from datetime import datetime
+import re
+from datetime import timedelta
+from functools import partial
 
 import pandas as pd
 import pytz
-import requests
 
-from weather_forecast_retrieval import utils
+from weather_forecast_retrieval import download, utils
+from weather_forecast_retrieval.concurrency import (
+    AdaptiveConcurrency, RateLimiter
+)
+from weather_forecast_retrieval.data.hrrr import GribInventory
+from weather_forecast_retrieval.grib_framing import GribFramingValidator
+from weather_forecast_retrieval.hrrr_preprocessor import HRRRPreprocessor
+from weather_forecast_retrieval.journal import DownloadJournal, open_journal
+from weather_forecast_retrieval.scheduler import BlackoutWindow, JobScheduler
 
-# times when downloading should stop as recomended by U of U
+ARCHIVE_URL = 'https://pando-rgw01.chpc.utah.edu/'
+
+# times when downloading should stop as recomended by U of U, the last
+# half of the no_hours in Mountain Time
 tzmdt = pytz.timezone('America/Denver')
 no_hours = [0, 3, 6, 9, 12, 15, 18, 21]
+ARCHIVE_BLACKOUT = BlackoutWindow(no_hours, start_minute=31, timezone=tzmdt)
+ARCHIVE_SOURCE = 'archive'
+
+# Courtesy limits for the archive. Downloads start at most RATE times per
+# second, with up to BURST at once, and WORKERS transfers overlap.
+RATE = 0.2
+BURST = 1
+WORKERS = 4
+
+# Status of the files in a backfill plan
+COMPLETE = 'complete'
+MISSING = 'missing'
+INVALID = 'invalid'
+
+# Approximate size of a file of each field in bytes to estimate a backfill
+# when there are no complete files to take the size from, and the assumed
+# download bandwidth in bytes per second
+FILE_SIZES = {
+    'sfc': 140 * 1024 ** 2,
+    'subh': 400 * 1024 ** 2,
+    'prs': 380 * 1024 ** 2,
+    'nat': 650 * 1024 ** 2,
+}
+SUBSET_FILE_SIZE = 10 * 1024 ** 2
+BANDWIDTH = 20 * 1024 ** 2
+
+DAY_DIRECTORY = re.compile(r'hrrr\.(\d{8})$')
+
+
+def archive_file_name(model, field, hour, forecast):
+    """
+    Name of a file in the archive, i.e. hrrr.t00z.wrfsfcf01.grib2
 
+    Args:
+        model:    Model type, i.e. hrrr
+        field:    Variable field, i.e. sfc
+        hour:     Model run hour
+        forecast: Forecast hour
 
-def check_before_download(logger):
+    Returns:
+        File name
     """
-    See if it is an okay time to download from U of U based on the times
-    that they are pulling data.
+    return "%s.t%02dz.wrf%sf%02d.grib2" % (model, hour, field, forecast)
+
+
+def is_complete_file(file_name):
     """
-    nowutc = datetime.utcfromtimestamp(time.time())
-    tzmdt = pytz.timezone('America/Denver')
-    nowtime_mdt = nowutc.replace(tzinfo=pytz.utc).astimezone(tzmdt)
+    Check if a local file is a complete GRIB2 file. The file size has to
+    match the lengths of its messages, which a truncated download does not.
+    Only the section headers are read from disk.
+
+    Args:
+        file_name: Path of the local file
 
-    this_hour = nowtime_mdt.time().hour
-    this_min = nowtime_mdt.time().minute
+    Returns:
+        True if the file exists and has a valid GRIB2 framing
+    """
+    if not os.path.isfile(file_name):
+        return False
 
-    # make sure we are not initiating download at an inconvenient time
-    if this_hour in no_hours:
-        while this_hour in no_hours and this_min > 30:
-            # nowtime = datetime.now()
-            nowutc = datetime.utcfromtimestamp(time.time())
-            nowtime_mdt = nowutc.replace(tzinfo=pytz.utc).astimezone(tzmdt)
-            # print(nowtime_mdt)
-            logger.info('Sleeping {}'.format(nowtime_mdt))
-            this_hour = nowtime_mdt.time().hour
-            this_min = nowtime_mdt.time().minute
+    try:
+        with open(file_name, 'rb') as f:
+            GribFramingValidator().read(f)
+    except download.ValidationError:
+        return False
 
-            time.sleep(100)
+    return True
 
 
-def download_url(fname, OUTDIR, logger, file_day, model='hrrr', field='sfc'):
+def download_subset(url, out_file, variables=None, http_session=None,
+                    retries=download.RETRIES, journal=None):
+    """
+    Download only the GRIB messages of the variables from the file at the
+    url. The byte ranges of the messages are looked up in the .idx inventory
+    that the archive has next to the file. The messages are written to
+    out_file as a smaller GRIB2 file that has to have one message per
+    selected message of the inventory.
+
+    Args:
+        url:          URL of the file
+        out_file:     Path to save the file to
+        variables:    (Optional) list of wgrib2 match strings.
+                      Default: GribInventory.VARIABLES
+        http_session: (Optional) requests session. Default: shared session
+        retries:      (Optional) Number of retries for an invalid file
+        journal:      (Optional) DownloadJournal to calculate the checksum
+                      of the file for
+
+    Returns:
+        Size of the file in bytes
+
+    Raises:
+        IOError if the inventory is not available or has no matching
+        messages
+        download.ValidationError if the file is invalid after the retries
+    """
+    http_session = http_session or download.session()
+
+    response = http_session.get(url + GribInventory.SUFFIX)
+    if response.status_code in download.THROTTLE_STATUS:
+        response.raise_for_status()
+    if response.status_code != 200:
+        raise IOError('Inventory not available, status {}'.format(
+            response.status_code
+        ))
+
+    inventory = GribInventory(response.text)
+    byte_ranges = inventory.byte_ranges(variables)
+    if len(byte_ranges) == 0:
+        raise IOError('No matching messages in inventory')
+
+    messages = len(set(
+        message['start'] for message in inventory.select(variables)
+    ))
+
+    for attempt in range(retries + 1):
+        validator = GribFramingValidator(messages)
+        if journal is not None:
+            validator = journal.validator(url, validator)
+        try:
+            return download.download_byte_ranges(
+                url, out_file, byte_ranges, http_session=http_session,
+                validator=validator
+            )
+        except download.ValidationError:
+            if attempt == retries:
+                raise
+
+
+def download_adaptive(fetch, concurrency, logger, retries=download.RETRIES):
+    """
+    Run a download within the limit of the AdaptiveConcurrency. Throttled
+    requests are retried after the backoff of the AdaptiveConcurrency.
+
+    Args:
+        fetch:       Function that downloads the file and returns the
+                     number of bytes
+        concurrency: AdaptiveConcurrency
+        logger:      Logger instance
+        retries:     Number of retries for throttled requests
+
+    Raises:
+        The error of the last attempt
+    """
+    for attempt in range(retries + 1):
+        try:
+            with concurrency.request() as request:
+                request.size = fetch()
+            return
+
+        except Exception as e:
+            if attempt == retries or not download.is_throttled(e):
+                raise
+            logger.debug('Throttled, limit {}'.format(concurrency.limit))
+
+
+def download_url(fname, OUTDIR, logger, file_day, model='hrrr', field='sfc',
+                 http_session=None, concurrency=None, journal=None,
+                 rate_limiter=None, variables=None):
     """
     Construct full URL and download file
 
     Args:
-        fname:      HRRR file name
-        OUTDIR:     Location to put HRRR file
-        logger:     Logger instance
-        file_day:   datetime date correspondig to the hrrr
-                    file (i.e hrrr.{date}/hrrr...)
+        fname:          HRRR file name
+        OUTDIR:         Location to put HRRR file
+        logger:         Logger instance
+        file_day:       datetime date correspondig to the hrrr
+                        file (i.e hrrr.{date}/hrrr...)
+        http_session:   (Optional) requests session to reuse connections.
+                        Default: shared session from download.session
+        concurrency:    (Optional) AdaptiveConcurrency to limit the
+                        concurrent downloads and back off when throttled.
+                        Use a http_session without retries, so that the
+                        throttled requests reach it.
+        journal:        (Optional) DownloadJournal, files that are complete
+                        in the journal are not requested again
+        rate_limiter:   (Optional) RateLimiter to wait for before the
+                        requests for the file
+        variables:      (Optional) list of wgrib2 match strings to only
+                        download these GRIB messages, see download_subset
 
     Returns:
         success:    boolean of weather or not we were succesful
 
     """
 
-    URL = "https://pando-rgw01.chpc.utah.edu/%s/%s/%s/%s" \
+    URL = ARCHIVE_URL + "%s/%s/%s/%s" \
         % (model, field, file_day.strftime('%Y%m%d'), fname)
 
     # 2) Rename file with date preceeding original filename
@@ -87,37 +240,74 @@ def download_url(fname, OUTDIR, logger, file_day, model='hrrr', field='sfc'):
     if not os.path.exists(redir):
         os.makedirs(redir)
 
-    # 3) Download the file via https
-    # Check the file size, make it's big enough to exist.
-    check_this = requests.head(URL)
-    file_size = int(check_this.headers['content-length'])
+    new_file = os.path.join(OUTDIR, rename)
+    if journal is not None and DownloadJournal.is_complete(journal.get(URL)):
+        logger.debug('Already downloaded: {}'.format(URL))
+        return True
+
+    # A complete file of an earlier run is not requested again
+    if is_complete_file(new_file):
+        logger.debug('Already downloaded: {}'.format(new_file))
+        if journal is not None:
+            journal.add(URL, new_file)
+        return True
+
+    if journal is not None and not journal.start(URL, new_file):
+        logger.info('{} is downloaded by another run'.format(URL))
+        return False
+
+    # 3) Download the file via https, as a courtesy for using the archive
+    # at the rate of the limiter.
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    http_session = http_session or download.session()
+
+    def fetch():
+        if variables is not None:
+            return download_subset(
+                URL, new_file, variables, http_session, journal=journal
+            )
+
+        # One streamed request that has to match the content-length.
+        # A missing key is an error response and an error message
+        # instead of GRIB data is rejected by the validator.
+        validator = GribFramingValidator()
+        if journal is not None:
+            validator = journal.validator(URL, validator)
+        return download.download_file(
+            URL, new_file, http_session=http_session, validator=validator
+        )
 
     success = False
     try:
-        if file_size > 10000:
+        if variables is not None:
+            logger.info("Downloading subset: {}".format(URL))
+        else:
             logger.info("Downloading: {}".format(URL))
-            new_file = os.path.join(OUTDIR, rename)
-            r = requests.get(URL, allow_redirects=True)
-            with open(new_file, 'wb') as f:
-                f.write(r.content)
-                logger.debug('Saved file to: {}'.format(new_file))
-            success = True
+
+        if concurrency is None:
+            fetch()
         else:
-            # URL returns an "Key does not exist" message
-            logger.error("ERROR:", URL, "Does Not Exist")
-            success = False
+            download_adaptive(fetch, concurrency, logger)
+        logger.debug('Saved file to: {}'.format(new_file))
+        success = True
 
     except Exception as e:
         logger.error('Error downloading or writing file: {}'.format(e))
 
-    # 4) Sleep five seconds, as a courtesy for using the archive.
-    time.sleep(5)
+    if journal is not None:
+        if success:
+            journal.complete(URL, new_file)
+        else:
+            journal.fail(URL)
 
     return success
 
 
 def download_HRRR(DATE, logger, model='hrrr', field='sfc', hour=range(0, 24),
-                  fxx=range(0, 1), OUTDIR='./'):
+                  fxx=range(0, 1), OUTDIR='./', concurrency=None,
+                  journal=None, rate_limiter=None, http_session=None,
+                  variables=None):
     """
     Downloads from the University of Utah MesoWest HRRR archive
     Input:
@@ -130,33 +320,200 @@ def download_HRRR(DATE, logger, model='hrrr', field='sfc', hour=range(0, 24),
         hour   - Range of model run hours. Default grabs all hours of day.
         fxx    - Range of forecast hours. Default grabs analysis hour (f00).
         OUTDIR - Directory to save the files.
+        concurrency - (Optional) AdaptiveConcurrency for the downloads
+        journal - (Optional) DownloadJournal for the downloads
+        rate_limiter - (Optional) RateLimiter for the downloads
+        http_session - (Optional) requests session for the downloads
+        variables - (Optional) wgrib2 match strings to only download these
+                    GRIB messages of the files
+
+    Returns:
+        List of booleans whether each download was successful
 
     Outcome:
         Downloads the desired HRRR file and outputs it into the same directory
         structure as NOMADS
     """
 
+    results = []
+
     # Loop through each hour and each forecast and download.
     for h in hour:
         for f in fxx:
-            # check current time to see if we can run
-            # replace utc local with MDT
-            # check_before_download(logger)
-
-            fname = "%s.t%02dz.wrf%sf%02d.grib2" % (model, h, field, f)
+            fname = archive_file_name(model, field, h, f)
 
             success = download_url(fname, OUTDIR, logger,
-                                   DATE, model=model, field=field)
+                                   DATE, model=model, field=field,
+                                   concurrency=concurrency,
+                                   journal=journal,
+                                   rate_limiter=rate_limiter,
+                                   http_session=http_session,
+                                   variables=variables)
 
             if not success:
                 logger.error('Failed to download {} for {}'.format(fname,
                                                                    DATE))
+            results.append(success)
+
+    return results
+
+
+def scan_save_dir(save_dir, start_date=None, end_date=None):
+    """
+    List the files of the hrrr.YYYYMMDD folders in save_dir with one
+    directory listing per day.
+
+    Args:
+        save_dir:   base HRRR directory
+        start_date: (Optional) first day to list
+        end_date:   (Optional) last day to list
+
+    Returns:
+        Dictionary of day folder name to a dictionary of file name to size
+    """
+    start_day = None if start_date is None else \
+        pd.to_datetime(start_date).strftime('%Y%m%d')
+    end_day = None if end_date is None else \
+        pd.to_datetime(end_date).strftime('%Y%m%d')
+
+    days = {}
+    with os.scandir(save_dir) as entries:
+        for entry in entries:
+            match = DAY_DIRECTORY.match(entry.name)
+            if match is None or not entry.is_dir():
+                continue
+            if start_day is not None and match.group(1) < start_day:
+                continue
+            if end_day is not None and match.group(1) > end_day:
+                continue
+
+            with os.scandir(entry.path) as files:
+                days[entry.name] = {
+                    f.name: f.stat().st_size for f in files if f.is_file()
+                }
+
+    return days
+
+
+def plan_backfill(start_date, end_date, save_dir, forecasts=range(3),
+                  model_type='hrrr', var_type='sfc', validate=True):
+    """
+    Compare the files in save_dir with the requested hours and forecasts.
+    The save_dir is listed once and, with validate, the GRIB2 framing of the
+    existing files is checked.
+
+    Args:
+        start_date: datetime object of start date
+        end_date:   datetime object of end date
+        save_dir:   base HRRR directory
+        forecasts:  forecast hours to get for each hour
+        model_type: model type, defaults to hrrr
+        var_type:   variable type, defaults to sfc
+        validate:   check the GRIB2 framing of the existing files, otherwise
+                    every existing file is complete
+
+    Returns:
+        Dataframe with a row for each requested file and the columns
+        date_time, file_day, file_name, out_file, size and status. The
+        status is COMPLETE, MISSING or INVALID and size the size of the
+        local file.
+    """
+    files = scan_save_dir(save_dir, start_date, end_date)
+
+    rows = []
+    for dd in pd.date_range(start_date, end_date, freq='H'):
+        day = 'hrrr.{}'.format(dd.strftime('%Y%m%d'))
+        day_files = files.get(day, {})
+
+        for f in forecasts:
+            file_name = archive_file_name(model_type, var_type, dd.hour, f)
+            out_file = os.path.join(save_dir, day, file_name)
+            size = day_files.get(file_name)
+
+            if size is None:
+                status = MISSING
+            elif validate and not is_complete_file(out_file):
+                status = INVALID
+            else:
+                status = COMPLETE
+
+            rows.append({
+                'date_time': dd,
+                'file_day': dd.date(),
+                'file_name': file_name,
+                'out_file': out_file,
+                'size': size or 0,
+                'status': status,
+            })
+
+    return pd.DataFrame(rows, columns=[
+        'date_time', 'file_day', 'file_name', 'out_file', 'size', 'status'
+    ])
+
+
+def estimate_backfill(plan, var_type='sfc', rate=RATE, bandwidth=BANDWIDTH,
+                      variables=None):
+    """
+    Estimate the bytes and duration to download the files of a plan that
+    are not complete. The size of a file is the median size of the complete
+    files of the plan or the FILE_SIZES of the field. The duration is bound
+    by the rate of the downloads or the bandwidth.
+
+    Args:
+        plan:      Dataframe from plan_backfill
+        var_type:  variable type, defaults to sfc
+        rate:      downloads started per second
+        bandwidth: download bandwidth in bytes per second
+        variables: wgrib2 match strings of a subset download
+
+    Returns:
+        Dictionary with the number of files, missing and invalid files,
+        bytes and duration as timedelta
+    """
+    complete = plan[plan.status == COMPLETE]
+    if len(complete) > 0:
+        file_size = int(complete['size'].median())
+    elif variables is not None:
+        file_size = SUBSET_FILE_SIZE
+    else:
+        file_size = FILE_SIZES.get(var_type, FILE_SIZES['sfc'])
+
+    files = int((plan.status != COMPLETE).sum())
+    size = files * file_size
+
+    return {
+        'files': files,
+        'missing': int((plan.status == MISSING).sum()),
+        'invalid': int((plan.status == INVALID).sum()),
+        'bytes': size,
+        'duration': timedelta(seconds=max(files / rate, size / bandwidth)),
+    }
 
 
 def HRRR_from_UofU(start_date, end_date, save_dir, external_logger=None,
-                   forecasts=range(3), model_type='hrrr', var_type='sfc'):
+                   forecasts=range(3), model_type='hrrr', var_type='sfc',
+                   journal=None, workers=WORKERS, rate=RATE, burst=BURST,
+                   variables=None, dry_run=False, blackout=ARCHIVE_BLACKOUT,
+                   job_scheduler=None, adaptive=False, bbox=None,
+                   output_path=None):
     """
-    Download HRRR data from the University of Utah
+    Download HRRR data from the University of Utah. Only the files that
+    are missing or invalid in save_dir are downloaded, see plan_backfill.
+    The files are downloaded by a pool of workers and the downloads start
+    at the rate of a token bucket to stay within the courtesy limits of the
+    archive. Downloads are deferred while the archive is in the blackout
+    window. With adaptive, the number of concurrent downloads adapts to
+    the throughput of the archive between one and the workers and backs off
+    when the archive throttles.
+
+    To keep working during a blackout, pass a JobScheduler with other
+    jobs, i.e. preprocessing or downloads from other sources. The downloads
+    are added to it as ARCHIVE_SOURCE jobs and the caller runs it.
+
+    With bbox and output_path, the files are cropped with the
+    HRRRPreprocessor by the same workers. The complete files in save_dir
+    are cropped right away, which keeps the workers busy during a blackout,
+    and the downloaded files once they are saved.
 
     Args:
         start_date:         datetime object of start date
@@ -166,9 +523,30 @@ def HRRR_from_UofU(start_date, end_date, save_dir, external_logger=None,
         forecasts:          forecast hours to get for each hour
         model_type:         model type to download, defaults to hrrr
         var_type:           variable type to download, default to sfc
+        journal:            DownloadJournal or path of the journal database
+                            to skip complete files and record downloads
+        workers:            number of downloads at the same time
+        rate:               downloads started per second
+        burst:              downloads that can start at once after the
+                            workers waited
+        variables:          wgrib2 match strings to only download these GRIB
+                            messages using the .idx inventory of the archive,
+                            i.e. GribInventory.VARIABLES. Default: full files
+        dry_run:            only log the plan and estimate of the backfill
+        blackout:           BlackoutWindow of the archive or None to ignore
+                            it. Default: ARCHIVE_BLACKOUT
+        job_scheduler:      JobScheduler to add the downloads to without
+                            running them. The workers argument is not used.
+        adaptive:           adapt the number of concurrent downloads with an
+                            AdaptiveConcurrency
+        bbox:               bounding box [lon W, lon E, lat S, lat N] to crop
+                            the files to, requires output_path
+        output_path:        directory to write the cropped files to
 
     Return:
-
+        List of booleans whether each missing or invalid file was
+        downloaded, the list of Jobs with a job_scheduler or the plan from
+        plan_backfill for a dry run
     """
     logger = external_logger or utils.setup_local_logger(__name__)
 
@@ -186,9 +564,6 @@ def HRRR_from_UofU(start_date, end_date, save_dir, external_logger=None,
             logger.error('forecasts must be a list or range')
             raise Exception('forecasts must be a list or range')
 
-    # HRRR data is hourly so create a list of hourly values
-    dt_index = pd.date_range(start_date, end_date, freq='H')
-
     # Make save_dir path if it doesn't exist.
     if not os.path.exists(save_dir):
         raise IOError('save_dir {} does not exist'.format(save_dir))
@@ -197,17 +572,106 @@ def HRRR_from_UofU(start_date, end_date, save_dir, external_logger=None,
     logger.info('Collecting hrrr data for {} through {}'.format(
         start_date, end_date))
     logger.info('Forecast hours: {}'.format(forecasts))
-    for dd in dt_index:
 
-        # hour needs to be a list
-        hrs = [dd.hour]
-
-        # get the data
-        download_HRRR(dd.date(), logger, model=model_type, field=var_type,
-                      hour=hrs, fxx=forecasts, OUTDIR=save_dir)
+    # HRRR data is hourly, plan the files of each hour that are needed
+    plan = plan_backfill(
+        start_date, end_date, save_dir, forecasts, model_type, var_type
+    )
+    estimate = estimate_backfill(
+        plan, var_type, rate=rate, variables=variables
+    )
+    logger.info(
+        '{files} of {total} files to download, {missing} missing and '
+        '{invalid} invalid, about {size:.1f} GB in {duration}'.format(
+            total=len(plan), size=estimate['bytes'] / 1024 ** 3, **estimate
+        )
+    )
+    if dry_run:
+        return plan
+
+    journal = open_journal(journal)
+    rate_limiter = RateLimiter(rate, burst)
+    concurrency = None
+    retries = download.RETRIES
+    if adaptive:
+        concurrency = AdaptiveConcurrency(max_limit=workers)
+        # throttled requests are retried by download_adaptive
+        retries = 0
+    http_session = download.session(
+        pool_size=max(int(workers), download.POOL_SIZE), retries=retries
+    )
 
-        # pause to be nice
-        time.sleep(3)
+    fetch = partial(
+        download_url, model=model_type, field=var_type,
+        http_session=http_session, concurrency=concurrency, journal=journal,
+        rate_limiter=rate_limiter, variables=variables
+    )
+    complete = plan[plan.status == COMPLETE]
+    plan = plan[plan.status != COMPLETE]
+    files = [
+        (row.file_name, save_dir, logger, row.file_day)
+        for row in plan.itertuples()
+    ]
+
+    run = job_scheduler is None
+    if run:
+        job_scheduler = JobScheduler(workers, logger=logger)
+    if blackout is not None:
+        job_scheduler.blackouts[ARCHIVE_SOURCE] = blackout
+
+    crops = []
+    if bbox is not None and output_path is not None:
+        preprocessor = HRRRPreprocessor(
+            save_dir, None, None, output_path, bbox, None
+        )
+
+        def crop(out_file):
+            crops.append(
+                job_scheduler.submit(preprocessor.crop_file, out_file)
+            )
+
+        # local jobs without a source are not deferred by the blackout
+        for out_file in complete.out_file:
+            crop(out_file)
+
+        download_file = fetch
+
+        def fetch(fname, OUTDIR, logger, file_day):
+            success = download_file(fname, OUTDIR, logger, file_day)
+            if success:
+                crop(os.path.join(
+                    OUTDIR, 'hrrr.{}'.format(file_day.strftime('%Y%m%d')),
+                    fname
+                ))
+            return success
+
+    jobs = [
+        job_scheduler.submit(fetch, *file, source=ARCHIVE_SOURCE)
+        for file in files
+    ]
+    if not run:
+        return jobs
+
+    logger.info('Downloading with {} workers at {} files per second'.format(
+        workers, rate
+    ))
+
+    # get the data
+    job_scheduler.run()
+    results = [job.result if job.error is None else False for job in jobs]
+
+    for (fname, _, _, file_day), success in zip(files, results):
+        if not success:
+            logger.error('Failed to download {} for {}'.format(
+                fname, file_day
+            ))
+
+    if len(crops) > 0:
+        logger.info('Cropped {} of {} files'.format(
+            sum(job.result is not None for job in crops), len(crops)
+        ))
+
+    return results
 
 
 def cli():
@@ -235,6 +699,56 @@ def cli():
                         required=False, default=1, type=int,
                         help='Number of forecasts to get')
 
+    parser.add_argument('-j', '--journal', dest='journal',
+                        required=False, default=None,
+                        help='Path of the download journal database')
+
+    parser.add_argument('-w', '--workers', dest='workers',
+                        required=False, default=WORKERS, type=int,
+                        help='Number of downloads at the same time')
+
+    parser.add_argument('-r', '--rate', dest='rate',
+                        required=False, default=RATE, type=float,
+                        help='Downloads started per second')
+
+    parser.add_argument('-b', '--burst', dest='burst',
+                        required=False, default=BURST, type=int,
+                        help='Downloads that can start at once')
+
+    parser.add_argument('--dry-run', dest='dry_run',
+                        action='store_true',
+                        help='Only show the number of missing files and the '
+                             'estimated size and duration of the download')
+
+    parser.add_argument('--ignore-blackout', dest='ignore_blackout',
+                        action='store_true',
+                        help='Download during the hours the archive is '
+                             'pulling data')
+
+    parser.add_argument('--adaptive', dest='adaptive',
+                        action='store_true',
+                        help='Adapt the number of downloads at the same time '
+                             'to the throughput of the archive, up to the '
+                             'number of workers')
+
+    parser.add_argument('--subset', dest='subset',
+                        action='store_true',
+                        help='Only download the GRIB messages of the surface '
+                             'variables using byte range requests')
+
+    parser.add_argument('--bbox', dest='bbox',
+                        type=lambda s: [i.strip() for i in s.split(',')],
+                        required=False, default=None,
+                        help="Bounding box to crop the files to as delimited "
+                             "string --bbox='longitude left, longitude "
+                             "right, latitude bottom, latitude top', "
+                             "requires -p")
+
+    parser.add_argument('-p', '--preprocess_path', dest='output_path',
+                        required=False, default=None,
+                        help='Directory to write the cropped files to, the '
+                             'complete files are cropped during a blackout')
+
     # start_date, end_date, save_dir, external_logger=None,
     # forecasts=range(3), model_type='hrrr', var_type='sfc'):
 
@@ -243,5 +757,15 @@ def cli():
         args.start_date,
         args.end_date,
         args.save_dir,
-        forecasts=range(0, args.forecasts)
+        forecasts=range(0, args.forecasts),
+        journal=args.journal,
+        workers=args.workers,
+        rate=args.rate,
+        burst=args.burst,
+        variables=GribInventory.VARIABLES if args.subset else None,
+        dry_run=args.dry_run,
+        blackout=None if args.ignore_blackout else ARCHIVE_BLACKOUT,
+        adaptive=args.adaptive,
+        bbox=args.bbox,
+        output_path=args.output_path
     )
@@ -1,6 +1,9 @@
 import argparse
 import sys
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 
 from weather_forecast_retrieval import utils
 from weather_forecast_retrieval.data.hrrr import HttpRetrieval
@@ -11,8 +14,14 @@ class HRRRNOMADS():
     """Helper class to aid in the interaction with downloading HRRR
     data from NOMADS.
     """
+    CROP_WORKERS = 2
+    WATCH_INTERVAL = 120
+    # Longest wait in seconds after failed polls
+    WATCH_MAX_BACKOFF = 900
 
-    def __init__(self, output_dir, num_requests=2, overwrite=False, verbose=False) -> None:
+    def __init__(self, output_dir, num_requests=2, overwrite=False, verbose=False,
+                 subset=False, engine='thread', rate_limit=None,
+                 adaptive=False, priority='date', journal=None) -> None:
 
         logLevel = 'DEBUG' if verbose else 'INFO'
         self._logger = utils.setup_local_logger(__name__, loglevel=logLevel)
@@ -21,8 +30,19 @@ class HRRRNOMADS():
         self.num_requests = num_requests
         self.overwrite = overwrite
         self.verbose = verbose
-
-        self.http_retrieval = HttpRetrieval(overwrite=overwrite, external_logger=self._logger)
+        self.subset = subset
+        self.engine = engine
+        self.cropped_files = []
+
+        config = {'output': {'adaptive': adaptive}}
+        if rate_limit is not None:
+            config['output']['rate_limit'] = rate_limit
+
+        self.http_retrieval = HttpRetrieval(
+            overwrite=overwrite, subset=subset, config=config,
+            external_logger=self._logger, num_requests=num_requests,
+            engine=engine, priority=priority, journal=journal
+        )
         self.http_retrieval.output_dir = output_dir
 
     def set_dates(self, start_date, end_date, forecast_hrs):
@@ -65,6 +85,80 @@ class HRRRNOMADS():
 
         return self.http_retrieval.fetch_by_date(start_date, end_date, forecast_hrs)
 
+    def watch(self, interval=WATCH_INTERVAL, latest=3, forecast_hrs=None,
+              polls=None, stop=None):
+        """Poll the listings for the latest hours and download new files as
+        soon as they appear. Listings are requested with the ETag and
+        Last-Modified of the previous poll and files that were already
+        downloaded or found are not checked again.
+
+        A failed poll is logged and the wait before the next poll doubles
+        with each failed poll in a row, up to WATCH_MAX_BACKOFF. Once
+        watching stops, the start and end date span all polls, so
+        preprocessing covers the files of all of them.
+
+        Args:
+            interval (float, optional): Seconds between polls. Defaults
+                to WATCH_INTERVAL.
+            latest (int, optional): Number of hours to download. Defaults to 3.
+            forecast_hrs (list, optional): Forecast hours to download.
+                Defaults to None or download all hours.
+            polls (int, optional): Stop after this number of polls.
+                Defaults to None or poll until stopped with the stop event
+                or a KeyboardInterrupt.
+            stop (threading.Event, optional): Event to stop polling.
+
+        Returns:
+            list: paths of the downloaded files
+        """
+        stop = stop or threading.Event()
+        downloaded = []
+        count = 0
+        failures = 0
+        start_date = None
+
+        self._logger.info('Watching NOMADS every {} seconds'.format(interval))
+
+        try:
+            while not stop.is_set():
+                try:
+                    results = self.latest(latest, forecast_hrs) or []
+                    new_files = [result for result in results if result]
+                    downloaded.extend(new_files)
+                    self._logger.info('Poll {} downloaded {} files'.format(
+                        count + 1, len(new_files)
+                    ))
+                    failures = 0
+
+                except Exception as e:
+                    failures += 1
+                    self._logger.error('Poll {} failed: {}'.format(
+                        count + 1, e
+                    ))
+
+                if start_date is None:
+                    start_date = self.start_date
+
+                count += 1
+                if polls is not None and count >= polls:
+                    break
+
+                wait = interval
+                if failures > 0:
+                    wait = min(
+                        interval * 2 ** failures,
+                        max(interval, self.WATCH_MAX_BACKOFF)
+                    )
+                stop.wait(wait)
+
+        except KeyboardInterrupt:
+            self._logger.info('Stopped watching')
+
+        if start_date is not None:
+            self.set_dates(start_date, self.end_date, forecast_hrs)
+
+        return downloaded
+
     def preprocessing(self, bbox, output_path):
         """Preprocess the downloaded files by cropping and extracting to the
         output_path
@@ -92,6 +186,61 @@ class HRRRNOMADS():
                 verbose=self.verbose
             ).run()
 
+    @contextmanager
+    def pipeline(self, bbox, output_path, workers=CROP_WORKERS):
+        """Crop each file as soon as it is downloaded. Downloads within the
+        context hand the saved files to a pool of wgrib2 workers, so
+        downloading and cropping overlap. Leaving the context waits for all
+        files to be cropped. The cropped files are in cropped_files.
+
+        Example:
+            with hn.pipeline(bbox, output_path):
+                hn.latest(forecast_hrs=[0, 1])
+
+        Args:
+            bbox (list): Bounding box [lon W, lon E, lat S, lat N]
+            output_path (str): directory to put cropped files
+            workers (int, optional): Number of files cropped at the same
+                time. Defaults to CROP_WORKERS.
+        """
+        preprocessor = HRRRPreprocessor(
+            self.output_dir,
+            None,
+            None,
+            output_path,
+            bbox,
+            None,
+            verbose=self.verbose
+        )
+        pool = ThreadPool(processes=workers)
+        crops = []
+
+        def crop(url, result):
+            if result:
+                self._logger.debug('Queue {} for cropping'.format(result))
+                crops.append(pool.apply_async(preprocessor.crop_file, (result,)))
+
+        self.http_retrieval.callback = crop
+        try:
+            yield
+        finally:
+            self.http_retrieval.callback = None
+            pool.close()
+            pool.join()
+
+        self.cropped_files = []
+        for result in crops:
+            try:
+                cropped_file = result.get()
+            except Exception as e:
+                self._logger.warning('Problem cropping file: {}'.format(e))
+                continue
+
+            if cropped_file is not None:
+                self.cropped_files.append(cropped_file)
+
+        self._logger.info('Cropped {} files'.format(len(self.cropped_files)))
+
 
 def main(**kwargs):
 
@@ -99,19 +248,41 @@ def main(**kwargs):
         kwargs['output_dir'],
         kwargs['num_requests'],
         kwargs['overwrite'],
-        kwargs['verbose']
+        kwargs['verbose'],
+        kwargs.get('subset', False),
+        kwargs.get('engine', 'thread'),
+        kwargs.get('rate_limit', None),
+        kwargs.get('adaptive', False),
+        kwargs.get('priority', 'date'),
+        kwargs.get('journal', None)
     )
 
-    if kwargs['start_date'] and kwargs['end_date']:
-        results = hn.date_range(kwargs['start_date'],
-                                kwargs['end_date'],
-                                kwargs['forecast_hrs'])
-    else:
-        results = hn.latest(kwargs['latest'],
+    def download():
+        if kwargs.get('watch', False):
+            return hn.watch(kwargs.get('interval', HRRRNOMADS.WATCH_INTERVAL),
+                            kwargs['latest'],
                             kwargs['forecast_hrs'])
+        elif kwargs['start_date'] and kwargs['end_date']:
+            return hn.date_range(kwargs['start_date'],
+                                 kwargs['end_date'],
+                                 kwargs['forecast_hrs'])
+        else:
+            return hn.latest(kwargs['latest'],
+                             kwargs['forecast_hrs'])
+
+    preprocess = kwargs['bbox'] and kwargs['output_path']
+
+    if preprocess and kwargs.get('pipeline', False):
+        with hn.pipeline(kwargs['bbox'],
+                         kwargs['output_path'],
+                         kwargs.get('workers', HRRRNOMADS.CROP_WORKERS)):
+            results = download()
 
-    if kwargs['bbox'] and kwargs['output_path']:
-        hn.preprocessing(kwargs['bbox'], kwargs['output_path'])
+    else:
+        results = download()
+
+        if preprocess:
+            hn.preprocessing(kwargs['bbox'], kwargs['output_path'])
 
     return results
 
@@ -134,6 +305,7 @@ def parse_args(args):
 
     parser.add_argument('-n', '--num_requests',
                         dest='num_requests',
+                        type=int,
                         default=2,
                         help='Number of concurrent requests, default 2')
 
@@ -181,6 +353,69 @@ def parse_args(args):
                         help="Download and overwrite existing HRRR files",
                         action="store_true")
 
+    parser.add_argument("--subset",
+                        help="Only download the GRIB messages of the surface "
+                             "variables using byte range requests",
+                        action="store_true")
+
+    parser.add_argument("--engine",
+                        dest='engine',
+                        choices=HttpRetrieval.ENGINES,
+                        default='thread',
+                        help="Download with a pool of threads or on an asyncio "
+                             "event loop, default thread")
+
+    parser.add_argument("--rate_limit",
+                        dest='rate_limit',
+                        type=float,
+                        default=None,
+                        help="Maximum number of new requests per second to a "
+                             "host with the async engine")
+
+    parser.add_argument("--pipeline",
+                        help="Crop each file as soon as it is downloaded "
+                             "instead of after all downloads, requires --bbox "
+                             "and -p",
+                        action="store_true")
+
+    parser.add_argument('-w', '--workers',
+                        dest='workers',
+                        type=int,
+                        default=HRRRNOMADS.CROP_WORKERS,
+                        help='Number of files cropped at the same time with '
+                             '--pipeline, default 2')
+
+    parser.add_argument("--watch",
+                        help="Keep running and download new files of the latest "
+                             "hours as soon as they are published",
+                        action="store_true")
+
+    parser.add_argument('-i', '--interval',
+                        dest='interval',
+                        type=float,
+                        default=HRRRNOMADS.WATCH_INTERVAL,
+                        help='Seconds between polls with --watch, default 120')
+
+    parser.add_argument("--adaptive",
+                        help="Adapt the number of concurrent requests to the "
+                             "throughput, starting at NUM_REQUESTS, and back "
+                             "off when throttled",
+                        action="store_true")
+
+    parser.add_argument("--priority",
+                        dest='priority',
+                        choices=HttpRetrieval.PRIORITIES,
+                        default='date',
+                        help="Order of the downloads: oldest or newest "
+                             "initialization first, or critical for forecast "
+                             "hours 1 to 6 newest first, default date")
+
+    parser.add_argument("-j", "--journal",
+                        dest='journal',
+                        default=None,
+                        help="Path of the download journal database to plan "
+                             "from and record the downloads")
+
     return parser.parse_args(args)
 
 
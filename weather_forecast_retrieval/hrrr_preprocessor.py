@@ -6,23 +6,21 @@ import subprocess
 
 import pandas as pd
 
-from weather_forecast_retrieval.data.hrrr import FileHandler
+from weather_forecast_retrieval.data.hrrr import FileHandler, GribInventory
+from weather_forecast_retrieval.scheduler import COMPLETE, JobScheduler
 
 
 class HRRRPreprocessor:
-    VARIABLES = tuple([
-        'TMP:2 m',
-        'RH:2 m',
-        'UGRD:10 m',
-        'VGRD:10 m',
-        'APCP:surface',
-        'DSWRF:surface',
-        'HGT:surface',
-        'TCDC:entire atmosphere'
-    ])
+    VARIABLES = GribInventory.VARIABLES
+
+    # Number of hours cropped at the same time and the number of hours
+    # waiting in the queue for each worker
+    WORKERS = 1
+    QUEUE_SIZE = 2
 
     def __init__(self, hrrr_dir, start_date, end_date, output_dir,
-                 bbox, forecast_hr, ncpu=0, verbose=False):
+                 bbox, forecast_hr, ncpu=None, verbose=False,
+                 workers=WORKERS):
 
         log_level = logging.INFO
         if verbose:
@@ -48,18 +46,28 @@ class HRRRPreprocessor:
         self.lats = bbox[2]
         self.latn = bbox[3]
 
-        # start and end date
+        # start and end date, not needed when only cropping single files
+        # with crop_file
         self.start_date = pd.to_datetime(start_date)
         self.end_date = pd.to_datetime(end_date)
-        self.date_times = pd.date_range(
-            self.start_date, self.end_date, freq='H')
+        self.date_times = pd.DatetimeIndex([])
+        if start_date is not None and end_date is not None:
+            self.date_times = pd.date_range(
+                self.start_date, self.end_date, freq='H')
 
         # forecast number, only do one at a time so multiple can run at once
         self.forecast_hr = forecast_hr
 
         self.variables = [variable for variable in self.VARIABLES]
 
-        # ncpu arg for wgrib2, 0 will default to all available cpu's
+        # hours cropped at the same time by run
+        self.workers = int(workers)
+
+        # ncpu arg for wgrib2, 0 will default to all available cpu's. When
+        # not set, the workers share the cpu's.
+        if ncpu is None:
+            ncpu = 0 if self.workers == 1 else \
+                max(1, (os.cpu_count() or 1) // self.workers)
         self.ncpu = '' if ncpu == 0 else '-ncpu {}'.format(ncpu)
 
         self._logger.info('HRRR directory: {}'.format(self.hrrr_dir))
@@ -71,6 +79,7 @@ class HRRRPreprocessor:
             '{} hours will be processed'.format(len(self.date_times)))
         self._logger.info('Forecast hour: {}'.format(self.forecast_hr))
         self._logger.info('Number of cpu argument: {}'.format(self.ncpu))
+        self._logger.info('Number of workers: {}'.format(self.workers))
 
     def check_for_good_file(self, file_name):
 
@@ -92,7 +101,7 @@ class HRRRPreprocessor:
                     if not self.verbose and bad_flag:
                         break
 
-        if bad_flag:
+        if bad_flag and os.path.exists(file_name):
             self._logger.warning('Removing {}'.format(file_name))
             os.remove(file_name)
 
@@ -132,46 +141,132 @@ class HRRRPreprocessor:
 
             return return_code, output
 
-    def run(self):
+    def crop_file(self, hrrr_file):
+        """Crop a HRRR file to the bounding box and extract the variables.
+        The cropped file is written to the same day folder and file name
+        in the output directory.
 
-        for date_time in self.date_times:
-            self._logger.info('Processing date: {}'.format(date_time))
+        Args:
+            hrrr_file (str): path to the HRRR file in a hrrr.YYYYMMDD folder
 
-            # get the file and path's
-            hrrr_day_dir = FileHandler.folder_name(date_time)
-            hrrr_file_name = FileHandler.file_name(
-                date_time.hour, self.forecast_hr
-            )
-            hrrr_abs_file_path = os.path.join(
-                self.hrrr_dir,
-                hrrr_day_dir,
-                hrrr_file_name
+        Returns:
+            str: path to the cropped file or None if it was not created or
+                 removed by the check
+        """
+        hrrr_day_dir = os.path.basename(os.path.dirname(hrrr_file))
+        new_hrrr_path = os.path.join(
+            self.output_dir,
+            hrrr_day_dir
+        )
+        os.makedirs(new_hrrr_path, exist_ok=True)
+        new_hrrr_file = os.path.join(
+            new_hrrr_path, os.path.basename(hrrr_file)
+        )
+
+        # one command to crop then extract the variables
+        pipe_action = """wgrib2 {} {} -small_grib {}:{} {}:{} - | """ \
+            """wgrib2 - -match '{}' -GRIB {}""".format(
+                hrrr_file,
+                self.ncpu,
+                self.lonw,
+                self.lone,
+                self.lats,
+                self.latn,
+                '|'.join(self.variables),
+                new_hrrr_file
             )
 
-            new_hrrr_path = os.path.join(
-                self.output_dir,
-                hrrr_day_dir
-            )
-            os.makedirs(new_hrrr_path, exist_ok=True)
-            new_hrrr_file = os.path.join(new_hrrr_path, hrrr_file_name)
+        self.call_wgrib2(pipe_action)
 
-            # one command to crop then extract the variables
-            pipe_action = """wgrib2 {} {} -small_grib {}:{} {}:{} - | """ \
-                """wgrib2 - -match '{}' -GRIB {}""".format(
-                    hrrr_abs_file_path,
-                    self.ncpu,
-                    self.lonw,
-                    self.lone,
-                    self.lats,
-                    self.latn,
-                    '|'.join(self.variables),
-                    new_hrrr_file
-                )
+        # Check that the file has been created and is not empty or corrupt
+        self.check_for_good_file(new_hrrr_file)
 
-            self.call_wgrib2(pipe_action)
+        if os.path.exists(new_hrrr_file):
+            return new_hrrr_file
+        return None
 
-            # Check that the file has been created and is not empty or corrupt
-            self.check_for_good_file(new_hrrr_file)
+    def hrrr_file(self, date_time):
+        """Path of the HRRR file of an hour and the forecast hour
+
+        Args:
+            date_time (pandas.Timestamp): hour of the model run
+
+        Returns:
+            str: path to the HRRR file in the hrrr_dir
+        """
+        # get the file and path's
+        hrrr_day_dir = FileHandler.folder_name(date_time)
+        hrrr_file_name = FileHandler.file_name(
+            date_time.hour, self.forecast_hr
+        )
+        return os.path.join(
+            self.hrrr_dir,
+            hrrr_day_dir,
+            hrrr_file_name
+        )
+
+    def process_date(self, date_time):
+        """Crop the HRRR file of an hour
+
+        Args:
+            date_time (pandas.Timestamp): hour of the model run
+
+        Returns:
+            str: path to the cropped file
+
+        Raises:
+            IOError: if the cropped file was not created
+        """
+        self._logger.info('Processing date: {}'.format(date_time))
+
+        hrrr_file = self.hrrr_file(date_time)
+        cropped_file = self.crop_file(hrrr_file)
+        if cropped_file is None:
+            raise IOError('Could not crop {}'.format(hrrr_file))
+
+        return cropped_file
+
+    def run(self):
+        """Crop the files of all hours between the start and end date.
+        The hours are cropped by a pool of workers. At most QUEUE_SIZE
+        hours per worker wait in the queue, so the work is handed out as
+        the workers finish.
+
+        Returns:
+            pandas.DataFrame: status of each hour, indexed by date_time with
+                the columns file, status and error. The status is complete
+                or failed, file the path to the cropped file.
+        """
+        scheduler = JobScheduler(
+            self.workers, max_queued=self.workers * self.QUEUE_SIZE
+        )
+        scheduler.start()
+        jobs = [
+            scheduler.submit(self.process_date, date_time)
+            for date_time in self.date_times
+        ]
+        scheduler.join()
+
+        status = pd.DataFrame(
+            {
+                'file': [job.result for job in jobs],
+                'status': [job.status for job in jobs],
+                'error': [
+                    None if job.error is None else str(job.error)
+                    for job in jobs
+                ],
+            },
+            index=pd.Index(self.date_times, name='date_time'),
+        )
+
+        failed = status[status.status != COMPLETE]
+        for date_time, row in failed.iterrows():
+            self._logger.warning('Failed {}: {}'.format(date_time, row.error))
+        self._logger.info('Processed {} hours, {} failed'.format(
+            len(status), len(failed)
+        ))
+
+        return status
 
 
 def cli():
@@ -205,9 +300,15 @@ def cli():
     parser.add_argument('-f', '--forecast_hr', dest='forecast_hr', type=int,
                         required=True, help='Forecast hour')
 
-    parser.add_argument('-n', '--ncpu', dest='ncpu', type=int, default=0,
-                        help='Number of CPUs for wgrib2, 0 (default) will use '
-                             'all available')
+    parser.add_argument('-n', '--ncpu', dest='ncpu', type=int, default=None,
+                        help='Number of CPUs for wgrib2, 0 will use all '
+                             'available. Default: the available CPUs shared '
+                             'by the workers')
+
+    parser.add_argument('-w', '--workers', dest='workers', type=int,
+                        default=HRRRPreprocessor.WORKERS,
+                        help='Number of hours to crop at the same time, '
+                             'each with a share of the CPUs')
 
     parser.add_argument('--bbox', dest='bbox',
                         type=lambda s: [i for i in s.split(',')],
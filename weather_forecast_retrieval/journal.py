@@ -0,0 +1,485 @@
+"""
+SQLite journal of the downloaded files.
+
+The journal records for every source URL the local file, the size and
+modification time given by the source, the status of the download, a
+checksum of the complete file and the start and end time of the last
+attempt. Retrievals plan from the journal with one query per listing
+instead of checking every output file on disk.
+
+The journal is shared by concurrent runs. A run claims a file with start
+before downloading it, and other runs skip files that are claimed by a
+running process. Claims of a run that stopped are taken over by the next
+run, which resumes the partial file of the download.
+
+The checksum is calculated by a ChecksumValidator while the file is
+downloaded, so recording a download does not read the file again. The
+queries only use SQL of SQLite 3.7 and later.
+"""
+
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from weather_forecast_retrieval import download
+
+QUEUED = 'queued'
+DOWNLOADING = 'downloading'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    url TEXT PRIMARY KEY,
+    out_file TEXT NOT NULL,
+    size INTEGER,
+    remote_size TEXT,
+    modified TEXT,
+    status TEXT NOT NULL,
+    checksum TEXT,
+    owner TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    started REAL,
+    finished REAL,
+    updated REAL NOT NULL
+)
+"""
+
+
+def checksum(file_name, buffer_size=download.BUFFER_SIZE):
+    """
+    SHA-256 checksum of a file
+
+    Args:
+        file_name:   Path of the file
+        buffer_size: Chunk size in bytes to read
+
+    Returns:
+        Hex digest of the checksum
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(buffer_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def open_journal(journal):
+    """
+    Get a journal from a path or an existing journal
+
+    Args:
+        journal: Path of the database, DownloadJournal or None
+
+    Returns:
+        DownloadJournal or None
+    """
+    if journal is None or isinstance(journal, DownloadJournal):
+        return journal
+    return DownloadJournal(journal)
+
+
+class ChecksumValidator:
+    """
+    Validator that calculates the SHA-256 checksum of the content while it
+    is downloaded and passes the content on to another validator. The
+    checksum of valid content is kept by the journal for complete.
+
+    Example:
+        validator = journal.validator(url, GribFramingValidator())
+        download.download_file(url, out_file, validator=validator)
+        journal.complete(url, out_file)
+    """
+
+    def __init__(self, journal, url, validator=None):
+        """
+        Args:
+            journal:   DownloadJournal that records the download
+            url:       Source URL
+            validator: (Optional) Validator of the content
+        """
+        self.journal = journal
+        self.url = url
+        self.validator = validator
+        self._digest = hashlib.sha256()
+
+    def update(self, chunk):
+        self._digest.update(chunk)
+        if self.validator is not None:
+            self.validator.update(chunk)
+
+    def close(self):
+        if self.validator is not None:
+            self.validator.close()
+        self.journal._set_checksum(self.url, self._digest.hexdigest())
+
+
+class DownloadJournal:
+    """
+    Journal of downloads in a SQLite database that can be shared by threads
+    and processes.
+
+    Example:
+        journal = DownloadJournal('/path/to/downloads.sqlite')
+
+        if journal.start(url, out_file, size=size):
+            try:
+                download.download_file(
+                    url, out_file, validator=journal.validator(url)
+                )
+                journal.complete(url)
+            except Exception as e:
+                journal.fail(url, e)
+    """
+
+    # Seconds without an update after which the claim of another process
+    # is taken over
+    STALE = 3600
+    # Seconds to wait for a lock on the database held by another process
+    TIMEOUT = 30
+
+    def __init__(self, path, stale=STALE, timeout=TIMEOUT):
+        """
+        Args:
+            path:    Path of the SQLite database, created if it does not
+                     exist
+            stale:   Seconds after which the claim of another process is
+                     taken over
+            timeout: Seconds to wait for a lock held by another process
+        """
+        self.path = path
+        self.stale = stale
+        self.owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+        self._lock = threading.Lock()
+        self._checksums = {}
+        self._connection = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None,
+            check_same_thread=False
+        )
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    def _transaction(self, *statements):
+        """
+        Execute (query, parameters) statements in one transaction
+        """
+        with self._lock:
+            connection = self._connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                for query, parameters in statements:
+                    connection.execute(query, parameters)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def _set_checksum(self, url, file_checksum):
+        with self._lock:
+            self._checksums[url] = file_checksum
+
+    def _pop_checksum(self, url):
+        with self._lock:
+            return self._checksums.pop(url, None)
+
+    def validator(self, url, validator=None):
+        """
+        Validator that calculates the checksum of a download for complete
+
+        Args:
+            url:       Source URL
+            validator: (Optional) Validator of the content to pass the
+                       content on to
+
+        Returns:
+            ChecksumValidator
+        """
+        if isinstance(validator, ChecksumValidator) and \
+                validator.journal is self and validator.url == url:
+            return validator
+        return ChecksumValidator(self, url, validator)
+
+    def get(self, url):
+        """
+        Journal entry of a url
+
+        Args:
+            url: Source URL
+
+        Returns:
+            sqlite3.Row or None if the url is not in the journal
+        """
+        rows = self._execute('SELECT * FROM downloads WHERE url = ?', (url,))
+        return rows[0] if len(rows) > 0 else None
+
+    def files(self, prefix=''):
+        """
+        All journal entries with a url that starts with the prefix, i.e.
+        the url of a listing
+
+        Args:
+            prefix: (Optional) Start of the urls. Default: all entries
+
+        Returns:
+            Dictionary of sqlite3.Row by url
+        """
+        rows = self._execute(
+            'SELECT * FROM downloads WHERE substr(url, 1, ?) = ?',
+            (len(prefix), prefix)
+        )
+        return {row['url']: row for row in rows}
+
+    def unfinished(self, prefix=''):
+        """
+        Entries that were not downloaded completely
+
+        Args:
+            prefix: (Optional) Start of the urls. Default: all entries
+
+        Returns:
+            List of sqlite3.Row
+        """
+        return [
+            row for row in self.files(prefix).values()
+            if row['status'] != COMPLETE
+        ]
+
+    @staticmethod
+    def is_complete(entry, size=None, modified=None):
+        """
+        Check if a journal entry is a complete download of the remote file
+        with the given size and modification time
+
+        Args:
+            entry:    sqlite3.Row from the journal or None
+            size:     (Optional) Size of the remote file, see
+                      download.size_matches
+            modified: (Optional) Modification time of the remote file
+
+        Returns:
+            True if complete and unchanged
+        """
+        if entry is None or entry['status'] != COMPLETE:
+            return False
+        if modified is not None and entry['modified'] is not None and \
+                entry['modified'] != str(modified):
+            return False
+        if entry['size'] is None:
+            return True
+        if isinstance(size, str) and size.isdigit():
+            size = int(size)
+
+        return download.size_matches(entry['size'], size)
+
+    def _is_claimed(self, entry, now):
+        """Another running process downloads the file"""
+        if entry is None or entry['status'] != DOWNLOADING or \
+                entry['owner'] == self.owner:
+            return False
+        if now - entry['updated'] > self.stale:
+            return False
+
+        # owner on the same host that is not running anymore
+        host, pid = entry['owner'].rsplit(':', 1)
+        if host == socket.gethostname():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return False
+            except OSError:
+                pass
+
+        return True
+
+    def queue(self, url, out_file, size=None, modified=None):
+        """
+        Record a planned download unless the file is being downloaded. The
+        entries of a run that stopped are listed by unfinished.
+
+        Args:
+            url:      Source URL
+            out_file: Path of the local file
+            size:     (Optional) Size of the remote file
+            modified: (Optional) Modification time of the remote file
+        """
+        now = time.time()
+        self._transaction(
+            (
+                """
+                INSERT OR IGNORE INTO downloads (url, out_file, status, updated)
+                VALUES (?, ?, ?, ?)
+                """,
+                (url, out_file, QUEUED, now)
+            ),
+            (
+                """
+                UPDATE downloads SET out_file = ?, remote_size = ?,
+                    modified = ?, status = ?, updated = ?
+                WHERE url = ? AND status != ?
+                """,
+                (out_file, self._text(size), self._text(modified), QUEUED,
+                 now, url, DOWNLOADING)
+            ),
+        )
+
+    def start(self, url, out_file, size=None, modified=None):
+        """
+        Claim a download for this process. The claim fails when another
+        running process downloads the file.
+
+        Args:
+            url:      Source URL
+            out_file: Path of the local file
+            size:     (Optional) Size of the remote file
+            modified: (Optional) Modification time of the remote file
+
+        Returns:
+            True if claimed, False if another process downloads the file
+        """
+        now = time.time()
+
+        with self._lock:
+            connection = self._connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = connection.execute(
+                    'SELECT * FROM downloads WHERE url = ?', (url,)
+                ).fetchall()
+                entry = rows[0] if len(rows) > 0 else None
+
+                if self._is_claimed(entry, now):
+                    connection.execute('ROLLBACK')
+                    return False
+
+                if entry is None:
+                    connection.execute(
+                        """
+                        INSERT INTO downloads
+                            (url, out_file, remote_size, modified, status,
+                             owner, attempts, started, updated)
+                        VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+                        """,
+                        (url, out_file, self._text(size),
+                         self._text(modified), DOWNLOADING, self.owner, now,
+                         now)
+                    )
+                else:
+                    connection.execute(
+                        """
+                        UPDATE downloads SET out_file = ?,
+                            remote_size = coalesce(?, remote_size),
+                            modified = coalesce(?, modified), status = ?,
+                            owner = ?, attempts = attempts + 1,
+                            error = NULL, started = ?, finished = NULL,
+                            updated = ?
+                        WHERE url = ?
+                        """,
+                        (out_file, self._text(size), self._text(modified),
+                         DOWNLOADING, self.owner, now, now, url)
+                    )
+                connection.execute('COMMIT')
+                self._checksums.pop(url, None)
+
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+        return True
+
+    def complete(self, url, out_file=None, file_checksum=True):
+        """
+        Record a complete download with the size and checksum of the file
+
+        Args:
+            url:           Source URL
+            out_file:      (Optional) Path of the local file. Default: the
+                           out_file of the entry
+            file_checksum: (Optional) Checksum of the file, True for the
+                           checksum of the validator of the download or to
+                           calculate it, None to not record one
+        """
+        if out_file is None:
+            out_file = self.get(url)['out_file']
+        if file_checksum is True:
+            file_checksum = self._pop_checksum(url) or checksum(out_file)
+
+        now = time.time()
+        self._transaction(
+            (
+                """
+                INSERT OR IGNORE INTO downloads (url, out_file, status, updated)
+                VALUES (?, ?, ?, ?)
+                """,
+                (url, out_file, COMPLETE, now)
+            ),
+            (
+                """
+                UPDATE downloads SET out_file = ?, size = ?, status = ?,
+                    checksum = ?, owner = ?, error = NULL, finished = ?,
+                    updated = ?
+                WHERE url = ?
+                """,
+                (out_file, os.path.getsize(out_file), COMPLETE,
+                 file_checksum, self.owner, now, now, url)
+            ),
+        )
+
+    def add(self, url, out_file, size=None, modified=None):
+        """
+        Record an existing complete file without downloading it, i.e. files
+        from before the journal was used. No checksum is calculated.
+
+        Args:
+            url:      Source URL
+            out_file: Path of the local file
+            size:     (Optional) Size of the remote file
+            modified: (Optional) Modification time of the remote file
+        """
+        self._execute(
+            """
+            INSERT OR REPLACE INTO downloads
+                (url, out_file, size, remote_size, modified, status, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (url, out_file, os.path.getsize(out_file), self._text(size),
+             self._text(modified), COMPLETE, time.time())
+        )
+
+    def fail(self, url, error=None):
+        """
+        Record a failed download. The partial file is resumed by the next
+        attempt.
+
+        Args:
+            url:   Source URL
+            error: (Optional) Error of the download
+        """
+        self._pop_checksum(url)
+        now = time.time()
+        self._execute(
+            """
+            UPDATE downloads SET status = ?, error = ?, finished = ?,
+                updated = ?
+            WHERE url = ?
+            """,
+            (FAILED, self._text(error), now, now, url)
+        )
+
+    @staticmethod
+    def _text(value):
+        return None if value is None else str(value)
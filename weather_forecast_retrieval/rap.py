@@ -4,11 +4,13 @@ Connect to the RAP Thredds Data Server site and download the data
 
 import logging
 import os
-import threading
-from urllib.request import urlretrieve
+from multiprocessing.pool import ThreadPool
 
 from siphon.catalog import TDSCatalog
 
+from weather_forecast_retrieval import download
+from weather_forecast_retrieval.journal import DownloadJournal, open_journal
+
 
 class RAP():
     """
@@ -36,8 +38,14 @@ class RAP():
     output_dir = '/data/snowpack/forecasts'
     log_file = os.path.join(output_dir, 'rap.log')
     forecast_hours = [0, 1]
+    num_requests = 4
 
-    def __init__(self):
+    def __init__(self, journal=None):
+        """
+        Args:
+            journal: (Optional) DownloadJournal or path of the journal
+                     database to plan from and record the downloads
+        """
         #         # start logging
         #         if 'log_level' in self.config['logging']:
         #             loglevel = self.config['logging']['log_level'].upper()
@@ -66,6 +74,8 @@ class RAP():
         self._loglevel = numeric_level
 
         self._logger = logging.getLogger(__name__)
+        self.journal = open_journal(journal)
+
         self._logger.info('Initialized RAP')
 
     def retrieve_tds(self):
@@ -102,25 +112,68 @@ class RAP():
                     self.output_dir, self.archive_path, lvl, lvl2)
                 self.check_dir(out_path_lvl2)
 
-                # req = []
-                threads = []
+                journal = {}
+                if self.journal is not None:
+                    journal = self.journal.files(
+                        '{}/{}/{}/'.format(opendap_url, lvl, lvl2))
+
+                downloads = []
                 for file_name in c2.datasets:
                     # construct the file name locally
                     file_local = os.path.join(out_path_lvl2, file_name)
                     file_remote = '{}/{}/{}/{}'.format(
                         opendap_url, lvl, lvl2, file_name)
 
-                    # get the file if it doesn't exist
-                    if not os.path.exists(file_local):
+                    # get the file if it is not in the journal or doesn't
+                    # exist
+                    if file_remote in journal:
+                        exists = DownloadJournal.is_complete(
+                            journal[file_remote])
+                    else:
+                        exists = os.path.exists(file_local)
+
+                    if not exists:
                         self._logger.info('Adding {}'.format(file_name))
-                        t = threading.Thread(
-                            target=urlretrieve, args=(file_remote, file_local))
-                        t.start()
-                        threads.append(t)
-#                         u = urlretrieve(file_remote, file_local)
-
-                for t in threads:
-                    t.join()
+                        downloads.append((file_remote, file_local))
+
+                if len(downloads) > 0:
+                    with ThreadPool(self.num_requests) as pool:
+                        pool.starmap(self.download_file, downloads)
+
+    def download_file(self, file_remote, file_local):
+        """
+        Download a file with the shared session that keeps the connections
+        to the TDS alive between files. The download is recorded in the
+        journal.
+
+        Args:
+            file_remote: URL of the file
+            file_local:  Path to save the file to
+        """
+        if self.journal is not None and \
+                not self.journal.start(file_remote, file_local):
+            self._logger.info('{} is downloaded by another run'.format(
+                file_remote))
+            return
+
+        validator = None
+        if self.journal is not None:
+            validator = self.journal.validator(file_remote)
+
+        try:
+            download.download_file(
+                file_remote,
+                file_local,
+                http_session=download.session(self.num_requests),
+                validator=validator
+            )
+            if self.journal is not None:
+                self.journal.complete(file_remote, file_local)
+        except Exception as e:
+            self._logger.error('Failed to download {}: {}'.format(
+                file_remote, e))
+            if self.journal is not None:
+                self.journal.fail(file_remote, e)
 
     def check_dir(self, p):
         if not os.path.isdir(p):
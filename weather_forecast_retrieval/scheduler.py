@@ -0,0 +1,325 @@
+"""
+Run download and processing jobs with a pool of worker threads while
+respecting the blackout windows of the sources.
+
+A source, i.e. the University of Utah archive, can ask not to be
+downloaded from at certain times. Jobs of a source in a blackout window are
+deferred until the window ends. The workers keep running the jobs of other
+sources and local processing jobs, which have no source, in the meantime.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+# Status of a job
+QUEUED = 'queued'
+DEFERRED = 'deferred'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+
+class BlackoutWindow:
+    """
+    Recurring time of the day when a source should not be used. The window
+    is from start_minute to end_minute of each of the hours in the time
+    zone.
+
+    Example:
+        # the last half of every third hour in Mountain Time
+        window = BlackoutWindow(
+            range(0, 24, 3), start_minute=30, timezone='America/Denver'
+        )
+        window.end()
+    """
+
+    def __init__(self, hours, start_minute=0, end_minute=60, timezone='UTC'):
+        """
+        Args:
+            hours:        Hours of the day with a blackout
+            start_minute: First minute of the hour in the blackout
+            end_minute:   Minute of the hour the blackout ends
+            timezone:     Name or pytz time zone of the hours
+        """
+        if not 0 <= start_minute < end_minute <= 60:
+            raise ValueError('Blackout minutes must be within an hour')
+
+        self.hours = set(hours)
+        self.start_minute = start_minute
+        self.end_minute = end_minute
+        if isinstance(timezone, str):
+            timezone = pytz.timezone(timezone)
+        self.timezone = timezone
+
+    def _contains(self, now):
+        return now.hour in self.hours and \
+            self.start_minute <= now.minute < self.end_minute
+
+    def end(self, now=None):
+        """
+        End of the blackout at the given time
+
+        Args:
+            now: (Optional) Time zone aware datetime. Default: now
+
+        Returns:
+            Time zone aware datetime when the blackout ends or None if now
+            is not in a blackout
+        """
+        if now is None:
+            now = datetime.now(pytz.utc)
+        now = now.astimezone(self.timezone)
+
+        if not self._contains(now):
+            return None
+
+        end = now
+        # windows of consecutive hours that end at the full hour join up
+        for _ in range(24):
+            end = self.timezone.normalize(
+                end.replace(minute=0, second=0, microsecond=0) +
+                timedelta(minutes=self.end_minute)
+            )
+            if not self._contains(end):
+                return end
+
+        raise ValueError('Blackout window does not end')
+
+
+class Job:
+    """
+    A function to run by the JobScheduler with its status. The result or
+    error is set once the job finished.
+    """
+
+    def __init__(self, function, args=(), kwargs=None, source=None):
+        """
+        Args:
+            function: Function to run
+            args:     Positional arguments of the function
+            kwargs:   Keyword arguments of the function
+            source:   (Optional) Name of the source the job uses. Jobs
+                      without source are never deferred.
+        """
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.source = source
+
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def run(self):
+        self.status = RUNNING
+        self.started = time.time()
+
+        try:
+            self.result = self.function(*self.args, **self.kwargs)
+            self.status = COMPLETE
+        except Exception as e:
+            self.error = e
+            self.status = FAILED
+
+        self.finished = time.time()
+
+
+class JobScheduler:
+    """
+    Run jobs with a pool of worker threads in the order they were
+    submitted. A job of a source in a blackout window is deferred and the
+    workers run the following jobs of other sources until the window ends.
+
+    Jobs can be submitted before calling run or while the workers run
+    between start and join. With max_queued, submit waits while that many
+    jobs are waiting to run, which bounds the queue of a long list of jobs.
+
+    Example:
+        scheduler = JobScheduler(
+            workers=4, blackouts={'archive': ARCHIVE_BLACKOUT}
+        )
+        scheduler.submit(download_file, url, source='archive')
+        scheduler.submit(preprocess, file_name)
+        jobs = scheduler.run()
+
+        # bounded queue while the workers run
+        scheduler = JobScheduler(workers=4, max_queued=8)
+        scheduler.start()
+        for file_name in file_names:
+            scheduler.submit(preprocess, file_name)
+        jobs = scheduler.join()
+    """
+
+    WORKERS = 1
+
+    def __init__(self, workers=WORKERS, blackouts=None, logger=None,
+                 max_queued=None):
+        """
+        Args:
+            workers:    Number of jobs to run at the same time
+            blackouts:  (Optional) Dictionary of source name to a
+                        BlackoutWindow
+            logger:     (Optional) Logger for deferred sources
+            max_queued: (Optional) Number of waiting jobs at which submit
+                        waits while the workers run. Default: no limit
+        """
+        self.workers = int(workers)
+        self.blackouts = dict(blackouts or {})
+        self.max_queued = max_queued
+        self.jobs = []
+
+        self._logger = logger
+        self._queue = []
+        self._running = 0
+        self._deferred = {}
+        self._threads = []
+        self._closed = True
+        self._condition = threading.Condition()
+
+    def submit(self, function, *args, source=None, **kwargs):
+        """
+        Queue a function to run. Jobs can be submitted while the scheduler
+        runs, i.e. by a running job. Waits for a free place in the queue
+        with max_queued while the workers run, except for running jobs.
+
+        Args:
+            function: Function to run
+            args:     Positional arguments of the function
+            source:   (Optional) Name of the source the job uses
+            kwargs:   Keyword arguments of the function
+
+        Returns:
+            Job
+        """
+        job = Job(function, args, kwargs, source)
+
+        with self._condition:
+            if self.max_queued is not None and \
+                    threading.current_thread() not in self._threads:
+                while not self._closed and \
+                        len(self._queue) >= self.max_queued:
+                    self._condition.wait()
+
+            self.jobs.append(job)
+            self._queue.append(job)
+            self._condition.notify_all()
+
+        return job
+
+    def status(self):
+        """
+        Number of jobs in each status
+
+        Returns:
+            Dictionary of status to number of jobs
+        """
+        counts = {}
+        for job in list(self.jobs):
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def _blackout_ends(self, now):
+        """End of the blackout of each source that is in one"""
+        ends = {}
+        for source, window in self.blackouts.items():
+            end = window.end(now)
+            if end is not None:
+                ends[source] = end
+
+        for source, end in ends.items():
+            if self._deferred.get(source) != end and \
+                    self._logger is not None:
+                self._logger.info('Deferring {} jobs until {}'.format(
+                    source, end
+                ))
+        self._deferred = ends
+
+        return ends
+
+    def _next_job(self):
+        """
+        Wait for the first queued job whose source is not in a blackout
+
+        Returns:
+            Job or None once all jobs are finished
+        """
+        with self._condition:
+            while True:
+                if len(self._queue) == 0:
+                    if self._running == 0 and self._closed:
+                        self._condition.notify_all()
+                        return None
+                    self._condition.wait()
+                    continue
+
+                now = datetime.now(pytz.utc)
+                ends = self._blackout_ends(now)
+
+                for index, job in enumerate(self._queue):
+                    if job.source in ends:
+                        job.status = DEFERRED
+                        continue
+
+                    self._running += 1
+                    self._condition.notify_all()
+                    return self._queue.pop(index)
+
+                wait = min(ends.values()) - now
+                self._condition.wait(max(wait.total_seconds(), 0))
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            job.run()
+
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+
+    def start(self):
+        """
+        Start the workers, which run the jobs until join is called and all
+        jobs are finished
+        """
+        with self._condition:
+            self._closed = False
+            self._threads = [
+                threading.Thread(target=self._work, daemon=True)
+                for _ in range(self.workers)
+            ]
+        for thread in self._threads:
+            thread.start()
+
+    def join(self):
+        """
+        Wait for the workers to finish the queued jobs and the jobs
+        submitted while running
+
+        Returns:
+            List of all submitted jobs
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+        return self.jobs
+
+    def run(self):
+        """
+        Run the queued jobs and the jobs submitted while running
+
+        Returns:
+            List of all submitted jobs
+        """
+        self.start()
+        return self.join()